@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.security import Principal, get_admin_principal
+
+router = APIRouter(prefix="/admin")
+
+
+@router.post("/foods/import")
+def import_food_catalog(
+    file: UploadFile = File(..., description="CSV, or Parquet with pyarrow"),
+    dry_run: bool = Query(False, description="Validate and report only"),
+    thumbnails: bool = Query(True, description="Create thumbnails from image_url"),
+    db: Session = Depends(get_db),
+    current_account: Principal = Depends(get_admin_principal),
+):
+    # Imported here so that importing the app does not load NumPy
+    from app.food_import import FOOD_IMPORT_MAX_BYTES, FoodImportError, import_foods
+
+    data = file.file.read(FOOD_IMPORT_MAX_BYTES + 1)
+    try:
+        return import_foods(
+            db, data, file.filename or "", dry_run=dry_run, thumbnails=thumbnails
+        )
+    except FoodImportError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
@@ -1,22 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException
 
 from app.database import get_db
-from app.models import Account
-from app.security import create_access_token, get_current_account, verify_password
+from app.models import Account, User
+from app.ratelimit import login_rate_limit
+from app.security import (
+    create_account_token,
+    get_current_account,
+    verify_and_update_password,
+)
 
 router = APIRouter()
 
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(login_rate_limit)])
 def login(username: str, password: str, db=Depends(get_db)):
     account = db.query(Account).filter(Account.username == username).first()
     if not account:
         raise HTTPException(status_code=404, detail="Username not found")
-    if not verify_password(password, account.password):
+    verified, new_hash = verify_and_update_password(password, account.password)
+    if not verified:
         raise HTTPException(status_code=401, detail="Incorrect password")
 
-    # Generate JWT token
-    access_token = create_access_token(data={"sub": account.username})
+    # Transparently upgrade hashes made with an outdated cost factor
+    if new_hash:
+        account.password = new_hash
+        db.commit()
+
+    # Generate JWT token carrying the account and user ids
+    user_id = db.query(User.id).filter(User.account_id == account.id).scalar()
+    access_token = create_account_token(account, user_id)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from app.metrics import Counter
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+cache_requests = Counter(
+    "cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+
+
+class Cache:
+    # Values must be JSON-serializable so every backend can store them
+
+    def __init__(self, name: str, ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl
+
+    def _get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._get(key)
+        cache_requests.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        # Stores the value only if the key is absent; returns whether it did
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def hits(self) -> float:
+        return cache_requests.value(cache=self.name, result="hit")
+
+    def misses(self) -> float:
+        return cache_requests.value(cache=self.name, result="miss")
+
+
+class MemoryCache(Cache):
+    # In-process LRU with per-entry expiry
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(name, ttl)
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        return time.monotonic() + ttl if ttl else None
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value: Any, ttl: Optional[float]):
+        self._data[key] = (value, self._expires_at(ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def _get(self, key):
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = (self._lookup(key) or 0) + amount
+            self._store(key, value, None)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache(Cache):
+    # Shared backend for multi-worker / multi-instance deployments; needs the
+    # optional `redis` package
+    def __init__(self, name: str, url: str = REDIS_URL, ttl: Optional[float] = None):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+
+        super().__init__(name, ttl)
+        self.prefix = f"calorties:{name}:"
+        self._client = redis.Redis.from_url(url)
+
+    def _ttl_ms(self, ttl: Optional[float]) -> Optional[int]:
+        ttl = self.ttl if ttl is None else ttl
+        return int(ttl * 1000) if ttl else None
+
+    def _get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def get_many(self, keys):
+        # One round trip for the whole batch
+        if not keys:
+            return []
+        values = [
+            None if raw is None else json.loads(raw)
+            for raw in self._client.mget([self.prefix + key for key in keys])
+        ]
+        for value in values:
+            cache_requests.inc(
+                cache=self.name, result="miss" if value is None else "hit"
+            )
+        return values
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, json.dumps(value), px=self._ttl_ms(ttl))
+
+    def add(self, key, value, ttl=None):
+        return bool(
+            self._client.set(
+                self.prefix + key, json.dumps(value), px=self._ttl_ms(ttl), nx=True
+            )
+        )
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def incr(self, key, amount=1):
+        return self._client.incrby(self.prefix + key, amount)
+
+    def clear(self):
+        keys = list(self._client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self._client.delete(*keys)
+
+
+def create_cache(name: str, maxsize: int = 1024, ttl: Optional[float] = None) -> Cache:
+    if CACHE_BACKEND == "redis":
+        return RedisCache(name, ttl=ttl)
+    return MemoryCache(name, maxsize=maxsize, ttl=ttl)
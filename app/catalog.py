@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Food
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the Food table version; within that window the
+# catalog is served without touching the database
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "30"))
+
+FoodRecord = namedtuple(
+    "FoodRecord", ["id", "name", "type", "jumlah_kalori", "thumbnail"]
+)
+
+
+def _serialize(records: List[FoodRecord]) -> Tuple[bytes, str]:
+    body = json.dumps(
+        {"foods": [record._asdict() for record in records]}, separators=(",", ":")
+    ).encode()
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+# GET /foods for a type no food has
+EMPTY_BODY = _serialize([])
+
+
+class FoodCatalog:
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._by_id: Dict[int, FoodRecord] = {}
+        self._by_type: Dict[Optional[str], List[FoodRecord]] = {}
+        self._serialized: Dict[Optional[str], Tuple[bytes, str]] = {}
+
+    def _current_version(self, db: Session) -> Tuple:
+        # Row count catches inserts and deletes, max(updated_at) catches edits
+        count, updated_at = db.query(
+            func.count(Food.id), func.max(Food.updated_at)
+        ).one()
+        return (count, str(updated_at))
+
+    def _load(self, db: Session, version: Tuple):
+        rows = db.query(
+            Food.id, Food.name, Food.type, Food.jumlah_kalori, Food.thumbnail
+        ).order_by(Food.id)
+        by_id = {}
+        by_type: Dict[Optional[str], List[FoodRecord]] = {}
+        for row in rows:
+            record = FoodRecord(*row)
+            by_id[record.id] = record
+            by_type.setdefault(record.type, []).append(record)
+
+        self._by_id = by_id
+        self._by_type = by_type
+        self._serialized = {}
+        self._version = version
+
+    def refresh(self, db: Session, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._version and now - self._checked_at < self.ttl:
+                return
+            version = self._current_version(db)
+            if force or version != self._version:
+                self._load(db, version)
+            self._checked_at = now
+
+    def invalidate(self):
+        # Forces a version check on the next read
+        with self._lock:
+            self._checked_at = 0.0
+
+    def get(self, db: Session, food_id: int) -> Optional[FoodRecord]:
+        self.refresh(db)
+        record = self._by_id.get(food_id)
+        if record is None:
+            # The food may have been added since the last version check
+            self.invalidate()
+            self.refresh(db)
+            record = self._by_id.get(food_id)
+        return record
+
+    def _foods(self, type: Optional[str]) -> List[FoodRecord]:
+        if type:
+            return list(self._by_type.get(type, ()))
+        return list(self._by_id.values())
+
+    def foods(self, db: Session, type: Optional[str] = None) -> List[FoodRecord]:
+        self.refresh(db)
+        return self._foods(type)
+
+    def serialized(self, db: Session, type: Optional[str] = None) -> Tuple[bytes, str]:
+        # JSON body of GET /foods for the type filter and its ETag, built once
+        # per catalog version
+        self.refresh(db)
+        key = type or None
+        if key is not None and key not in self._by_type:
+            # Only known types are cached, so made-up filters cannot grow it
+            return EMPTY_BODY
+        cached = self._serialized.get(key)
+        if cached is None:
+            cached = self._serialized[key] = _serialize(self._foods(key))
+        return cached
+
+
+def preload_catalog(db: Session):
+    try:
+        food_catalog.refresh(db, force=True)
+    except Exception:
+        # The catalog loads lazily on first use instead
+        logger.exception("Could not preload the food catalog")
+
+
+food_catalog = FoodCatalog()
@@ -1,19 +1,273 @@
+import itertools
+import logging
 import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app.cache import create_cache
+from app.instrumentation import instrument_sql
+from app.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
 
 USERNAME = os.getenv("DB_USERNAME")
 PASSWORD = os.getenv("DB_PASSWORD")
 HOST = os.getenv("DB_HOST")
 PORT = os.getenv("DB_PORT")
+# e.g. "mysqldb" for the C driver; mysqlconnector is the pure-Python default
+DRIVER = os.getenv("DB_DRIVER", "mysqlconnector")
+# e.g. "aiomysql" or "asyncmy"; enables the async engine and get_async_db,
+# which GET /calories reads through on the event loop
+ASYNC_DRIVER = os.getenv("DB_ASYNC_DRIVER")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Comma-separated replica hosts ("host" or "host:port") sharing the primary's
+# credentials and schema, or full URLs in DB_REPLICA_URLS
+DB_REPLICA_HOSTS = os.getenv("DB_REPLICA_HOSTS", "")
+DB_REPLICA_URLS = os.getenv("DB_REPLICA_URLS", "")
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "10"))
+# Reads of an account that wrote within this many seconds go to the primary
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# DATABASE_URL overrides the MySQL settings above, e.g. for a local database
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or (
+    f"mysql+{DRIVER}://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/db-calorie-tracking"
+)
+
+pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    ["engine"],
+)
+read_routes = Counter(
+    "db_read_routes_total", "Read sessions by target engine", ["engine"]
+)
+pool_connections = Gauge(
+    "db_pool_connections", "Pooled connections by engine and state", ["engine", "state"]
+)
+
+_pools: Dict[str, QueuePool] = {}
+
+
+class InstrumentedQueuePool(QueuePool):
+    # Records how long each checkout waits for a free (or new) connection
+    engine_name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.observe(
+                time.perf_counter() - start, engine=self.engine_name
+            )
+
+    def recreate(self):
+        pool = super().recreate()
+        _register_pool(pool, self.engine_name)
+        return pool
+
+
+def _register_pool(pool: InstrumentedQueuePool, name: str):
+    pool.engine_name = name
+    _pools[name] = pool
+
+
+def _pool_states() -> Dict[Tuple[str, str], float]:
+    states = {}
+    for name, pool in _pools.items():
+        states[(name, "in_use")] = pool.checkedout()
+        states[(name, "idle")] = pool.checkedin()
+        states[(name, "overflow")] = max(pool.overflow(), 0)
+    return states
+
+
+pool_connections.set_function(_pool_states)
+instrument_sql()
+
+
+def _create_engine(url: str, name: str = "primary"):
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_engine(url, connect_args={"check_same_thread": False})
+
+    engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    _register_pool(engine.pool, name)
+    return engine
+
+
+# The primary engine is created on first use, so importing the app does not
+# load the database driver
+engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    global engine
+    if engine is None:
+        with _engine_lock:
+            if engine is None:
+                engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+    return engine
+
 
-SQLALCHEMY_DATABASE_URL = (
-    f"mysql+mysqlconnector://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/db-calorie-tracking"
+class LazySession(Session):
+    # Sessions without an explicit bind use the primary engine
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+SessionLocal = sessionmaker(class_=LazySession, autocommit=False, autoflush=False)
+
+# The async engine is created on first use too, and only with DB_ASYNC_DRIVER.
+# It connects to the primary; replicas are only used by the sync sessions.
+async_engine = None
+AsyncSessionLocal = None
+_async_engine_lock = threading.Lock()
+
+
+def get_async_sessionmaker():
+    global async_engine, AsyncSessionLocal
+    if AsyncSessionLocal is None:
+        with _async_engine_lock:
+            if AsyncSessionLocal is None:
+                from sqlalchemy.ext.asyncio import (
+                    async_sessionmaker,
+                    create_async_engine,
+                )
+
+                url = make_url(SQLALCHEMY_DATABASE_URL)
+                url = url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVER}")
+                options = {}
+                if url.get_backend_name() != "sqlite":
+                    options = dict(
+                        pool_size=DB_POOL_SIZE,
+                        max_overflow=DB_MAX_OVERFLOW,
+                        pool_timeout=DB_POOL_TIMEOUT,
+                        pool_recycle=DB_POOL_RECYCLE,
+                        pool_pre_ping=DB_POOL_PRE_PING,
+                    )
+                async_engine = create_async_engine(url, **options)
+                AsyncSessionLocal = async_sessionmaker(
+                    async_engine, autoflush=False, expire_on_commit=False
+                )
+    return AsyncSessionLocal
+
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+class Replica:
+    def __init__(self, name: str, url):
+        self.name = name
+        self.url = url
+        self.healthy = True
+        self.checked_at = 0.0
+        self._engine: Optional[Engine] = None
+        self._engine_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self) -> Engine:
+        # Created on first use, like the primary
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    self._engine = _create_engine(self.url, self.name)
+        return self._engine
+
+    def is_healthy(self, interval: float) -> bool:
+        # Re-checked at most once per interval, by whichever request gets the
+        # lock first; the others use the last known state
+        if time.monotonic() - self.checked_at < interval:
+            return self.healthy
+        if not self._lock.acquire(blocking=False):
+            return self.healthy
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            self.healthy = True
+        except Exception:
+            if self.healthy:
+                logger.warning("Read replica %s failed its health check", self.name)
+            self.healthy = False
+        finally:
+            self.checked_at = time.monotonic()
+            self._lock.release()
+        return self.healthy
+
+
+def _replica_urls() -> List[str]:
+    urls = [url.strip() for url in DB_REPLICA_URLS.split(",") if url.strip()]
+    primary_url = make_url(SQLALCHEMY_DATABASE_URL)
+    for host in [host.strip() for host in DB_REPLICA_HOSTS.split(",") if host]:
+        name, _, port = host.partition(":")
+        urls.append(
+            primary_url.set(host=name, port=int(port) if port else primary_url.port)
+        )
+    return urls
+
+
+replicas = [Replica(f"replica{i}", url) for i, url in enumerate(_replica_urls())]
+_replica_cycle = itertools.cycle(replicas) if replicas else None
+
+# Shared across workers when CACHE_BACKEND=redis
+recent_writes = create_cache(
+    "recent-writes", maxsize=100000, ttl=DB_READ_YOUR_WRITES_SECONDS
 )
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def mark_write(account_id: int):
+    # Call after committing a write on behalf of an account
+    if replicas:
+        recent_writes.set(str(account_id), 1)
+
+
+def read_engine(account_id: Optional[int] = None) -> Engine:
+    # Round-robin over healthy replicas, falling back to the primary; accounts
+    # that just wrote read from the primary to see their own writes
+    if not replicas:
+        return get_engine()
+    if account_id is not None and recent_writes.get(str(account_id)):
+        read_routes.inc(engine="primary")
+        return get_engine()
+    for _ in range(len(replicas)):
+        replica = next(_replica_cycle)
+        if replica.is_healthy(DB_REPLICA_HEALTH_INTERVAL):
+            read_routes.inc(engine=replica.name)
+            return replica.engine
+    read_routes.inc(engine="primary")
+    return get_engine()
+
+
+def read_session(account_id: Optional[int] = None):
+    db = SessionLocal(bind=read_engine(account_id))
+    try:
+        yield db
+    finally:
+        db.close()
 
 
 def get_db():
@@ -22,3 +276,13 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    # An AsyncSession with DB_ASYNC_DRIVER, else None, in which case the route
+    # falls back to its sync session
+    if not ASYNC_DRIVER:
+        yield None
+        return
+    async with get_async_sessionmaker()() as db:
+        yield db
@@ -0,0 +1,376 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.orm import Session
+
+from app.catalog import food_catalog
+from app.database import SessionLocal
+from app.gcs import get_storage
+from app.imaging import (
+    CONTENT_TYPES,
+    EXTENSIONS,
+    IMAGE_FORMAT,
+    IMAGE_MAX_BYTES,
+    ImageError,
+    get_executor,
+    transform_image,
+)
+from app.models import Food
+
+# Rows written per transaction
+FOOD_IMPORT_BATCH_SIZE = int(os.getenv("FOOD_IMPORT_BATCH_SIZE", "1000"))
+FOOD_IMPORT_MAX_BYTES = int(os.getenv("FOOD_IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Concurrent image downloads while precomputing thumbnails
+FOOD_IMPORT_THUMBNAIL_WORKERS = int(os.getenv("FOOD_IMPORT_THUMBNAIL_WORKERS", "8"))
+FOOD_IMPORT_FETCH_TIMEOUT = float(os.getenv("FOOD_IMPORT_FETCH_TIMEOUT", "10"))
+
+REQUIRED_COLUMNS = ("name", "type", "jumlah_kalori")
+# Optional source photo for the food, turned into its catalog thumbnail
+IMAGE_COLUMN = "image_url"
+MAX_TEXT_LENGTH = 255
+MAX_KALORI = 2**31 - 1
+# Row errors returned in the report; the counts cover all of them
+MAX_REPORTED_ERRORS = 100
+
+
+class FoodImportError(Exception):
+    pass
+
+
+def read_csv(data: bytes) -> Dict[str, np.ndarray]:
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise FoodImportError("CSV file must be UTF-8")
+    reader = csv.reader(io.StringIO(text))
+    header = [name.strip().lower() for name in next(reader, [])]
+    rows = list(reader)
+    columns = {}
+    for index, name in enumerate(header):
+        columns[name] = np.array(
+            [row[index] if index < len(row) else "" for row in rows], dtype=str
+        )
+    return columns
+
+
+def read_parquet(data: bytes) -> Dict[str, np.ndarray]:
+    try:
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise FoodImportError("Parquet import requires the pyarrow package")
+
+    try:
+        table = parquet.read_table(BytesIO(data))
+    except Exception as exc:
+        raise FoodImportError(f"Invalid Parquet file: {exc}")
+    return {
+        name.strip().lower(): np.array(
+            ["" if value is None else str(value) for value in column.to_pylist()],
+            dtype=str,
+        )
+        for name, column in zip(table.column_names, table.columns)
+    }
+
+
+def read_file(data: bytes, filename: str) -> Dict[str, np.ndarray]:
+    if len(data) > FOOD_IMPORT_MAX_BYTES:
+        raise FoodImportError(f"File is larger than {FOOD_IMPORT_MAX_BYTES} bytes")
+    if filename.lower().endswith(".parquet"):
+        return read_parquet(data)
+    return read_csv(data)
+
+
+class ValidatedFoods:
+    # Columns of the rows that passed validation, deduplicated by name, with
+    # the (1-based) row number each came from
+    def __init__(
+        self,
+        rows: np.ndarray,
+        names: np.ndarray,
+        types: np.ndarray,
+        kalori: np.ndarray,
+        image_urls: np.ndarray,
+    ):
+        self.rows = rows
+        self.names = names
+        self.types = types
+        self.kalori = kalori
+        self.image_urls = image_urls
+
+
+def validate(
+    columns: Dict[str, np.ndarray]
+) -> Tuple[ValidatedFoods, List[dict], int, int]:
+    # Checks every column at once with array operations instead of row by
+    # row. Returns the valid rows, the row errors, the number of rows read and
+    # the number of duplicates dropped
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise FoodImportError(f"Missing columns: {', '.join(missing)}")
+
+    names = np.char.strip(columns["name"])
+    types = np.char.lower(np.char.strip(columns["type"]))
+    kalori_text = np.char.strip(columns["jumlah_kalori"])
+    image_urls = np.char.strip(columns.get(IMAGE_COLUMN, np.full(len(names), "")))
+    total = len(names)
+
+    # Whole, non-negative numbers; "120.0" from spreadsheet exports is fine.
+    # isdigit also accepts digits float() cannot parse, such as "²", so the
+    # text must be ASCII too: its UTF-8 encoding is then no longer than it is
+    numeric = np.char.isdigit(np.char.replace(kalori_text, ".", "", 1)) & (
+        np.char.str_len(np.char.encode(kalori_text, "utf-8"))
+        == np.char.str_len(kalori_text)
+    )
+    kalori = np.zeros(total)
+    kalori[numeric] = kalori_text[numeric].astype(float)
+    checks = [
+        (np.char.str_len(names) == 0, "name is required"),
+        (np.char.str_len(names) > MAX_TEXT_LENGTH, "name is too long"),
+        (np.char.str_len(types) == 0, "type is required"),
+        (np.char.str_len(types) > MAX_TEXT_LENGTH, "type is too long"),
+        (~numeric, "jumlah_kalori must be a non-negative number"),
+        (numeric & (kalori != np.floor(kalori)), "jumlah_kalori must be whole"),
+        (kalori > MAX_KALORI, "jumlah_kalori is too large"),
+        (
+            (np.char.str_len(image_urls) > 0)
+            & ~np.char.startswith(image_urls, "http://")
+            & ~np.char.startswith(image_urls, "https://"),
+            "image_url must be an http(s) URL",
+        ),
+    ]
+
+    invalid = np.zeros(total, dtype=bool)
+    errors = []
+    for failed, message in checks:
+        invalid |= failed
+        errors.extend(
+            {"row": int(row) + 1, "error": message} for row in np.flatnonzero(failed)
+        )
+    errors.sort(key=lambda error: error["row"])
+
+    # Within the file the last row for a name wins; names match case-insensitively
+    valid = np.flatnonzero(~invalid)
+    keys = np.char.lower(names[valid])
+    _, last_from_end = np.unique(keys[::-1], return_index=True)
+    keep = np.sort(valid[len(valid) - 1 - last_from_end])
+    duplicates = len(valid) - len(keep)
+
+    foods = ValidatedFoods(
+        keep + 1,
+        names[keep],
+        types[keep],
+        kalori[keep].astype(np.int64),
+        image_urls[keep],
+    )
+    return foods, errors, total, duplicates
+
+
+def _thumbnail(session, image_url: str) -> str:
+    response = session.get(image_url, timeout=FOOD_IMPORT_FETCH_TIMEOUT)
+    response.raise_for_status()
+    data = response.content
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ImageError(f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+
+    # Named after the source image, so re-importing the same photo overwrites
+    # its thumbnail instead of adding another one
+    _, thumbnail, _, _ = get_executor().submit(transform_image, data).result()
+    digest = hashlib.sha1(data).hexdigest()
+    return get_storage().upload(
+        BytesIO(thumbnail),
+        f"food_thumbnails/{digest}_thumb.{EXTENSIONS[IMAGE_FORMAT]}",
+        CONTENT_TYPES[IMAGE_FORMAT],
+    )
+
+
+def precompute_thumbnails(
+    foods: ValidatedFoods,
+) -> Tuple[Dict[int, str], List[dict]]:
+    # Downloads, resizes and uploads the thumbnails before any row is written,
+    # so no transaction stays open across network calls. Returns the
+    # thumbnail URL by index into `foods`, and the failures as row errors
+    indices = np.flatnonzero(np.char.str_len(foods.image_urls) > 0)
+    thumbnails: Dict[int, str] = {}
+    errors = []
+    if not len(indices):
+        return thumbnails, errors
+
+    import requests
+
+    session = requests.Session()
+    with ThreadPoolExecutor(max_workers=FOOD_IMPORT_THUMBNAIL_WORKERS) as pool:
+        futures = {
+            int(index): pool.submit(_thumbnail, session, str(foods.image_urls[index]))
+            for index in indices
+        }
+        for index, future in futures.items():
+            try:
+                thumbnails[index] = future.result()
+            except (requests.RequestException, ImageError, OSError) as exc:
+                errors.append(
+                    {
+                        "row": int(foods.rows[index]),
+                        "error": f"thumbnail not created: {exc}",
+                    }
+                )
+    return thumbnails, errors
+
+
+def _existing_foods(db: Session) -> Dict[str, tuple]:
+    # Catalog rows by lower-cased name; the oldest row wins if names repeat
+    rows = db.query(
+        Food.id,
+        Food.name,
+        Food.type,
+        Food.jumlah_kalori,
+        Food.thumbnail,
+        Food.deleted_at,
+    ).order_by(Food.id.desc())
+    return {row.name.lower(): tuple(row) for row in rows}
+
+
+def _write_batches(db: Session, statement, rows: List[dict]):
+    for start in range(0, len(rows), FOOD_IMPORT_BATCH_SIZE):
+        stop = start + FOOD_IMPORT_BATCH_SIZE
+        db.execute(statement, rows[start:stop])
+        db.commit()
+
+
+def import_foods(
+    db: Session,
+    data: bytes,
+    filename: str = "foods.csv",
+    dry_run: bool = False,
+    thumbnails: bool = True,
+) -> dict:
+    # Validates a CSV or Parquet catalog file and upserts it into Food by
+    # name: new names are inserted, changed rows updated (restoring deleted
+    # ones) and identical rows left alone
+    foods, errors, total, duplicates = validate(read_file(data, filename))
+
+    thumbnail_urls: Dict[int, str] = {}
+    if thumbnails and not dry_run:
+        thumbnail_urls, thumbnail_errors = precompute_thumbnails(foods)
+        errors = sorted(errors + thumbnail_errors, key=lambda error: error["row"])
+
+    existing = _existing_foods(db)
+    inserts = []
+    updates = []
+    unchanged = 0
+    for index, (name, type, kalori) in enumerate(
+        zip(foods.names.tolist(), foods.types.tolist(), foods.kalori.tolist())
+    ):
+        current = existing.get(name.lower())
+        thumbnail = thumbnail_urls.get(index)
+        if current is None:
+            inserts.append(
+                {
+                    "name": name,
+                    "type": type,
+                    "jumlah_kalori": kalori,
+                    "thumbnail": thumbnail,
+                }
+            )
+            continue
+        (
+            food_id,
+            _,
+            current_type,
+            current_kalori,
+            current_thumbnail,
+            deleted_at,
+        ) = current
+        thumbnail = thumbnail or current_thumbnail
+        if (type, kalori, thumbnail, deleted_at) == (
+            current_type,
+            current_kalori,
+            current_thumbnail,
+            None,
+        ):
+            unchanged += 1
+            continue
+        updates.append(
+            {
+                "b_id": food_id,
+                "type": type,
+                "jumlah_kalori": kalori,
+                "thumbnail": thumbnail,
+            }
+        )
+
+    if not dry_run:
+        # Core statements: executemany without the ORM's per-object bookkeeping
+        foods_table = Food.__table__
+        _write_batches(db, insert(foods_table), inserts)
+        _write_batches(
+            db,
+            update(foods_table)
+            .where(foods_table.c.id == bindparam("b_id"))
+            .values(
+                type=bindparam("type"),
+                jumlah_kalori=bindparam("jumlah_kalori"),
+                thumbnail=bindparam("thumbnail"),
+                deleted_at=None,
+                updated_at=func.current_timestamp(),
+            ),
+            updates,
+        )
+        if inserts or updates:
+            food_catalog.invalidate()
+
+    return {
+        "rows": total,
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "unchanged": unchanged,
+        "duplicates": duplicates,
+        "invalid": total - len(foods.rows) - duplicates,
+        "thumbnails": len(thumbnail_urls),
+        "dry_run": dry_run,
+        "errors": errors[:MAX_REPORTED_ERRORS],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.food_import",
+        description="Load or update the Food catalog from a CSV or Parquet file",
+    )
+    parser.add_argument("path", help="CSV file, or .parquet with pyarrow installed")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Validate and report, write nothing"
+    )
+    parser.add_argument(
+        "--no-thumbnails", action="store_true", help="Ignore the image_url column"
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.path, "rb") as file:
+        data = file.read()
+    db = SessionLocal()
+    try:
+        report = import_foods(
+            db,
+            data,
+            os.path.basename(args.path),
+            dry_run=args.dry_run,
+            thumbnails=not args.no_thumbnails,
+        )
+    except FoodImportError as exc:
+        parser.exit(1, f"{exc}\n")
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
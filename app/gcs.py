@@ -1,21 +1,207 @@
+import os
+import shutil
+import threading
+import time
+from io import BytesIO
+from typing import BinaryIO, Optional
+
 from fastapi import UploadFile
-from google.cloud import storage
+from starlette.concurrency import run_in_threadpool
 
+from app.imaging import ProcessedImage
+from app.instrumentation import outbound
+from app.metrics import Counter, Histogram
 
-def upload_to_gcs(file: UploadFile, filename) -> str:
-    # Create a GCS client
-    key_path = ".gcs-client.json"
-    client = storage.Client.from_service_account_json(key_path)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+GCS_KEY_PATH = os.getenv("GCS_KEY_PATH", ".gcs-client.json")
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "calorties")
+GCS_POOL_SIZE = int(os.getenv("GCS_POOL_SIZE", "32"))
+# Uploads above the threshold are streamed as resumable uploads in chunks of
+# GCS_CHUNK_SIZE bytes (must be a multiple of 256 KiB)
+GCS_CHUNK_SIZE = int(os.getenv("GCS_CHUNK_SIZE", str(4 * 1024 * 1024)))
+GCS_RESUMABLE_THRESHOLD = int(
+    os.getenv("GCS_RESUMABLE_THRESHOLD", str(4 * 1024 * 1024))
+)
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", ".storage")
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL")
+
+upload_seconds = Histogram(
+    "storage_upload_seconds", "Time spent uploading an object", ["backend"]
+)
+upload_bytes = Counter(
+    "storage_upload_bytes_total", "Bytes uploaded to object storage", ["backend"]
+)
+upload_errors = Counter(
+    "storage_upload_errors_total", "Failed object storage uploads", ["backend"]
+)
+
+
+def _fileobj_size(fileobj: BinaryIO) -> Optional[int]:
+    # Remaining bytes from the current position, if the file is seekable
+    try:
+        position = fileobj.tell()
+        size = fileobj.seek(0, os.SEEK_END) - position
+        fileobj.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class Storage:
+    name = "storage"
+
+    def _upload(
+        self, fileobj: BinaryIO, filename: str, content_type: Optional[str]
+    ) -> str:
+        raise NotImplementedError
+
+    def upload(
+        self, fileobj: BinaryIO, filename: str, content_type: Optional[str] = None
+    ) -> str:
+        size = _fileobj_size(fileobj)
+        start = time.perf_counter()
+        try:
+            with outbound("storage"):
+                url = self._upload(fileobj, filename, content_type)
+        except Exception:
+            upload_errors.inc(backend=self.name)
+            raise
+        upload_seconds.observe(time.perf_counter() - start, backend=self.name)
+        upload_bytes.inc(size or 0, backend=self.name)
+        return url
+
+    async def upload_async(
+        self, fileobj: BinaryIO, filename: str, content_type: Optional[str] = None
+    ) -> str:
+        return await run_in_threadpool(self.upload, fileobj, filename, content_type)
+
+
+class GCSStorage(Storage):
+    name = "gcs"
+
+    def __init__(
+        self,
+        bucket_name: str = GCS_BUCKET_NAME,
+        key_path: str = GCS_KEY_PATH,
+        pool_size: int = GCS_POOL_SIZE,
+        chunk_size: int = GCS_CHUNK_SIZE,
+        resumable_threshold: int = GCS_RESUMABLE_THRESHOLD,
+    ):
+        self.bucket_name = bucket_name
+        self.key_path = key_path
+        self.pool_size = pool_size
+        self.chunk_size = chunk_size
+        self.resumable_threshold = resumable_threshold
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _create_bucket(self):
+        # The Google client libraries take a noticeable part of a cold start to
+        # import, so they are loaded with the first upload (or the warm-up)
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import storage
+        from google.oauth2 import service_account
+        from requests.adapters import HTTPAdapter
+
+        credentials = service_account.Credentials.from_service_account_file(
+            self.key_path, scopes=storage.Client.SCOPE
+        )
+
+        # One authorized session per process, with a connection pool sized for
+        # the number of concurrent uploads
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size
+        )
+        session.mount("https://", adapter)
+
+        client = storage.Client(
+            project=credentials.project_id, credentials=credentials, _http=session
+        )
+        return client.bucket(self.bucket_name)
 
-    # Set up GCS bucket and filename
-    bucket_name = "calorties"
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    self._bucket = self._create_bucket()
+        return self._bucket
 
-    # Upload the file to GCS
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(filename)
-    blob.upload_from_file(file.file, content_type=file.content_type)
+    def _upload(self, fileobj, filename, content_type):
+        size = _fileobj_size(fileobj)
+        chunk_size = None
+        if size is None or size > self.resumable_threshold:
+            chunk_size = self.chunk_size
+
+        blob = self.bucket.blob(filename, chunk_size=chunk_size)
+        blob.upload_from_file(fileobj, content_type=content_type, size=size)
+
+        # Get the public URL of the uploaded file
+        return blob.public_url
+
+
+class LocalStorage(Storage):
+    name = "local"
+
+    def __init__(
+        self,
+        directory: str = LOCAL_STORAGE_DIR,
+        base_url: Optional[str] = LOCAL_STORAGE_BASE_URL,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.base_url = (base_url or f"file://{self.directory}").rstrip("/")
+
+    def _upload(self, fileobj, filename, content_type):
+        path = os.path.join(self.directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, 1024 * 1024)
+        return f"{self.base_url}/{filename}"
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == "local":
+                    _storage = LocalStorage()
+                else:
+                    _storage = GCSStorage()
+    return _storage
+
+
+def set_storage(backend: Storage):
+    global _storage
+    _storage = backend
+
+
+def upload_fileobj_to_gcs(
+    fileobj: BinaryIO, filename: str, content_type: Optional[str] = None
+) -> str:
+    return get_storage().upload(fileobj, filename, content_type)
+
+
+def upload_to_gcs(file: UploadFile, filename) -> str:
+    return upload_fileobj_to_gcs(file.file, filename, file.content_type)
 
-    # Get the public URL of the uploaded file
-    image_url = blob.public_url
 
-    return image_url
+def upload_processed_image(processed: ProcessedImage, basename: str) -> str:
+    # Stores the downscaled image plus its display thumbnail next to it and
+    # returns the public URL of the image
+    storage_backend = get_storage()
+    storage_backend.upload(
+        BytesIO(processed.thumbnail),
+        f"{basename}_thumb.{processed.extension}",
+        processed.content_type,
+    )
+    return storage_backend.upload(
+        BytesIO(processed.image),
+        f"{basename}.{processed.extension}",
+        processed.content_type,
+    )
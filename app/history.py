@@ -0,0 +1,68 @@
+from datetime import date
+from typing import TYPE_CHECKING, Iterable, Tuple
+
+# NumPy is imported where it is used, so importing the app does not load it
+if TYPE_CHECKING:
+    import numpy as np
+
+# Harris-Benedict coefficients: base, per kg, per cm, per year of age
+HARRIS_BENEDICT = {
+    "male": (66.5, 13.75, 5.003, 6.75),
+    "female": (655.1, 9.563, 1.85, 4.676),
+}
+
+
+def harris_benedict(gender: str, weight: float, height: float, age):
+    # Daily calorie target for the user; `age` may be a number or an array of
+    # ages, one per day
+    coefficients = HARRIS_BENEDICT.get((gender or "").lower())
+    if coefficients is None:
+        # No target for other genders; keeps the shape of `age`
+        return age * 0.0
+    base, per_kg, per_cm, per_year = coefficients
+    return base + (per_kg * weight) + (per_cm * height) - (per_year * age)
+
+
+def date_range(start: date, end: date) -> "np.ndarray":
+    # Every day from start to end inclusive, as datetime64[D]
+    import numpy as np
+
+    return np.arange(
+        np.datetime64(start, "D"), np.datetime64(end, "D") + 1, dtype="datetime64[D]"
+    )
+
+
+def daily_totals(
+    rows: Iterable[Tuple[date, float]], start: date, end: date
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    # Scatters (day, total) rows into a zero-filled series covering every day
+    # of the range
+    import numpy as np
+
+    days = date_range(start, end)
+    totals = np.zeros(len(days))
+    rows = list(rows)
+    if rows:
+        row_days = np.array([row[0] for row in rows], dtype="datetime64[D]")
+        offsets = (row_days - days[0]).astype(np.int64)
+        totals[offsets] = np.array([row[1] for row in rows], dtype=float)
+    return days, totals
+
+
+def moving_average(values: "np.ndarray", window: int) -> "np.ndarray":
+    # Trailing mean over `window` days; the first days average what is there
+    import numpy as np
+
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def ages(birthdate: date, days: "np.ndarray") -> "np.ndarray":
+    # Age in whole years on each day, with the same leap year approximation
+    # as the daily summary
+    import numpy as np
+
+    elapsed = (days - np.datetime64(birthdate, "D")).astype(np.int64)
+    return np.floor(elapsed / 365.2425)
@@ -0,0 +1,99 @@
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+
+from app.cache import Cache, create_cache
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# How long a completed response is replayed for a retried key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# How long a request holds its key before a retry may take over, in case the
+# process dies mid-request
+IDEMPOTENCY_LOCK_TTL = float(os.getenv("IDEMPOTENCY_LOCK_TTL", "120"))
+
+PENDING = "pending"
+COMPLETED = "completed"
+
+
+def fingerprint(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    # Remembers the response to each (account, Idempotency-Key) so a retried
+    # request gets the original response instead of being executed again. A
+    # key is claimed atomically (cache add) while its request runs, so a retry
+    # that overlaps the original gets 409 rather than a second execution.
+    def __init__(self, cache: Cache):
+        self.cache = cache
+
+    def _key(self, account_id: int, scope: str, key: str) -> str:
+        return f"{account_id}:{scope}:{key}"
+
+    def begin(
+        self, account_id: int, scope: str, key: str, request_fingerprint: str
+    ) -> Optional[ORJSONResponse]:
+        # Returns the stored response to replay, or None once the key is
+        # claimed for this request
+        cache_key = self._key(account_id, scope, key)
+        claim = {"state": PENDING, "fingerprint": request_fingerprint}
+        for _ in range(2):
+            if self.cache.add(cache_key, claim, ttl=IDEMPOTENCY_LOCK_TTL):
+                return None
+            record = self.cache.get(cache_key)
+            if record is not None:
+                break
+        else:
+            raise HTTPException(status_code=409, detail="Idempotency-Key is in use")
+
+        if record["fingerprint"] != request_fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different request",
+            )
+        if record["state"] == PENDING:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is in progress",
+                headers={"Retry-After": "1"},
+            )
+        return ORJSONResponse(
+            record["body"],
+            status_code=record["status_code"],
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    def complete(
+        self,
+        account_id: int,
+        scope: str,
+        key: str,
+        request_fingerprint: str,
+        body: dict,
+        status_code: int = 200,
+    ):
+        self.cache.set(
+            self._key(account_id, scope, key),
+            {
+                "state": COMPLETED,
+                "fingerprint": request_fingerprint,
+                "status_code": status_code,
+                "body": body,
+            },
+            ttl=IDEMPOTENCY_TTL,
+        )
+
+    def release(self, account_id: int, scope: str, key: str):
+        # Call when the request failed, so that a retry runs it again
+        self.cache.delete(self._key(account_id, scope, key))
+
+
+idempotency_store = IdempotencyStore(
+    create_cache("idempotency", maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+)
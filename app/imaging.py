@@ -0,0 +1,204 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from app.metrics import Histogram
+
+# Pillow is only needed where images are decoded, mostly in the worker
+# processes, so it is imported there
+if TYPE_CHECKING:
+    from PIL import Image
+
+IMAGE_MODEL_SIZE = int(os.getenv("IMAGE_MODEL_SIZE", "512"))
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+READ_CHUNK_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+preprocess_seconds = Histogram(
+    "image_preprocess_seconds", "Time spent per image preprocessing step", ["step"]
+)
+
+
+class ImageError(Exception):
+    pass
+
+
+class ProcessedImage:
+    def __init__(
+        self,
+        image: bytes,
+        thumbnail: bytes,
+        image_format: str,
+        timings: Dict[str, float],
+        perceptual_hash: str = "",
+    ):
+        self.image = image
+        self.thumbnail = thumbnail
+        self.perceptual_hash = perceptual_hash
+        self.content_type = CONTENT_TYPES[image_format]
+        self.extension = EXTENSIONS[image_format]
+        self.timings = timings
+
+
+def _encode(image: "Image.Image", image_format: str, quality: int) -> bytes:
+    out = BytesIO()
+    if image_format == "PNG":
+        image.save(out, format=image_format, optimize=True)
+    else:
+        image.save(out, format=image_format, quality=quality)
+    return out.getvalue()
+
+
+def difference_hash(image: "Image.Image", size: int = 8) -> str:
+    # 64-bit dHash: robust to re-encoding and rescaling of the same photo
+    from PIL import Image
+
+    pixels = list(image.convert("L").resize((size + 1, size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def transform_image(
+    data: bytes,
+    model_size: int = IMAGE_MODEL_SIZE,
+    thumbnail_size: int = IMAGE_THUMBNAIL_SIZE,
+    image_format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+) -> Tuple[bytes, bytes, Dict[str, float], str]:
+    # Runs in a worker process, so it only takes and returns picklable values
+    from PIL import Image, ImageOps
+
+    timings = {}
+
+    start = time.perf_counter()
+    try:
+        image = Image.open(BytesIO(data))
+        # Let the JPEG decoder downscale by a power of two while decoding
+        image.draft("RGB", (model_size, model_size))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise ImageError("Invalid image file") from exc
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image.thumbnail((model_size, model_size), Image.LANCZOS)
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+    timings["resize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_bytes = _encode(image, image_format, quality)
+    thumbnail_bytes = _encode(thumbnail, image_format, quality)
+    timings["encode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    perceptual_hash = difference_hash(thumbnail)
+    timings["hash"] = time.perf_counter() - start
+
+    return image_bytes, thumbnail_bytes, timings, perceptual_hash
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _record(timings: Dict[str, float]):
+    for step, seconds in timings.items():
+        preprocess_seconds.observe(seconds, step=step)
+
+
+def _too_large():
+    return HTTPException(
+        status_code=413,
+        detail=f"Image is larger than {IMAGE_MAX_BYTES} bytes",
+    )
+
+
+def read_upload(file: UploadFile) -> bytes:
+    # Stream the upload in chunks so oversized files are rejected early
+    start = time.perf_counter()
+    buffer = BytesIO()
+    while True:
+        chunk = file.file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if buffer.tell() > IMAGE_MAX_BYTES:
+            raise _too_large()
+    preprocess_seconds.observe(time.perf_counter() - start, step="read")
+    return buffer.getvalue()
+
+
+async def read_upload_async(file: UploadFile) -> bytes:
+    start = time.perf_counter()
+    buffer = BytesIO()
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if buffer.tell() > IMAGE_MAX_BYTES:
+            raise _too_large()
+    preprocess_seconds.observe(time.perf_counter() - start, step="read")
+    return buffer.getvalue()
+
+
+def _to_processed(result: Tuple[bytes, bytes, Dict[str, float], str]) -> ProcessedImage:
+    image_bytes, thumbnail_bytes, timings, perceptual_hash = result
+    _record(timings)
+    return ProcessedImage(
+        image_bytes, thumbnail_bytes, IMAGE_FORMAT, timings, perceptual_hash
+    )
+
+
+def preprocess_image(data: bytes) -> ProcessedImage:
+    # Blocks the calling (threadpool) thread, but the decode/resize/encode
+    # work runs in the process pool and never holds this process's GIL
+    try:
+        result = get_executor().submit(transform_image, data).result()
+    except ImageError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return _to_processed(result)
+
+
+async def preprocess_image_async(data: bytes) -> ProcessedImage:
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(get_executor(), transform_image, data)
+    except ImageError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return _to_processed(result)
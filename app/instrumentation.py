@@ -0,0 +1,188 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this many seconds are logged with the SQL they ran;
+# unset disables the log (and statement capture)
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0")) or None
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "50"))
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route",
+    ["method", "route", "status"],
+)
+request_sql_statements = Histogram(
+    "http_request_sql_statements",
+    "SQL statements executed per request",
+    ["method", "route"],
+    buckets=COUNT_BUCKETS,
+)
+request_sql_seconds = Histogram(
+    "http_request_sql_seconds",
+    "Time spent in SQL per request",
+    ["method", "route"],
+)
+outbound_seconds = Histogram(
+    "outbound_call_seconds", "Time spent calling other services", ["target"]
+)
+outbound_errors = Counter(
+    "outbound_call_errors_total", "Failed calls to other services", ["target"]
+)
+slow_requests = Counter(
+    "http_slow_requests_total", "Requests over SLOW_REQUEST_SECONDS", ["route"]
+)
+
+
+class RequestStats:
+    # Mutable per-request totals; shared with the threadpool threads that run
+    # sync endpoints, which see the same object through the copied context
+    __slots__ = ("sql_count", "sql_seconds", "outbound", "statements")
+
+    def __init__(self, capture_statements: bool = False):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.outbound: Dict[str, float] = {}
+        self.statements: Optional[List[Tuple[float, str]]] = (
+            [] if capture_statements else None
+        )
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if (
+        stats.statements is not None
+        and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS
+    ):
+        stats.statements.append((elapsed, statement))
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get("query_start")
+        if starts:
+            starts.pop()
+
+
+def instrument_sql(target=Engine):
+    # Listening on the Engine class covers every engine: primary, replicas
+    # and any engine created later
+    event.listen(target, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target, "after_cursor_execute", _after_cursor_execute)
+    event.listen(target, "handle_error", _handle_error)
+
+
+@contextmanager
+def outbound(target: str):
+    # Times a call to another service, for the metrics and the current
+    # request's totals
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        outbound_errors.inc(target=target)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        outbound_seconds.observe(elapsed, target=target)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.outbound[target] = stats.outbound.get(target, 0.0) + elapsed
+
+
+def _route_name(scope) -> str:
+    # The route template rather than the raw path keeps label cardinality
+    # bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class InstrumentationMiddleware:
+    # Plain ASGI middleware, so streamed responses are timed until their last
+    # chunk is sent
+    def __init__(self, app, slow_request_seconds: Optional[float] = None):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds or SLOW_REQUEST_SECONDS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(capture_statements=bool(self.slow_request_seconds))
+        token = _request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            self._record(scope, status, elapsed, stats)
+
+    def _record(self, scope, status: int, elapsed: float, stats: RequestStats):
+        method = scope["method"]
+        route = _route_name(scope)
+        request_duration.observe(elapsed, method=method, route=route, status=status)
+        request_sql_statements.observe(stats.sql_count, method=method, route=route)
+        request_sql_seconds.observe(stats.sql_seconds, method=method, route=route)
+
+        if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+            slow_requests.inc(route=route)
+            outbound = ", ".join(
+                f"{target}={seconds * 1000:.1f}ms"
+                for target, seconds in stats.outbound.items()
+            )
+            statements = "".join(
+                f"\n  {seconds * 1000:.1f}ms {' '.join(statement.split())[:500]}"
+                for seconds, statement in stats.statements or ()
+            )
+            logger.warning(
+                "Slow request %s %s -> %s in %.1fms: %d SQL statements (%.1fms), "
+                "outbound: %s%s",
+                method,
+                scope["path"],
+                status,
+                elapsed * 1000,
+                stats.sql_count,
+                stats.sql_seconds * 1000,
+                outbound or "none",
+                statements,
+            )
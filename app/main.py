@@ -1,9 +1,49 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 
+from app.admin import router as admin_router
 from app.auth import router as auth_router
+from app.database import dispose_async_engine
+from app.imaging import shutdown_executor
+from app.instrumentation import InstrumentationMiddleware
+from app.metrics import router as metrics_router
+from app.metrics import worker_snapshots
+from app.passwords import password_service
+from app.pipeline import pipeline
 from app.routes import router
+from app.startup import warm_up, warmup_steps
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Checked before any work so a typo fails the deploy instead of being
+    # ignored
+    steps = warmup_steps()
+    await run_in_threadpool(warm_up, steps)
+    await pipeline.start()
+    if worker_snapshots:
+        worker_snapshots.start()
+    yield
+    await pipeline.stop()
+    if worker_snapshots:
+        worker_snapshots.stop()
+    shutdown_executor()
+    password_service.shutdown()
+    await dispose_async_engine()
+
 
-app = FastAPI(title="Calorties API Docs")
+# orjson serializes responses several times faster than the stdlib encoder
+app = FastAPI(
+    title="Calorties API Docs",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+app.add_middleware(InstrumentationMiddleware)
 
 app.include_router(auth_router)
 app.include_router(router)
+app.include_router(admin_router)
+app.include_router(metrics_router)
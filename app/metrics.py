@@ -0,0 +1,314 @@
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter()
+
+# Set by app.server when it runs several workers: each worker writes snapshots
+# of its metrics there, and /metrics serves the samples of every live worker
+# labelled by worker (its pid), so a scrape that lands on any worker sees all
+# of them and no counter goes backwards between scrapes. Aggregate with e.g.
+# sum without (worker) (rate(...)).
+METRICS_DIR = os.getenv("METRICS_DIR")
+# Seconds between snapshots; the other workers' samples are up to this old
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5"))
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _add_label(labels: str, name: str, value: str) -> str:
+    pair = f'{name}="{value}"'
+    return "{" + pair + ("," + labels[1:] if labels else "}")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self, samples: Optional[List[Tuple[str, str, float]]] = None) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, labels, value in self.samples() if samples is None else samples:
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            ("", _format_labels(self.labelnames, key), value) for key, value in items
+        ]
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]):
+        # Values are read from the callback at scrape time, keyed by label
+        # values in labelnames order
+        self._function = function
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is not None:
+            items = list(self._function().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [
+            ("", _format_labels(self.labelnames, key), value) for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def sum(self, **labels) -> float:
+        return self._sums.get(self._key(labels), 0.0)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._counts.items()]
+            sums = dict(self._sums)
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(bound),)
+                )
+                samples.append(("_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(("_sum", labels, sums[key]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+    def collect(self, worker: str) -> Dict[str, List[Tuple[str, str, float]]]:
+        return {
+            name: [
+                (suffix, _add_label(labels, "worker", worker), value)
+                for suffix, labels, value in metric.samples()
+            ]
+            for name, metric in self._metrics.items()
+        }
+
+    def render_workers(self, snapshots: List[Dict[str, list]]) -> str:
+        # Every worker registers the same metrics, so each family is rendered
+        # once with the samples of all workers
+        return (
+            "\n".join(
+                metric.render(
+                    [
+                        tuple(sample)
+                        for snapshot in snapshots
+                        for sample in snapshot.get(name, ())
+                    ]
+                )
+                for name, metric in self._metrics.items()
+            )
+            + "\n"
+        )
+
+
+REGISTRY = Registry()
+
+
+class WorkerSnapshots:
+    # Periodic snapshots of this worker's metrics in a directory shared with
+    # the other workers, one <pid>.json file each
+    def __init__(self, directory: str, interval: float = METRICS_SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def write(self) -> Dict[str, list]:
+        snapshot = REGISTRY.collect(str(os.getpid()))
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, self.path)
+        return snapshot
+
+    def read_others(self) -> List[Dict[str, list]]:
+        snapshots = []
+        for name in os.listdir(self.directory):
+            pid, extension = os.path.splitext(name)
+            if extension != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                # A worker that died without cleaning up is dropped
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                _remove(path)
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        return REGISTRY.render_workers([self.write()] + self.read_others())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self.write()
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-snapshots", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        _remove(self.path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+worker_snapshots = WorkerSnapshots(METRICS_DIR) if METRICS_DIR else None
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    body = worker_snapshots.render() if worker_snapshots else REGISTRY.render()
+    return PlainTextResponse(
+        body, media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -5,8 +5,11 @@ from sqlalchemy import (
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     String,
+    func,
+    text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -19,12 +22,14 @@ class Account(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     nama = Column(String(255), nullable=False)
-    username = Column(String(255), nullable=False)
-    email = Column(String(255), nullable=False)
+    username = Column(String(255), nullable=False, unique=True, index=True)
+    email = Column(String(255), nullable=False, unique=True, index=True)
     password = Column(String(255), nullable=False)
-    created_at = Column(DateTime, server_default="CURRENT_TIMESTAMP")
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(
-        DateTime, server_default="CURRENT_TIMESTAMP", onupdate="CURRENT_TIMESTAMP"
+        DateTime,
+        server_default=text("CURRENT_TIMESTAMP"),
+        onupdate=func.current_timestamp(),
     )
     deleted_at = Column(DateTime)
 
@@ -33,7 +38,7 @@ class User(Base):
     __tablename__ = "User"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    account_id = Column(Integer, ForeignKey("Account.id"))
+    account_id = Column(Integer, ForeignKey("Account.id"), index=True)
     nama = Column(String(255), nullable=False)
     email = Column(String(255), nullable=False)
     birthdate = Column(Date)
@@ -41,9 +46,11 @@ class User(Base):
     tinggi_badan = Column(DECIMAL(5, 2))
     berat_badan = Column(DECIMAL(5, 2))
     profile_image_url = Column(String(255))
-    created_at = Column(DateTime, server_default="CURRENT_TIMESTAMP")
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(
-        DateTime, server_default="CURRENT_TIMESTAMP", onupdate="CURRENT_TIMESTAMP"
+        DateTime,
+        server_default=text("CURRENT_TIMESTAMP"),
+        onupdate=func.current_timestamp(),
     )
     deleted_at = Column(DateTime)
     account = relationship("Account", foreign_keys=[account_id])
@@ -53,29 +60,64 @@ class Food(Base):
     __tablename__ = "Food"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    name = Column(String(255), nullable=False)
+    name = Column(String(255), nullable=False, index=True)
     type = Column(String(255))
     jumlah_kalori = Column(Integer)
     thumbnail = Column(String(255))
-    created_at = Column(DateTime, server_default="CURRENT_TIMESTAMP")
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(
-        DateTime, server_default="CURRENT_TIMESTAMP", onupdate="CURRENT_TIMESTAMP"
+        DateTime,
+        server_default=text("CURRENT_TIMESTAMP"),
+        onupdate=func.current_timestamp(),
     )
     deleted_at = Column(DateTime)
 
 
 class Calorie(Base):
     __tablename__ = "Calorie"
+    __table_args__ = (
+        # A user's meals by time, for the daily views, exports and rollup
+        # rebuilds
+        Index("ix_Calorie_user_id_created_at", "user_id", "created_at"),
+        # Replayed offline entries are recognised by their client key
+        Index(
+            "ux_Calorie_user_id_idempotency_key",
+            "user_id",
+            "idempotency_key",
+            unique=True,
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("User.id"))
     food_id = Column(Integer, ForeignKey("Food.id"))
     jumlah_kalori = Column(Integer)
     food_image_url = Column(String(255))
-    created_at = Column(DateTime, server_default="CURRENT_TIMESTAMP")
+    # Client-generated key of the entry, unique per user; NULL for meals
+    # recorded without one
+    idempotency_key = Column(String(64))
+    # Food type when the meal was recorded, i.e. the rollup row it counts
+    # towards; the food's own type may change later
+    food_type = Column(String(255))
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(
-        DateTime, server_default="CURRENT_TIMESTAMP", onupdate="CURRENT_TIMESTAMP"
+        DateTime,
+        server_default=text("CURRENT_TIMESTAMP"),
+        onupdate=func.current_timestamp(),
     )
     deleted_at = Column(DateTime)
     user = relationship("User", foreign_keys=[user_id])
     food = relationship("Food", foreign_keys=[food_id])
+
+
+class CalorieRollup(Base):
+    # Calories per user, day and food type, maintained alongside Calorie
+    # inserts and soft deletes (see app/rollup.py)
+    __tablename__ = "CalorieRollup"
+
+    user_id = Column(Integer, ForeignKey("User.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    # Foods without a type are counted under ""
+    type = Column(String(255), primary_key=True, default="")
+    total_kalori = Column(Integer, nullable=False, default=0)
+    meal_count = Column(Integer, nullable=False, default=0)
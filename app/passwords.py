@@ -0,0 +1,156 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.metrics import Gauge, Histogram
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+# Hashing requests allowed to wait or run at once before new ones get 503
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "64"))
+
+_pwd_context: Optional["CryptContext"] = None
+_pwd_context_lock = threading.Lock()
+
+password_queue_wait = Histogram(
+    "password_queue_wait_seconds",
+    "Time password operations wait for a worker",
+    ["operation"],
+)
+password_hash_time = Histogram(
+    "password_hash_seconds", "Time spent hashing in the worker", ["operation"]
+)
+password_pending = Gauge("password_pending", "Password operations waiting or running")
+
+
+def get_pwd_context() -> "CryptContext":
+    # Built on first use, in whichever process hashes: passlib and bcrypt stay
+    # out of the app's import. Hashes with a different cost factor are
+    # reported as needing an update, so changing BCRYPT_ROUNDS rehashes
+    # passwords on the next successful login
+    global _pwd_context
+    if _pwd_context is None:
+        with _pwd_context_lock:
+            if _pwd_context is None:
+                from passlib.context import CryptContext
+
+                _pwd_context = CryptContext(
+                    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+                )
+    return _pwd_context
+
+
+def _hash(password: str) -> Tuple[str, float]:
+    start = time.perf_counter()
+    hashed = get_pwd_context().hash(password)
+    return hashed, time.perf_counter() - start
+
+
+def _verify_and_update(
+    password: str, hashed_password: str
+) -> Tuple[Tuple[bool, Optional[str]], float]:
+    start = time.perf_counter()
+    result = get_pwd_context().verify_and_update(password, hashed_password)
+    return result, time.perf_counter() - start
+
+
+class PasswordService:
+    def __init__(
+        self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        password_pending.set_function(lambda: {(): self._pending})
+
+    @property
+    def context(self) -> "CryptContext":
+        # For hashing in this process, e.g. when seeding test data
+        return get_pwd_context()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _submit(self, operation: str, function, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many concurrent password operations, retry later",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+
+        submitted_at = time.perf_counter()
+        result: Future = Future()
+
+        def done(future: Future):
+            with self._lock:
+                self._pending -= 1
+            try:
+                value, hash_seconds = future.result()
+            except Exception as exc:
+                result.set_exception(exc)
+                return
+            total = time.perf_counter() - submitted_at
+            password_hash_time.observe(hash_seconds, operation=operation)
+            password_queue_wait.observe(
+                max(total - hash_seconds, 0.0), operation=operation
+            )
+            result.set_result(value)
+
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(done)
+        return result
+
+    def hash(self, password: str) -> str:
+        # Blocks the calling thread only; the hashing itself runs in a worker
+        # process and does not hold this process's GIL
+        return self._submit("hash", _hash, password).result()
+
+    def verify_and_update(
+        self, password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        # Returns whether the password matches and, if the stored hash uses
+        # outdated settings, a replacement hash
+        return self._submit(
+            "verify", _verify_and_update, password, hashed_password
+        ).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit("hash", _hash, password))
+
+    async def verify_and_update_async(
+        self, password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        return await asyncio.wrap_future(
+            self._submit("verify", _verify_and_update, password, hashed_password)
+        )
+
+
+password_service = PasswordService()
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.catalog import food_catalog
+from app.database import SessionLocal, mark_write
+from app.gcs import upload_fileobj_to_gcs
+from app.models import Calorie, User
+from app.prediction import predict_food_id, prediction_cache
+from app.ratelimit import inference_stage, upload_stage
+from app.rollup import add_calorie
+from app.summary_cache import summary_cache
+
+logger = logging.getLogger(__name__)
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+# "thread" runs jobs on the event loop's thread pool; "process" on a pool of
+# INGEST_WORKERS processes, where each process runs one job at a time and has
+# its own copy of the upload and inference stage caps, so the pipeline adds at
+# most INGEST_WORKERS calls to each stage on top of the web requests
+INGEST_EXECUTOR = os.getenv("INGEST_EXECUTOR", "thread")
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "10000"))
+# Seconds a job waits for a free upload or inference slot before it fails
+INGEST_STAGE_TIMEOUT = float(os.getenv("INGEST_STAGE_TIMEOUT", "60"))
+# Seconds shutdown waits for queued jobs before abandoning them; app.server
+# sets it to what is left of SHUTDOWN_TIMEOUT after the graceful period
+INGEST_DRAIN_TIMEOUT = float(os.getenv("INGEST_DRAIN_TIMEOUT", "10"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class IngestError(Exception):
+    # Plain, picklable stand-in for the HTTPException raised by the stages, so
+    # a failure can travel back from a process pool worker
+    def __init__(self, detail: str, status_code: int = 500):
+        super().__init__(detail, status_code)
+        self.detail = detail
+        self.status_code = status_code
+
+    def __str__(self):
+        return str(self.detail)
+
+
+class IngestJob:
+    def __init__(
+        self,
+        account_id: int,
+        filename: str,
+        content_type: Optional[str],
+        data: bytes,
+        thumbnail: bytes = b"",
+    ):
+        self.id = uuid.uuid4().hex
+        self.account_id = account_id
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+        self.thumbnail = thumbnail
+        self.status = JOB_QUEUED
+        self.calorie_id: Optional[int] = None
+        self.food_id: Optional[int] = None
+        self.image_url: Optional[str] = None
+        # Set when the result should be stored in the prediction cache
+        self.cache_key: Optional[str] = None
+        # Client Idempotency-Key, stored on the meal
+        self.idempotency_key: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "calorie_id": self.calorie_id,
+            "food_id": self.food_id,
+            "image_url": self.image_url,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class InMemoryJobStore:
+    # Keeps the most recent jobs only; finished jobs are dropped oldest-first
+    # once max_jobs is reached so the store stays bounded.
+    def __init__(self, max_jobs: int = INGEST_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+
+    def save(self, job: IngestJob):
+        self._jobs[job.id] = job
+        self._jobs.move_to_end(job.id)
+        while len(self._jobs) > self.max_jobs:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status not in (JOB_SUCCEEDED, JOB_FAILED):
+                break
+            del self._jobs[oldest_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+
+def _job_result(calorie: Calorie) -> Dict:
+    return {
+        "calorie_id": calorie.id,
+        "user_id": calorie.user_id,
+        "day": calorie.created_at.date(),
+        "food_id": calorie.food_id,
+        "image_url": calorie.food_image_url,
+    }
+
+
+def process_ingest_job(
+    account_id: int,
+    filename: str,
+    content_type: Optional[str],
+    data: bytes,
+    thumbnail: bytes = b"",
+    image_url: Optional[str] = None,
+    food_id: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+) -> Dict:
+    # Runs upload -> inference -> insert for a single job, skipping the steps
+    # whose result is already known. Kept as a plain function of picklable
+    # arguments (and raising only picklable errors) so it can run in a process
+    # pool.
+    #
+    # Admitted jobs wait longer than requests for their turn in the shared
+    # stages, but not forever, so a stuck stage fails jobs instead of holding
+    # the pool's workers. In a process pool the stage caps are per process
+    # (see INGEST_EXECUTOR).
+    try:
+        if image_url is None:
+            with upload_stage.slot(timeout=INGEST_STAGE_TIMEOUT):
+                if thumbnail:
+                    basename, extension = os.path.splitext(filename)
+                    thumbnail_name = f"{basename}_thumb{extension}"
+                    upload_fileobj_to_gcs(
+                        BytesIO(thumbnail), thumbnail_name, content_type
+                    )
+                image_url = upload_fileobj_to_gcs(BytesIO(data), filename, content_type)
+        if food_id is None:
+            with inference_stage.slot(timeout=INGEST_STAGE_TIMEOUT):
+                food_id = predict_food_id(image_url)
+    except HTTPException as exc:
+        # HTTPException does not survive unpickling in the parent process
+        raise IngestError(str(exc.detail), exc.status_code) from None
+
+    db = SessionLocal()
+    try:
+        food = food_catalog.get(db, food_id)
+        if not food:
+            raise IngestError("Food not found")
+
+        user = db.query(User).filter(User.account_id == account_id).first()
+        if not user:
+            raise IngestError("User not found")
+
+        # Already recorded under this Idempotency-Key by an earlier request
+        new_calorie = None
+        if idempotency_key:
+            new_calorie = (
+                db.query(Calorie)
+                .filter(
+                    Calorie.user_id == user.id,
+                    Calorie.idempotency_key == idempotency_key,
+                )
+                .first()
+            )
+        if new_calorie is not None:
+            return _job_result(new_calorie)
+
+        new_calorie = Calorie(
+            user_id=user.id,
+            food_id=food_id,
+            jumlah_kalori=food.jumlah_kalori,
+            food_image_url=image_url,
+            idempotency_key=idempotency_key,
+        )
+        db.add(new_calorie)
+        add_calorie(db, new_calorie, food.type)
+        db.commit()
+        db.refresh(new_calorie)
+
+        return _job_result(new_calorie)
+    finally:
+        db.close()
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        store: Optional[InMemoryJobStore] = None,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        workers: int = INGEST_WORKERS,
+        executor: Optional[Executor] = None,
+    ):
+        self.store = store or InMemoryJobStore()
+        self.queue_size = queue_size
+        self.workers = workers
+        # None runs jobs on the loop's default thread pool
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: bool = True, timeout: float = INGEST_DRAIN_TIMEOUT):
+        if not self._tasks:
+            return
+        if drain:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "Stopping with %d ingestion jobs still queued",
+                    self._queue.qsize(),
+                )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if isinstance(self.executor, ProcessPoolExecutor):
+            self.executor.shutdown(wait=True)
+
+    def submit(self, job: IngestJob) -> IngestJob:
+        if self._queue is None:
+            raise HTTPException(
+                status_code=503, detail="Ingestion pipeline is not running"
+            )
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            # Backpressure: refuse new work instead of queuing unboundedly
+            raise HTTPException(
+                status_code=503,
+                detail="Ingestion queue is full, retry later",
+                headers={"Retry-After": "5"},
+            )
+        self.store.save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.store.get(job_id)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                job.status = JOB_RUNNING
+                result = await loop.run_in_executor(
+                    self.executor,
+                    process_ingest_job,
+                    job.account_id,
+                    job.filename,
+                    job.content_type,
+                    job.data,
+                    job.thumbnail,
+                    job.image_url,
+                    job.food_id,
+                    job.idempotency_key,
+                )
+                job.calorie_id = result["calorie_id"]
+                job.food_id = result["food_id"]
+                job.image_url = result["image_url"]
+                job.status = JOB_SUCCEEDED
+                # Marked here rather than in process_ingest_job, which may run
+                # in another process
+                mark_write(job.account_id)
+                summary_cache.invalidate_day(result["user_id"], result["day"])
+                if job.cache_key:
+                    prediction_cache.set(job.cache_key, job.food_id, job.image_url)
+            except (HTTPException, IngestError) as exc:
+                job.error = exc.detail
+                job.status = JOB_FAILED
+            except Exception as exc:
+                job.error = str(exc) or exc.__class__.__name__
+                job.status = JOB_FAILED
+            finally:
+                # Drop the image payload as soon as the job is done with it
+                job.data = b""
+                job.thumbnail = b""
+                job.finished_at = datetime.utcnow()
+                self.store.save(job)
+                self._queue.task_done()
+
+
+def _create_executor() -> Optional[Executor]:
+    if INGEST_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+    return None
+
+
+pipeline = IngestionPipeline(executor=_create_executor())
@@ -1,17 +1,298 @@
-import requests
+import asyncio
+import hashlib
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
 from fastapi import HTTPException
 
+from app.cache import Cache, create_cache
+from app.imaging import ProcessedImage
+from app.instrumentation import outbound
 
-def predict_food_id(image_url):
-    # Call infer_food_id endpoint to get the food_id based on the image URL
-    infer_food_id_endpoint = "http://localhost:8000/inference/food-id"
-    data = {"image_url": image_url}
-    response = requests.post(infer_food_id_endpoint, params=data)
+INFERENCE_URL = os.getenv("INFERENCE_URL", "http://localhost:8000")
+PREDICTION_CONNECT_TIMEOUT = float(os.getenv("PREDICTION_CONNECT_TIMEOUT", "2"))
+PREDICTION_READ_TIMEOUT = float(os.getenv("PREDICTION_READ_TIMEOUT", "10"))
+PREDICTION_RETRIES = int(os.getenv("PREDICTION_RETRIES", "2"))
+PREDICTION_POOL_SIZE = int(os.getenv("PREDICTION_POOL_SIZE", "16"))
+# A batch size of 1 disables micro-batching and calls the single endpoint
+PREDICTION_BATCH_SIZE = int(os.getenv("PREDICTION_BATCH_SIZE", "8"))
+PREDICTION_BATCH_WAIT_MS = float(os.getenv("PREDICTION_BATCH_WAIT_MS", "10"))
+PREDICTION_BREAKER_THRESHOLD = int(os.getenv("PREDICTION_BREAKER_THRESHOLD", "5"))
+PREDICTION_BREAKER_RESET = float(os.getenv("PREDICTION_BREAKER_RESET", "30"))
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "86400"))
+# Key on a perceptual hash of the downscaled image instead of the raw bytes, so
+# re-compressed copies of the same photo also hit (costs a preprocessing pass)
+PREDICTION_CACHE_PERCEPTUAL = os.getenv("PREDICTION_CACHE_PERCEPTUAL") == "1"
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures and rejects calls until
+    # `reset_timeout` seconds have passed, then lets a single trial call
+    # through (half-open) to decide whether to close again.
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return
+        raise HTTPException(
+            status_code=503,
+            detail="Inference service unavailable",
+            headers={"Retry-After": str(int(self.reset_timeout))},
+        )
+
+    def after_fork(self):
+        # The lock may have been held by another thread of the parent
+        self._lock = threading.Lock()
+        self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class PredictionClient:
+    def __init__(
+        self,
+        base_url: str = INFERENCE_URL,
+        batch_size: int = PREDICTION_BATCH_SIZE,
+        batch_wait_ms: float = PREDICTION_BATCH_WAIT_MS,
+        retries: int = PREDICTION_RETRIES,
+        pool_size: int = PREDICTION_POOL_SIZE,
+        timeout: Tuple[float, float] = (
+            PREDICTION_CONNECT_TIMEOUT,
+            PREDICTION_READ_TIMEOUT,
+        ),
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(
+            PREDICTION_BREAKER_THRESHOLD, PREDICTION_BREAKER_RESET
+        )
+
+        self.retries = retries
+        self.pool_size = pool_size
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # Threads do not survive a fork, so a process pool worker would
+            # otherwise inherit a batcher that is never coming back and wait
+            # on it forever; pooled connections would be shared with the parent
+            client = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: _reset_after_fork(client))
+
+    def _reset(self):
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        # Batches are sent concurrently, up to one per pooled connection
+        self._senders = ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix="prediction-batch"
+        )
+        self._batcher: Optional[threading.Thread] = None
+        self._batcher_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created on first use, which keeps requests out of the import path
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Inference is a pure function of the image, so retrying POSTs is safe
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=0.1,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _post(self, path: str, **kwargs) -> dict:
+        import requests
+
+        self.breaker.before_call()
+        try:
+            response = self.session.post(
+                self.base_url + path, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException as exc:
+            self.breaker.record_failure()
+            raise HTTPException(
+                status_code=503, detail=f"Inference service unavailable: {exc}"
+            )
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=response.text)
+
+        return response.json()
+
+    def predict(self, image_url: str) -> int:
+        if self.batch_size <= 1:
+            # Call infer_food_id endpoint to get the food_id based on the image URL
+            result = self._post("/inference/food-id", params={"image_url": image_url})
+            return result.get("food_id")
+        return self.submit(image_url).result()
+
+    def predict_batch(self, image_urls: List[str]) -> List[int]:
+        result = self._post(
+            "/inference/food-id/batch", json={"image_urls": list(image_urls)}
+        )
+        return result.get("food_ids")
+
+    def submit(self, image_url: str) -> Future:
+        self._ensure_batcher()
+        future: Future = Future()
+        self._queue.put((image_url, future))
+        return future
+
+    def _ensure_batcher(self):
+        if self._batcher is None:
+            with self._batcher_lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(
+                        target=self._run_batcher, name="prediction-batcher", daemon=True
+                    )
+                    self._batcher.start()
+
+    def _next_batch(self) -> List[Tuple[str, Future]]:
+        # Wait for the first request, then gather whatever else arrives within
+        # the batch window, up to batch_size
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _send_batch(self, batch: List[Tuple[str, Future]]):
+        futures = [future for _, future in batch]
+        try:
+            food_ids = self.predict_batch([image_url for image_url, _ in batch])
+            if len(food_ids) != len(batch):
+                raise HTTPException(
+                    status_code=502, detail="Inference batch size mismatch"
+                )
+        except Exception as exc:
+            for future in futures:
+                future.set_exception(exc)
+            return
+        for future, food_id in zip(futures, food_ids):
+            future.set_result(food_id)
+
+    def _run_batcher(self):
+        while True:
+            self._senders.submit(self._send_batch, self._next_batch())
+
+
+def _reset_after_fork(client: "weakref.ref[PredictionClient]"):
+    instance = client()
+    if instance is not None:
+        instance._reset()
+        instance.breaker.after_fork()
+
+
+class PredictionCache:
+    # Maps an account's uploaded image to the stored URL and predicted food_id,
+    # so re-sent photos skip both the upload and the inference call
+    def __init__(self, cache: Cache, perceptual: bool = PREDICTION_CACHE_PERCEPTUAL):
+        self.cache = cache
+        self.perceptual = perceptual
+
+    def key(
+        self,
+        account_id: int,
+        data: bytes,
+        processed: Optional[ProcessedImage] = None,
+    ) -> str:
+        if self.perceptual:
+            return f"{account_id}:dhash:{processed.perceptual_hash}"
+        return f"{account_id}:sha256:{hashlib.sha256(data).hexdigest()}"
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, food_id: int, image_url: str):
+        self.cache.set(key, {"food_id": food_id, "image_url": image_url})
+
+
+prediction_client = PredictionClient()
+prediction_cache = PredictionCache(
+    create_cache("prediction", maxsize=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+)
+
+
+def predict_food_id(image_url):
+    with outbound("inference"):
+        return prediction_client.predict(image_url)
 
-    result = response.json()
-    food_id = result.get("food_id")
 
-    return food_id
+async def predict_food_id_async(image_url):
+    with outbound("inference"):
+        if prediction_client.batch_size <= 1:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, prediction_client.predict, image_url
+            )
+        return await asyncio.wrap_future(prediction_client.submit(image_url))
@@ -0,0 +1,222 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import jwt
+from fastapi import HTTPException, Request
+from jwt import InvalidTokenError
+
+from app.cache import CACHE_BACKEND, REDIS_URL
+from app.gcs import GCS_POOL_SIZE
+from app.metrics import Counter, Gauge
+from app.prediction import PREDICTION_POOL_SIZE
+from app.security import ALGORITHM, SECRET_KEY
+
+# "memory" keeps the buckets per process; "redis" shares them between workers
+# and instances
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", CACHE_BACKEND)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# Buckets kept by the memory backend; the least recently used go first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Per-route budgets as "<requests>/<seconds>": a client may burst up to
+# <requests> and then gets one more every <seconds>/<requests>. Empty or 0
+# turns the limit off.
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/60")
+RATE_LIMIT_REGISTER = os.getenv("RATE_LIMIT_REGISTER", "5/60")
+RATE_LIMIT_CALORIES = os.getenv("RATE_LIMIT_CALORIES", "30/60")
+RATE_LIMIT_PROFILE_IMAGE = os.getenv("RATE_LIMIT_PROFILE_IMAGE", "10/60")
+
+# Requests allowed in the upload and inference stages at once, per worker
+# process; by default the size of their HTTP connection pools, past which
+# calls would only queue for a connection
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", str(GCS_POOL_SIZE)))
+INFERENCE_MAX_CONCURRENCY = int(
+    os.getenv("INFERENCE_MAX_CONCURRENCY", str(PREDICTION_POOL_SIZE))
+)
+# Seconds a request waits for a free slot before it is turned away with a 503
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "1"))
+
+rate_limited_requests = Counter(
+    "rate_limited_requests_total", "Requests rejected by a rate limit", ["limit"]
+)
+shed_requests = Counter(
+    "shed_requests_total", "Requests turned away by a full stage", ["stage"]
+)
+stage_in_flight = Gauge(
+    "stage_in_flight", "Requests inside a concurrency-limited stage", ["stage"]
+)
+
+
+def parse_budget(value: str) -> Optional[Tuple[float, float]]:
+    # "<requests>/<seconds>" as (capacity, tokens per second), or None if off
+    if not value.strip():
+        return None
+    requests, _, seconds = value.partition("/")
+    capacity = float(requests)
+    if capacity <= 0:
+        return None
+    return capacity, capacity / float(seconds or 1)
+
+
+class RateLimitBackend:
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        # Takes a token from the bucket; returns 0 if there was one, otherwise
+        # the seconds until there will be
+        raise NotImplementedError
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # An evicted bucket starts full again, as if the client were idle
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Refill and take in one round trip, on the Redis clock so that every
+# instance sees the same time
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    # Shared buckets for multi-worker / multi-instance deployments; needs the
+    # optional `redis` package
+    def __init__(self, url: str = REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+
+        self.prefix = "calorties:ratelimit:"
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate]))
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitBackend()
+    return MemoryRateLimitBackend()
+
+
+def client_key(request: Request) -> str:
+    # The account of a valid bearer token, else the client address (already
+    # taken from X-Forwarded-For by uvicorn for trusted proxies). Only the
+    # signature is checked, so no request waits on the database to be limited.
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except InvalidTokenError:
+            payload = {}
+        account = payload.get("aid") or payload.get("sub")
+        if account is not None:
+            return f"account:{account}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+class RateLimit:
+    # Token bucket per client, used as a route dependency:
+    #   @router.post("/login", dependencies=[Depends(login_rate_limit)])
+    # Routes sharing a name share their buckets.
+    def __init__(self, name: str, budget: str, backend: RateLimitBackend):
+        self.name = name
+        self.budget = parse_budget(budget)
+        self.backend = backend
+
+    def __call__(self, request: Request):
+        if not RATE_LIMIT_ENABLED or self.budget is None:
+            return
+        capacity, rate = self.budget
+        wait = self.backend.take(f"{self.name}:{client_key(request)}", capacity, rate)
+        if wait > 0:
+            rate_limited_requests.inc(limit=self.name)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, retry later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+
+class ConcurrencyLimit:
+    # Caps the requests inside an expensive stage. A request that finds it
+    # full waits up to ADMISSION_TIMEOUT and is then turned away with a 503,
+    # instead of piling up threads and open connections behind the stage.
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = ADMISSION_TIMEOUT):
+        # timeout=None waits as long as it takes, for background work that
+        # has already been admitted
+        if self._semaphore is None:
+            yield
+            return
+        if not self._semaphore.acquire(timeout=timeout):
+            shed_requests.inc(stage=self.name)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many requests in {self.name}, retry later",
+                headers={"Retry-After": "1"},
+            )
+        stage_in_flight.inc(stage=self.name)
+        try:
+            yield
+        finally:
+            stage_in_flight.dec(stage=self.name)
+            self._semaphore.release()
+
+
+rate_limit_backend = create_rate_limit_backend()
+login_rate_limit = RateLimit("login", RATE_LIMIT_LOGIN, rate_limit_backend)
+register_rate_limit = RateLimit("register", RATE_LIMIT_REGISTER, rate_limit_backend)
+calories_rate_limit = RateLimit("calories", RATE_LIMIT_CALORIES, rate_limit_backend)
+profile_image_rate_limit = RateLimit(
+    "profile-image", RATE_LIMIT_PROFILE_IMAGE, rate_limit_backend
+)
+
+upload_stage = ConcurrencyLimit("upload", UPLOAD_MAX_CONCURRENCY)
+inference_stage = ConcurrencyLimit("inference", INFERENCE_MAX_CONCURRENCY)
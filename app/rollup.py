@@ -0,0 +1,178 @@
+import argparse
+from datetime import date, datetime, time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, get_engine
+from app.models import Calorie, CalorieRollup, Food
+
+rollup_table = CalorieRollup.__table__
+
+
+def _upsert(db: Session, rows: List[dict]):
+    # Adds each row's totals to its (user, day, type) row, creating it if
+    # needed; all rows go out as one executemany
+    # Only the dialect in use is imported; the PostgreSQL one is slow to load
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        statement = dialect_insert(rollup_table)
+        statement = statement.on_duplicate_key_update(
+            total_kalori=rollup_table.c.total_kalori + statement.inserted.total_kalori,
+            meal_count=rollup_table.c.meal_count + statement.inserted.meal_count,
+        )
+    else:
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        statement = dialect_insert(rollup_table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[
+                rollup_table.c.user_id,
+                rollup_table.c.day,
+                rollup_table.c.type,
+            ],
+            set_={
+                "total_kalori": rollup_table.c.total_kalori
+                + statement.excluded.total_kalori,
+                "meal_count": rollup_table.c.meal_count + statement.excluded.meal_count,
+            },
+        )
+    db.execute(statement, rows)
+
+
+def add_calorie(db: Session, calorie: Calorie, food_type: Optional[str]):
+    # Call after db.add(calorie) and before the commit, so the meal and its
+    # rollup land in the same transaction
+    calorie.food_type = food_type
+    db.flush()
+    _upsert(
+        db,
+        [
+            dict(
+                user_id=calorie.user_id,
+                day=calorie.created_at.date(),
+                type=food_type or "",
+                total_kalori=calorie.jumlah_kalori or 0,
+                meal_count=1,
+            )
+        ],
+    )
+
+
+def add_calories(db: Session, user_id: int, meals: Iterable[Tuple[date, str, int]]):
+    # Bulk version of add_calorie for (day, food type, kalori) meals of one
+    # user, merged per rollup row first
+    totals: Dict[Tuple[date, str], List[int]] = {}
+    for day, food_type, kalori in meals:
+        total = totals.setdefault((day, food_type or ""), [0, 0])
+        total[0] += kalori or 0
+        total[1] += 1
+    if totals:
+        _upsert(
+            db,
+            [
+                dict(
+                    user_id=user_id,
+                    day=day,
+                    type=food_type,
+                    total_kalori=kalori,
+                    meal_count=count,
+                )
+                for (day, food_type), (kalori, count) in totals.items()
+            ],
+        )
+
+
+def remove_calorie(db: Session, calorie: Calorie, food_type: Optional[str] = None):
+    # Call when soft deleting a meal, in the same transaction. The meal comes
+    # off the row it was added to; food_type is only used for meals recorded
+    # without their type
+    if calorie.food_type is not None:
+        food_type = calorie.food_type
+    db.query(CalorieRollup).filter(
+        CalorieRollup.user_id == calorie.user_id,
+        CalorieRollup.day == calorie.created_at.date(),
+        CalorieRollup.type == (food_type or ""),
+    ).update(
+        {
+            CalorieRollup.total_kalori: CalorieRollup.total_kalori
+            - (calorie.jumlah_kalori or 0),
+            CalorieRollup.meal_count: CalorieRollup.meal_count - 1,
+        },
+        synchronize_session=False,
+    )
+
+
+def rebuild(
+    db: Session, user_id: Optional[int] = None, since: Optional[date] = None
+) -> int:
+    # Recomputes the rollup from the Calorie rows, for everyone or one user and
+    # optionally from a given day on. Returns the number of rollup rows.
+    delete = db.query(CalorieRollup)
+    if user_id is not None:
+        delete = delete.filter(CalorieRollup.user_id == user_id)
+    if since is not None:
+        delete = delete.filter(CalorieRollup.day >= since)
+    delete.delete(synchronize_session=False)
+
+    day = func.date(Calorie.created_at)
+    # The type the meal was recorded with, else its food's current type
+    type = func.coalesce(Calorie.food_type, Food.type, "")
+    totals = (
+        select(
+            Calorie.user_id,
+            day,
+            type,
+            func.coalesce(func.sum(Calorie.jumlah_kalori), 0),
+            func.count(Calorie.id),
+        )
+        .outerjoin(Food, Food.id == Calorie.food_id)
+        .where(Calorie.user_id.isnot(None), Calorie.deleted_at.is_(None))
+        .group_by(Calorie.user_id, day, type)
+    )
+    if user_id is not None:
+        totals = totals.where(Calorie.user_id == user_id)
+    if since is not None:
+        totals = totals.where(Calorie.created_at >= datetime.combine(since, time.min))
+
+    result = db.execute(
+        insert(CalorieRollup).from_select(
+            ["user_id", "day", "type", "total_kalori", "meal_count"], totals
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.rollup", description="Maintain the CalorieRollup table"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser(
+        "rebuild",
+        help="Create the table if needed and recompute it from the Calorie rows",
+    )
+    rebuild_parser.add_argument("--user-id", type=int, help="Only this user")
+    rebuild_parser.add_argument(
+        "--since", type=date.fromisoformat, help="Only days from YYYY-MM-DD on"
+    )
+    args = parser.parse_args(argv)
+
+    rollup_table.create(bind=get_engine(), checkfirst=True)
+    db = SessionLocal()
+    try:
+        rows = rebuild(db, user_id=args.user_id, since=args.since)
+    finally:
+        db.close()
+    print(f"Rebuilt {rows} rollup rows")
+
+
+if __name__ == "__main__":
+    main()
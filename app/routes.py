@@ -1,28 +1,80 @@
+import base64
+import binascii
+import csv
+import io
+import random
+import uuid
 from datetime import date, datetime, time, timedelta
-from typing import Optional
-
-from fastapi import APIRouter, Body, Depends, File, HTTPException, Query, UploadFile
-from sqlalchemy import func
+from typing import List, Optional, Set, Tuple
+
+import orjson
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    File,
+    Header,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-
-from app.database import get_db
-from app.gcs import upload_to_gcs
-from app.models import Account, Calorie, Food, User
-from app.prediction import predict_food_id
+from starlette.concurrency import run_in_threadpool
+
+from app.catalog import food_catalog
+from app.database import get_async_db, get_db, mark_write
+from app.etag import etag_matches, not_modified
+from app.gcs import upload_processed_image
+from app.history import ages, daily_totals, harris_benedict, moving_average
+from app.idempotency import fingerprint, idempotency_store
+from app.imaging import (
+    preprocess_image,
+    preprocess_image_async,
+    read_upload,
+    read_upload_async,
+)
+from app.models import Account, Calorie, CalorieRollup, Food, User
+from app.pipeline import IngestJob, pipeline
+from app.prediction import predict_food_id, prediction_cache
+from app.ratelimit import (
+    calories_rate_limit,
+    inference_stage,
+    profile_image_rate_limit,
+    register_rate_limit,
+    upload_stage,
+)
+from app.rollup import add_calorie, add_calories, remove_calorie
 from app.schemas import (
     AccountCreate,
+    CalorieBulkCreate,
+    CalorieEntry,
     FoodDetail,
     FoodList,
     FoodSummary,
+    InferenceBatchRequest,
+    MealList,
     UserCreate,
     UserUpdate,
 )
-from app.security import get_current_account, get_hashed_password
+from app.security import (
+    Principal,
+    get_current_account,
+    get_current_principal,
+    get_hashed_password,
+    get_read_db,
+    invalidate_principal,
+)
+from app.summary_cache import summary_cache
 
 router = APIRouter()
 
 
-@router.post("/register")
+@router.post("/register", dependencies=[Depends(register_rate_limit)])
 def register(account: AccountCreate, db: Session = Depends(get_db)):
     # Check if the username or email is already registered
     existing_account = (
@@ -71,6 +123,8 @@ def create_user(
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    invalidate_principal(current_account.id)
+    mark_write(current_account.id)
 
     return {"message": "User created successfully", "user_id": new_user.id}
 
@@ -112,26 +166,31 @@ def update_user(
     user.updated_at = func.current_timestamp()
     current_account.updated_at = func.current_timestamp()
     db.commit()
+    invalidate_principal(current_account.id)
+    mark_write(current_account.id)
+    # Weight, height and birthdate feed the calorie targets
+    summary_cache.invalidate_profile(user.id)
 
     return {"message": "User updated successfully"}
 
 
-@router.post("/users/profile-image")
+@router.post("/users/profile-image", dependencies=[Depends(profile_image_rate_limit)])
 def upload_profile_image(
     profile_image: UploadFile = File(...),
-    current_account: Account = Depends(get_current_account),
+    current_account: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db),
 ):
-    # Upload profile image to GCS and get the public URL
+    # Downscale the profile image, upload it to GCS and get the public URL
     if profile_image:
+        processed = preprocess_image(read_upload(profile_image))
         filename = f"profile_image/{current_account.id}"
-        filename = filename + "." + profile_image.filename.split(".")[-1]
-        image_url = upload_to_gcs(profile_image, filename)
+        with upload_stage.slot():
+            image_url = upload_processed_image(processed, filename)
     else:
         raise HTTPException(status_code=400, detail="No profile image provided")
 
     # Retrieve the current user from the database
-    current_user = db.query(User).filter(User.account_id == current_account.id).first()
+    current_user = db.query(User).filter(User.id == current_account.user_id).first()
 
     if not current_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -140,26 +199,31 @@ def upload_profile_image(
     current_user.profile_image_url = image_url
     current_user.updated_at = func.current_timestamp()
     db.commit()
+    mark_write(current_account.id)
 
     return {"message": "Profile image uploaded successfully", "image_url": image_url}
 
 
-@router.put("/users/profile-image/{user_id}")
+@router.put(
+    "/users/profile-image/{user_id}",
+    dependencies=[Depends(profile_image_rate_limit)],
+)
 def update_profile_image(
     profile_image: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_account: Account = Depends(get_current_account),
+    current_account: Principal = Depends(get_current_principal),
 ):
-    # Upload profile image to GCS and get the public URL
+    # Downscale the profile image, upload it to GCS and get the public URL
     if profile_image:
+        processed = preprocess_image(read_upload(profile_image))
         filename = f"profile_image/{current_account.id}"
-        filename = filename + "." + profile_image.filename.split(".")[-1]
-        image_url = upload_to_gcs(profile_image, filename)
+        with upload_stage.slot():
+            image_url = upload_processed_image(processed, filename)
     else:
         raise HTTPException(status_code=400, detail="No profile image provided")
 
     # Retrieve the current user from the database
-    current_user = db.query(User).filter(User.account_id == current_account.id).first()
+    current_user = db.query(User).filter(User.id == current_account.user_id).first()
 
     if not current_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -169,118 +233,714 @@ def update_profile_image(
     current_user.updated_at = func.current_timestamp()
 
     db.commit()
+    mark_write(current_account.id)
 
     return {"message": "Profile image updated successfully", "image_url": image_url}
 
 
-@router.get("/foods", response_model=FoodList)
+FOOD_FIELDS = {
+    "id": Food.id,
+    "name": Food.name,
+    "type": Food.type,
+    "jumlah_kalori": Food.jumlah_kalori,
+    "thumbnail": Food.thumbnail,
+}
+
+
+# Rows per page read for an NDJSON food stream
+FOODS_CHUNK_ROWS = 500
+
+
+def _food_columns(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(FOOD_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in FOOD_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    # The id is always selected, it is the pagination key
+    return ["id"] + [name for name in names if name != "id"]
+
+
+# The handler returns pre-serialized bodies, so the schema is documented here
+# rather than enforced through response_model
+FOODS_RESPONSES = {
+    200: {
+        "model": FoodList,
+        "description": "The foods. With `fields`, each food has only those fields "
+        "and its id; with format=ndjson, one food object per line and no "
+        "next_cursor.",
+        "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+    },
+    304: {"description": "The catalog matches If-None-Match"},
+}
+
+
+@router.get("/foods", responses=FOODS_RESPONSES)
 def get_foods(
-    db: Session = Depends(get_db),
-    current_account: Account = Depends(get_current_account),
+    db: Session = Depends(get_read_db),
+    current_account: Principal = Depends(get_current_principal),
     type: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=1, description="Food name prefix"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields"),
+    cursor: Optional[int] = Query(None, description="next_cursor of the last page"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    format: str = Query("json", regex="^(json|ndjson)$"),
+    if_none_match: Optional[str] = Header(None),
 ):
-    query = db.query(Food)
+    if not (q or fields or cursor or limit or format == "ndjson"):
+        # The full catalog is served from the in-process cache as
+        # pre-serialized JSON
+        body, etag = food_catalog.serialized(db, type)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+        )
+
+    # Keyset pagination over the primary key, selecting only the requested
+    # columns
+    names = _food_columns(fields)
+    query = db.query(*[FOOD_FIELDS[name] for name in names])
     if type:
         query = query.filter(Food.type == type)
-    foods = query.all()
-    food_list = FoodList(foods=[food.__dict__ for food in foods])
-    return food_list
+    if q:
+        prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(Food.name.like(prefix + "%", escape="\\"))
+    if cursor:
+        query = query.filter(Food.id > cursor)
+    query = query.order_by(Food.id)
+
+    if format == "ndjson":
+        # Streamed to bulk sync clients in keyset pages, so only one page is
+        # in memory at a time whatever the driver buffers
+        def ndjson():
+            remaining = limit
+            last_id = None
+            while remaining is None or remaining > 0:
+                size = min(FOODS_CHUNK_ROWS, remaining or FOODS_CHUNK_ROWS)
+                page = query if last_id is None else query.filter(Food.id > last_id)
+                rows = page.limit(size).all()
+                db.rollback()
+                if rows:
+                    yield b"".join(
+                        orjson.dumps(dict(zip(names, row))) + b"\n" for row in rows
+                    )
+                if len(rows) < size:
+                    return
+                last_id = rows[-1][0]
+                if remaining is not None:
+                    remaining -= len(rows)
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    limit = limit or 100
+    rows = query.limit(limit + 1).all()
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+
+    return ORJSONResponse(
+        {
+            "foods": [dict(zip(names, row)) for row in rows[:limit]],
+            "next_cursor": next_cursor,
+        }
+    )
+
 
 @router.get("/foods/daily")
 def get_food_by_day(
     date: date,
-    db: Session = Depends(get_db),
-    current_account: Account = Depends(get_current_account),
+    db: Session = Depends(get_read_db),
+    current_account: Principal = Depends(get_current_principal),
 ) -> FoodSummary:
-    user = db.query(User).filter(User.account_id == current_account.id).first()
-    if not user:
+    # The user id comes with the authenticated principal
+    user_id = current_account.user_id
+    if not user_id:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_id = user.id
+    # Calculate the start and end of the day
+    start_date = datetime.combine(date, time.min)
+    end_date = datetime.combine(date, time.max)
 
-    calories = (
-        db.query(Calorie)
-        .filter(func.DATE(Calorie.created_at) == date, Calorie.user_id == user_id)
+    # Join each meal to its food so the whole day is a single query; the
+    # per-type totals are summed from the same rows, which keeps the query
+    # free of window functions (MySQL 8.0+)
+    rows = (
+        db.query(Food.id, Food.name, Food.type, Food.jumlah_kalori)
+        .join(Calorie, Calorie.food_id == Food.id)
+        .filter(
+            Calorie.user_id == user_id,
+            Calorie.created_at >= start_date,
+            Calorie.created_at <= end_date,
+            Calorie.deleted_at.is_(None),
+        )
+        .order_by(Calorie.created_at, Calorie.id)
         .all()
     )
 
     food_details = []
     total_by_type = {}
-
-    for calorie in calories:
-        food = db.query(Food).filter(Food.id == calorie.food_id).first()
-        if food:
-            food_detail = FoodDetail(
-                food_id=food.id, name=food.name, jumlah_kalori=food.jumlah_kalori
-            )
-            food_details.append(food_detail)
-
-            if food.type not in total_by_type:
-                total_by_type[food.type] = food.jumlah_kalori
-            else:
-                total_by_type[food.type] += food.jumlah_kalori
+    for row in rows:
+        food_details.append(
+            FoodDetail(food_id=row.id, name=row.name, jumlah_kalori=row.jumlah_kalori)
+        )
+        total_by_type[row.type] = total_by_type.get(row.type, 0) + row.jumlah_kalori
 
     food_summary = FoodSummary(food_details=food_details, total_by_type=total_by_type)
 
     return food_summary
 
 
-@router.post("/calories")
-def record_calorie_consumption(
-    db: Session = Depends(get_db),
-    current_account: Account = Depends(get_current_account),
-    image: UploadFile = File(...),
-):
-    # Upload the image file to Google Cloud Storage (GCS) and get the public URL
-    if image:
-        filename = f"food_inference/{current_account.username}/{int(time.time())}"
-        filename = filename + "." + image.filename.split(".")[-1]
-        image_url = upload_to_gcs(image, filename)
-    else:
-        raise HTTPException(status_code=400, detail="No image provided")
+def _recorded_calorie(db: Session, user_id: int, idempotency_key: str):
+    return (
+        db.query(Calorie.id)
+        .filter(Calorie.user_id == user_id, Calorie.idempotency_key == idempotency_key)
+        .scalar()
+    )
+
+
+def _record_calorie(
+    db: Session,
+    current_account: Principal,
+    data: bytes,
+    idempotency_key: Optional[str] = None,
+) -> dict:
+    recorded = "Calorie consumption recorded successfully"
 
-    food_id = predict_food_id(image_url)
+    # The user id comes with the authenticated principal
+    if not current_account.user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # The key is stored on the meal too, so a retry still finds it after its
+    # idempotency cache entry is gone
+    if idempotency_key:
+        calorie_id = _recorded_calorie(db, current_account.user_id, idempotency_key)
+        if calorie_id:
+            return {"message": recorded, "calorie_id": calorie_id}
+        # Ends the read so the connection goes back to the pool instead of
+        # idling in a transaction through the upload and inference
+        db.rollback()
+
+    processed = preprocess_image(data) if prediction_cache.perceptual else None
+
+    # Re-sent photos reuse the earlier upload and prediction
+    cache_key = prediction_cache.key(current_account.id, data, processed)
+    cached = prediction_cache.get(cache_key)
+    if cached:
+        image_url = cached["image_url"]
+        food_id = cached["food_id"]
+    else:
+        # Downscale the image to the model input size, upload it to Google
+        # Cloud Storage (GCS) and get the public URL. Random names never
+        # collide, unlike the per-second timestamps used before.
+        if processed is None:
+            processed = preprocess_image(data)
+        filename = f"food_inference/{current_account.username}/{uuid.uuid4().hex}"
+        # Each stage sheds with a 503 when it is full rather than queuing
+        with upload_stage.slot():
+            image_url = upload_processed_image(processed, filename)
+        with inference_stage.slot():
+            food_id = predict_food_id(image_url)
+        prediction_cache.set(cache_key, food_id, image_url)
 
     # Check if the food type exists
-    food = db.query(Food).filter(Food.id == food_id).first()
+    food = food_catalog.get(db, food_id)
     if not food:
         raise HTTPException(status_code=404, detail="Food not found")
 
-    # Retrieve the user based on the current account ID
-    user = db.query(User).filter(User.account_id == current_account.id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # Create a new calorie record
     new_calorie = Calorie(
-        user_id=user.id,
+        user_id=current_account.user_id,
         food_id=food_id,
         jumlah_kalori=food.jumlah_kalori,
         food_image_url=image_url,
+        idempotency_key=idempotency_key,
     )
 
     db.add(new_calorie)
-    db.commit()
+    try:
+        add_calorie(db, new_calorie, food.type)
+        db.commit()
+    except IntegrityError:
+        # A concurrent request with the same key recorded the meal first
+        db.rollback()
+        calorie_id = idempotency_key and _recorded_calorie(
+            db, current_account.user_id, idempotency_key
+        )
+        if not calorie_id:
+            raise
+        return {"message": recorded, "calorie_id": calorie_id}
     db.refresh(new_calorie)
+    mark_write(current_account.id)
+    summary_cache.invalidate_day(new_calorie.user_id, new_calorie.created_at.date())
+
+    return {"message": recorded, "calorie_id": new_calorie.id}
+
+
+@router.post("/calories", dependencies=[Depends(calories_rate_limit)])
+def record_calorie_consumption(
+    db: Session = Depends(get_db),
+    current_account: Principal = Depends(get_current_principal),
+    image: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=64),
+):
+    if not image:
+        raise HTTPException(status_code=400, detail="No image provided")
+
+    data = read_upload(image)
+    if not idempotency_key:
+        return _record_calorie(db, current_account, data)
+
+    # A retry with the same Idempotency-Key gets the original response, with
+    # no second upload, inference or insert
+    request_fingerprint = fingerprint(data)
+    replay = idempotency_store.begin(
+        current_account.id, "calories", idempotency_key, request_fingerprint
+    )
+    if replay is not None:
+        return replay
+    try:
+        result = _record_calorie(db, current_account, data, idempotency_key)
+    except Exception:
+        idempotency_store.release(current_account.id, "calories", idempotency_key)
+        raise
+    idempotency_store.complete(
+        current_account.id, "calories", idempotency_key, request_fingerprint, result
+    )
+    return result
+
+
+# Client timestamps further ahead than this are rejected
+BULK_MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def _record_calorie_entries(
+    db: Session, user_id: int, entries: List[CalorieEntry]
+) -> Tuple[List[dict], Set[date]]:
+    # Returns the per-entry results and the days that gained meals. Repeated
+    # keys within the batch share the first entry's result.
+    results = {}
+    pending = {}
+    now = datetime.now()
+    for entry in entries:
+        key = entry.idempotency_key
+        if key in results or key in pending:
+            continue
+        consumed_at = entry.consumed_at
+        if consumed_at.tzinfo is not None:
+            # Stored as naive local time, like CURRENT_TIMESTAMP
+            consumed_at = consumed_at.astimezone().replace(tzinfo=None)
+        if consumed_at > now + BULK_MAX_CLOCK_SKEW:
+            results[key] = {
+                "status": "rejected",
+                "error": "consumed_at is in the future",
+            }
+            continue
+        pending[key] = (entry, consumed_at)
+
+    # Entries recorded by an earlier replay of the same queue
+    if pending:
+        for key, calorie_id in db.query(Calorie.idempotency_key, Calorie.id).filter(
+            Calorie.user_id == user_id, Calorie.idempotency_key.in_(list(pending))
+        ):
+            results[key] = {"status": "duplicate", "calorie_id": calorie_id}
+            del pending[key]
+
+    # All foods in one IN query
+    food_ids = {entry.food_id for entry, _ in pending.values()}
+    foods = {}
+    if food_ids:
+        rows = db.query(Food.id, Food.type, Food.jumlah_kalori).filter(
+            Food.id.in_(food_ids)
+        )
+        foods = {food.id: food for food in rows}
+    rows = []
+    for key, (entry, consumed_at) in list(pending.items()):
+        food = foods.get(entry.food_id)
+        if food is None:
+            results[key] = {"status": "rejected", "error": "Food not found"}
+            del pending[key]
+            continue
+        rows.append(
+            {
+                "user_id": user_id,
+                "food_id": food.id,
+                "jumlah_kalori": food.jumlah_kalori,
+                "food_image_url": entry.food_image_url,
+                "idempotency_key": key,
+                "food_type": food.type,
+                "created_at": consumed_at,
+                "updated_at": now,
+            }
+        )
+
+    if rows:
+        # One executemany for the meals and one for their rollup rows
+        db.execute(insert(Calorie), rows)
+        add_calories(
+            db,
+            user_id,
+            [
+                (
+                    row["created_at"].date(),
+                    row["food_type"],
+                    row["jumlah_kalori"],
+                )
+                for row in rows
+            ],
+        )
+        for key, calorie_id in db.query(Calorie.idempotency_key, Calorie.id).filter(
+            Calorie.user_id == user_id, Calorie.idempotency_key.in_(list(pending))
+        ):
+            results[key] = {"status": "created", "calorie_id": calorie_id}
+
+    return [
+        {"idempotency_key": entry.idempotency_key, **results[entry.idempotency_key]}
+        for entry in entries
+    ], {row["created_at"].date() for row in rows}
+
+
+@router.post("/calories/bulk")
+def record_calorie_consumption_bulk(
+    request: CalorieBulkCreate,
+    db: Session = Depends(get_db),
+    current_account: Principal = Depends(get_current_principal),
+):
+    # Replays of meals queued offline: one transaction for the whole batch,
+    # with per-entry results. Entries whose idempotency_key was already
+    # recorded for this user are reported as duplicates, not inserted again.
+    user_id = current_account.user_id
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        results, days = _record_calorie_entries(db, user_id, request.entries)
+        db.commit()
+    except IntegrityError:
+        # A concurrent replay inserted some of the same keys first; with its
+        # rows committed, a second pass reports them as duplicates
+        db.rollback()
+        results, days = _record_calorie_entries(db, user_id, request.entries)
+        db.commit()
+
+    if days:
+        mark_write(current_account.id)
+        for day in days:
+            summary_cache.invalidate_day(user_id, day)
+
+    return {"results": results}
+
+
+@router.delete("/calories/{calorie_id}")
+def delete_calorie(
+    calorie_id: int,
+    db: Session = Depends(get_db),
+    current_account: Principal = Depends(get_current_principal),
+):
+    calorie = (
+        db.query(Calorie)
+        .filter(Calorie.id == calorie_id, Calorie.deleted_at.is_(None))
+        .first()
+    )
+    if not calorie or calorie.user_id != current_account.user_id:
+        raise HTTPException(status_code=404, detail="Calorie record not found")
+
+    # Soft delete; the deleted_at guard makes a concurrent second delete a
+    # no-op so the rollup is only decremented once
+    deleted = (
+        db.query(Calorie)
+        .filter(Calorie.id == calorie_id, Calorie.deleted_at.is_(None))
+        .update({Calorie.deleted_at: func.current_timestamp()})
+    )
+    day = calorie.created_at.date()
+    if deleted:
+        food_type = calorie.food_type
+        if food_type is None:
+            food = food_catalog.get(db, calorie.food_id)
+            food_type = food.type if food else None
+        remove_calorie(db, calorie, food_type)
+    db.commit()
+    mark_write(current_account.id)
+    summary_cache.invalidate_day(current_account.user_id, day)
+
+    return {"message": "Calorie record deleted successfully"}
+
+
+@router.post(
+    "/calories/async",
+    status_code=202,
+    dependencies=[Depends(calories_rate_limit)],
+)
+async def record_calorie_consumption_async(
+    current_account: Principal = Depends(get_current_principal),
+    image: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=64),
+):
+    if not image:
+        raise HTTPException(status_code=400, detail="No image provided")
+
+    # Read the image now; the upload file is closed once the request ends
+    data = await read_upload_async(image)
+
+    # A retry with the same Idempotency-Key gets the original job back
+    if idempotency_key:
+        request_fingerprint = fingerprint(data)
+        replay = idempotency_store.begin(
+            current_account.id, "calories-async", idempotency_key, request_fingerprint
+        )
+        if replay is not None:
+            return replay
+        try:
+            result = await _submit_calorie_job(current_account, data, idempotency_key)
+        except Exception:
+            idempotency_store.release(
+                current_account.id, "calories-async", idempotency_key
+            )
+            raise
+        idempotency_store.complete(
+            current_account.id,
+            "calories-async",
+            idempotency_key,
+            request_fingerprint,
+            result,
+            status_code=202,
+        )
+        return result
+
+    return await _submit_calorie_job(current_account, data)
+
+
+async def _submit_calorie_job(
+    current_account: Principal, data: bytes, idempotency_key: Optional[str] = None
+) -> dict:
+    processed = None
+    if prediction_cache.perceptual:
+        processed = await preprocess_image_async(data)
+
+    # Re-sent photos reuse the earlier upload and prediction, leaving only the
+    # insert to the pipeline
+    cache_key = prediction_cache.key(current_account.id, data, processed)
+    cached = prediction_cache.get(cache_key)
+    if cached:
+        job = IngestJob(current_account.id, "", None, b"")
+        job.image_url = cached["image_url"]
+        job.food_id = cached["food_id"]
+    else:
+        if processed is None:
+            processed = await preprocess_image_async(data)
+        filename = f"food_inference/{current_account.username}/{uuid.uuid4().hex}"
+        job = IngestJob(
+            current_account.id,
+            f"{filename}.{processed.extension}",
+            processed.content_type,
+            processed.image,
+            thumbnail=processed.thumbnail,
+        )
+        job.cache_key = cache_key
+    job.idempotency_key = idempotency_key
+
+    # Upload, inference and insert run in the ingestion pipeline workers
+    pipeline.submit(job)
 
     return {
-        "message": "Calorie consumption recorded successfully",
-        "calorie_id": new_calorie.id,
+        "message": "Calorie consumption queued",
+        "job_id": job.id,
+        "status": job.status,
     }
 
 
-@router.get("/calories/summary-day")
-def get_daily_calorie_summary(
-    date: date = Query(date.today(), description="Date for the summary"),
-    db: Session = Depends(get_db),
-    current_account: Account = Depends(get_current_account),
+@router.get("/calories/jobs/{job_id}")
+def get_calorie_job(
+    job_id: str,
+    current_account: Principal = Depends(get_current_principal),
 ):
-    # Calculate the start and end of the day
-    start_date = datetime.combine(date, time.min)
-    end_date = datetime.combine(date, time.max)
+    job = pipeline.get(job_id)
+    if not job or job.account_id != current_account.id:
+        raise HTTPException(status_code=404, detail="Job not found")
 
-    # Retrieve the user based on the current account ID
-    user = db.query(User).filter(User.account_id == current_account.id).first()
+    return job.to_dict()
+
+
+MEAL_FIELDS = {
+    "id": Calorie.id,
+    "food_id": Calorie.food_id,
+    "name": Food.name,
+    "type": Food.type,
+    "jumlah_kalori": Calorie.jumlah_kalori,
+    "food_image_url": Calorie.food_image_url,
+    "created_at": Calorie.created_at,
+}
+# Rows per chunk written to an export stream
+EXPORT_CHUNK_ROWS = 500
+
+
+def _encode_meal_cursor(created_at: datetime, calorie_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{calorie_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_meal_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, calorie_id = raw.decode().split("|")
+        return datetime.fromisoformat(created_at), int(calorie_id)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _meal_history_query(
+    user_id: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+    after: Optional[Tuple[datetime, int]] = None,
+):
+    # A user's meals in (created_at, id) order; the index on (user_id,
+    # created_at, which the (user_id, created_at) index serves without
+    # sorting. A statement rather than a Query, so that both sync and async
+    # sessions can run it.
+    query = (
+        select(*MEAL_FIELDS.values())
+        .join(Food, Food.id == Calorie.food_id)
+        .where(Calorie.user_id == user_id, Calorie.deleted_at.is_(None))
+    )
+    if start_date:
+        query = query.where(
+            Calorie.created_at >= datetime.combine(start_date, time.min)
+        )
+    if end_date:
+        query = query.where(Calorie.created_at <= datetime.combine(end_date, time.max))
+    if after:
+        # Keyset condition written out rather than as a row comparison, so
+        # MySQL uses it as an index range
+        created_at, calorie_id = after
+        query = query.where(
+            Calorie.created_at >= created_at,
+            or_(Calorie.created_at > created_at, Calorie.id > calorie_id),
+        )
+    return query.order_by(Calorie.created_at, Calorie.id)
+
+
+def _meal_history_chunks(
+    db: Session,
+    user_id: int,
+    start_date: Optional[date],
+    end_date: Optional[date],
+):
+    # The history in keyset pages of EXPORT_CHUNK_ROWS, so only one page is in
+    # memory at a time whatever the driver buffers. Each page ends its read,
+    # so a slow client does not hold a connection between pages.
+    after = None
+    while True:
+        query = _meal_history_query(user_id, start_date, end_date, after)
+        rows = db.execute(query.limit(EXPORT_CHUNK_ROWS)).all()
+        db.rollback()
+        if rows:
+            yield rows
+        if len(rows) < EXPORT_CHUNK_ROWS:
+            return
+        after = (rows[-1].created_at, rows[-1].id)
+
+
+def _meal_row(row) -> dict:
+    meal = dict(zip(MEAL_FIELDS, row))
+    meal["created_at"] = meal["created_at"].isoformat()
+    return meal
+
+
+@router.get("/calories", response_model=MealList)
+async def get_meal_history(
+    start_date: Optional[date] = Query(None, description="First day to include"),
+    end_date: Optional[date] = Query(None, description="Last day to include"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the last page"),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_read_db),
+    async_db: Optional[AsyncSession] = Depends(get_async_db),
+    current_account: Principal = Depends(get_current_principal),
+):
+    user_id = current_account.user_id
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    after = _decode_meal_cursor(cursor) if cursor else None
+    query = _meal_history_query(user_id, start_date, end_date, after).limit(limit + 1)
+    if async_db is not None:
+        # On the event loop with DB_ASYNC_DRIVER, without taking a thread
+        rows = (await async_db.execute(query)).all()
+    else:
+        rows = await run_in_threadpool(lambda: db.execute(query).all())
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_meal_cursor(last.created_at, last.id)
+
+    return ORJSONResponse(
+        {"meals": [_meal_row(row) for row in rows[:limit]], "next_cursor": next_cursor}
+    )
+
+
+@router.get("/calories/export")
+def export_meal_history(
+    format: str = Query("csv", regex="^(csv|ndjson)$"),
+    start_date: Optional[date] = Query(None, description="First day to include"),
+    end_date: Optional[date] = Query(None, description="Last day to include"),
+    db: Session = Depends(get_read_db),
+    current_account: Principal = Depends(get_current_principal),
+):
+    user_id = current_account.user_id
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    chunks = _meal_history_chunks(db, user_id, start_date, end_date)
+
+    if format == "ndjson":
+
+        def ndjson():
+            for partition in chunks:
+                yield b"".join(
+                    orjson.dumps(_meal_row(row)) + b"\n" for row in partition
+                )
+
+        return StreamingResponse(
+            ndjson(),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": 'attachment; filename="meals.ndjson"'},
+        )
+
+    def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(MEAL_FIELDS)
+        for partition in chunks:
+            for row in partition:
+                writer.writerow(_meal_row(row).values())
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Just the header when there are no meals
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return StreamingResponse(
+        csv_rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="meals.csv"'},
+    )
+
+
+def calculate_target_kalori(user: User, age):
+    # Harris-Benedict target for the user at the given age (or array of ages)
+    return harris_benedict(
+        user.gender, float(user.berat_badan), float(user.tinggi_badan), age
+    )
+
+
+def _daily_summary(db: Session, user_id: int, date: date) -> dict:
+    # Retrieve the user based on the principal's user ID
+    user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -289,25 +949,12 @@ def get_daily_calorie_summary(
     age = (date - birthdate) // timedelta(days=365.2425)  # Approximation for leap years
 
     # Compute target_kalori based on gender and user's information
-    gender = user.gender.lower()
-    weight = float(user.berat_badan)
-    height = float(user.tinggi_badan)
-
-    if gender == "male":
-        target_kalori = 66.5 + (13.75 * weight) + (5.003 * height) - (6.75 * age)
-    elif gender == "female":
-        target_kalori = 655.1 + (9.563 * weight) + (1.85 * height) - (4.676 * age)
-    else:
-        target_kalori = 0
+    target_kalori = calculate_target_kalori(user, age)
 
-    # Query the database to get the calorie consumption summary for the day
+    # Read the day's total from the precomputed rollup
     summary = (
-        db.query(func.sum(Calorie.jumlah_kalori).label("total_kalori_masuk"))
-        .filter(
-            Calorie.user_id == user.id,
-            Calorie.created_at >= start_date,
-            Calorie.created_at <= end_date,
-        )
+        db.query(func.sum(CalorieRollup.total_kalori).label("total_kalori_masuk"))
+        .filter(CalorieRollup.user_id == user.id, CalorieRollup.day == date)
         .first()
     )
 
@@ -327,60 +974,145 @@ def get_daily_calorie_summary(
     }
 
 
+@router.get("/calories/summary-day")
+def get_daily_calorie_summary(
+    date: date = Query(None, description="Date for the summary, default today"),
+    db: Session = Depends(get_read_db),
+    current_account: Principal = Depends(get_current_principal),
+    if_none_match: Optional[str] = Header(None),
+):
+    date = date or datetime.now().date()
+    user_id = current_account.user_id
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Served from the summary cache until the user logs or deletes a meal on
+    # that day or changes their profile
+    key = summary_cache.key("day", user_id, date, date)
+    return summary_cache.respond(
+        key, lambda: _daily_summary(db, user_id, date), if_none_match
+    )
+
+
+def _daily_rollup(db: Session, user_id: int, start_date: date, end_date: date):
+    # Per-day totals for the range as one indexed range query on the rollup,
+    # gap-filled with zeros
+    rows = (
+        db.query(CalorieRollup.day, func.sum(CalorieRollup.total_kalori))
+        .filter(
+            CalorieRollup.user_id == user_id,
+            CalorieRollup.day >= start_date,
+            CalorieRollup.day <= end_date,
+        )
+        .group_by(CalorieRollup.day)
+        .all()
+    )
+    return daily_totals(rows, start_date, end_date)
+
+
+def _weekly_summary(db: Session, user_id: int, start_date: date, end_date: date):
+    # Read the per-day totals for the week from the precomputed rollup
+    days, totals = _daily_rollup(db, user_id, start_date, end_date)
+
+    return [
+        {"date": day, "total_kalori_masuk": total}
+        for day, total in zip(days.tolist(), totals.tolist())
+    ]
+
+
 @router.get("/calories/summary-week")
 def get_weekly_calorie_summary(
     start_date: date = Query(None, description="Start date for the summary"),
     end_date: date = Query(None, description="End date for the summary"),
-    db: Session = Depends(get_db),
-    current_account: Account = Depends(get_current_account),
+    db: Session = Depends(get_read_db),
+    current_account: Principal = Depends(get_current_principal),
+    if_none_match: Optional[str] = Header(None),
 ):
     if not start_date or not end_date:
         # Calculate the start and end dates for the week
         start_date = date.today() - timedelta(days=date.today().weekday())
         end_date = start_date + timedelta(days=6)
 
-    # Retrieve the user based on the current account ID
-    user = db.query(User).filter(User.account_id == current_account.id).first()
-    if not user:
+    # The user id comes with the authenticated principal
+    user_id = current_account.user_id
+    if not user_id:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Query the database to get the calorie consumption summary for the week
-    summary = (
-        db.query(
-            func.DATE(Calorie.created_at).label("daily"),
-            func.sum(Calorie.jumlah_kalori).label("total_kalori_masuk"),
-        )
-        .filter(
-            Calorie.user_id == user.id,
-            Calorie.created_at >= start_date,
-            Calorie.created_at <= end_date,
-        )
-        .group_by(func.DATE(Calorie.created_at))
-        .order_by(func.DATE(Calorie.created_at))
-        .all()
+    key = summary_cache.key("week", user_id, start_date, end_date)
+    return summary_cache.respond(
+        key, lambda: _weekly_summary(db, user_id, start_date, end_date), if_none_match
     )
 
-    date_list = []
-    current_date = start_date
 
-    while current_date <= end_date:
-        date_list.append(current_date)
-        current_date += timedelta(days=1)
+def _calorie_history(
+    db: Session, user_id: int, start_date: date, end_date: date, window: int
+) -> dict:
+    import numpy as np
 
-    summary_dict = {}
-    for dt, total_kalori_masuk in summary:
-        summary_dict[dt.strftime("%Y%m%d")] = float(total_kalori_masuk)
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Every series is computed over whole arrays, one element per day
+    dates, totals = _daily_rollup(db, user.id, start_date, end_date)
+    averages = moving_average(totals, window)
+    targets = calculate_target_kalori(user, ages(user.birthdate, dates))
+    deficits = np.maximum(targets - totals, 0)
+    surpluses = np.maximum(totals - targets, 0)
 
-    summary_list = []
-    for dt in date_list:
-        summary_list.append(
+    # Built from plain JSON types, so serializing it needs no per-field
+    # encoding
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "window": window,
+        "total_kalori_masuk": float(totals.sum()),
+        "average_kalori_masuk": float(totals.mean()),
+        "total_kalori_kurang": float(deficits.sum()),
+        "total_kalori_berlebih": float(surpluses.sum()),
+        "days": [
             {
-                "date": dt,
-                "total_kalori_masuk": summary_dict.get(dt.strftime("%Y%m%d"), 0),
+                "date": day,
+                "total_kalori_masuk": total,
+                "moving_average": average,
+                "target_kalori": target,
+                "total_kalori_kurang": deficit,
+                "total_kalori_berlebih": surplus,
             }
-        )
+            for day, total, average, target, deficit, surplus in zip(
+                np.datetime_as_string(dates).tolist(),
+                totals.tolist(),
+                averages.tolist(),
+                np.broadcast_to(targets, totals.shape).tolist(),
+                deficits.tolist(),
+                surpluses.tolist(),
+            )
+        ],
+    }
+
+
+@router.get("/calories/summary-history")
+def get_calorie_history(
+    days: int = Query(30, ge=1, le=366, description="Number of days to return"),
+    end_date: date = Query(None, description="Last day of the history"),
+    window: int = Query(7, ge=1, le=90, description="Moving average window"),
+    db: Session = Depends(get_read_db),
+    current_account: Principal = Depends(get_current_principal),
+    if_none_match: Optional[str] = Header(None),
+):
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=days - 1)
 
-    return summary_list
+    user_id = current_account.user_id
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    key = summary_cache.key("history", user_id, start_date, end_date, window)
+    return summary_cache.respond(
+        key,
+        lambda: _calorie_history(db, user_id, start_date, end_date, window),
+        if_none_match,
+    )
 
 
 # Dummy API - To be implemented
@@ -395,3 +1127,16 @@ def infer_food_id(image_url: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="No food found")
 
     return {"food_id": food.id}
+
+
+# Dummy API - To be implemented
+# Batched variant of infer_food_id used by the prediction client's
+# micro-batcher; returns one food_id per image URL, in order
+@router.post("/inference/food-id/batch")
+def infer_food_id_batch(request: InferenceBatchRequest, db: Session = Depends(get_db)):
+    food_ids = [food_id for (food_id,) in db.query(Food.id).all()]
+
+    if not food_ids:
+        raise HTTPException(status_code=404, detail="No food found")
+
+    return {"food_ids": [random.choice(food_ids) for _ in request.image_urls]}
@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, datetime
 from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
@@ -40,6 +40,7 @@ class FoodItem(BaseModel):
 
 class FoodList(BaseModel):
     foods: List[FoodItem]
+    next_cursor: Optional[int] = None
 
 
 class FoodDetail(BaseModel):
@@ -51,3 +52,33 @@ class FoodDetail(BaseModel):
 class FoodSummary(BaseModel):
     food_details: List[FoodDetail]
     total_by_type: Dict[str, int]
+
+
+class InferenceBatchRequest(BaseModel):
+    image_urls: List[str] = Field(..., min_items=1, max_items=256)
+
+
+class CalorieEntry(BaseModel):
+    food_id: int
+    consumed_at: datetime = Field(..., description="When the meal was eaten")
+    idempotency_key: str = Field(..., min_length=1, max_length=64)
+    food_image_url: Optional[str] = Field(None, min_length=1, max_length=255)
+
+
+class CalorieBulkCreate(BaseModel):
+    entries: List[CalorieEntry] = Field(..., min_items=1, max_items=500)
+
+
+class MealItem(BaseModel):
+    id: int
+    food_id: int
+    name: str
+    type: str
+    jumlah_kalori: int
+    food_image_url: Optional[str] = None
+    created_at: datetime
+
+
+class MealList(BaseModel):
+    meals: List[MealItem]
+    next_cursor: Optional[str] = None
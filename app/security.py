@@ -1,29 +1,71 @@
+import os
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
 
 import jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jwt import InvalidTokenError
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.database import get_db
-from app.models import Account
+from app.cache import create_cache
+from app.database import get_db, read_session
+from app.models import Account, User
+from app.passwords import password_service
 
 SECRET_KEY = "calorties-api-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# "stateless" serves identities from token claims and a short-lived principal
+# cache; "db" loads the identity from the database on every request
+AUTH_MODE = os.getenv("AUTH_MODE", "stateless")
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# Comma-separated usernames allowed to use the /admin endpoints
+ADMIN_USERNAMES = {
+    name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()
+}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+# Shared between workers with CACHE_BACKEND=redis, so that a change made
+# through one worker is not served stale by the others
+principal_cache = create_cache(
+    "principal", maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL
+)
+
+
+class Principal:
+    # Detached snapshot of the authenticated account and its user profile
+    __slots__ = ("id", "username", "nama", "email", "user_id")
+
+    def __init__(
+        self, id: int, username: str, nama: str, email: str, user_id: Optional[int]
+    ):
+        self.id = id
+        self.username = username
+        self.nama = nama
+        self.email = email
+        self.user_id = user_id
+
+    def fields(self) -> list:
+        # JSON-serializable form for the principal cache; Principal(*fields)
+        # rebuilds it
+        return [getattr(self, name) for name in self.__slots__]
 
 
 def get_hashed_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_service.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_service.verify_and_update(plain_password, hashed_password)[0]
+
+
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    return password_service.verify_and_update(plain_password, hashed_password)
 
 
 def create_access_token(
@@ -57,3 +99,101 @@ async def get_current_account(
         raise HTTPException(
             status_code=401, detail="Invalid authentication credentials"
         )
+
+
+def create_account_token(account: Account, user_id: Optional[int] = None) -> str:
+    # The account and user ids let get_current_principal skip the database
+    return create_access_token(
+        data={"sub": account.username, "aid": account.id, "uid": user_id}
+    )
+
+
+def _load_principal(
+    db: Session, *criteria, user_id: Optional[int] = None
+) -> Optional[Principal]:
+    if user_id is not None:
+        # The token names the user profile, so only the account is read
+        row = (
+            db.query(Account.id, Account.username, Account.nama, Account.email)
+            .filter(*criteria)
+            .first()
+        )
+        row = (*row, user_id) if row else None
+    else:
+        row = (
+            db.query(Account.id, Account.username, Account.nama, Account.email, User.id)
+            .outerjoin(User, User.account_id == Account.id)
+            .filter(*criteria)
+            .first()
+        )
+    # Ends the read so the connection goes back to the pool; read endpoints
+    # query through another session and would otherwise hold two at once
+    db.rollback()
+    return Principal(*row) if row else None
+
+
+def invalidate_principal(account_id: int):
+    # Call after changing an account or creating its user profile
+    principal_cache.delete(str(account_id))
+
+
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db),
+) -> Principal:
+    try:
+        payload = jwt.decode(
+            credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM]
+        )
+    except InvalidTokenError:
+        raise HTTPException(
+            status_code=401, detail="Invalid authentication credentials"
+        )
+
+    username: str = payload.get("sub")
+    if username is None:
+        raise HTTPException(
+            status_code=401, detail="Invalid authentication credentials"
+        )
+
+    account_id = payload.get("aid")
+    if AUTH_MODE == "stateless" and account_id is not None:
+        cached = principal_cache.get(str(account_id))
+        principal = Principal(*cached) if cached is not None else None
+        if principal is None:
+            # Off the event loop: a checkout waiting on a full pool would
+            # otherwise stall the requests about to return their connections
+            # Tokens issued before the user profile existed have no uid
+            principal = await run_in_threadpool(
+                _load_principal,
+                db,
+                Account.id == account_id,
+                user_id=payload.get("uid"),
+            )
+            if principal is not None:
+                principal_cache.set(str(account_id), principal.fields())
+        # A renamed account invalidates tokens issued for the old username
+        if principal is None or principal.username != username:
+            raise HTTPException(status_code=401, detail="User not found")
+        return principal
+
+    principal = await run_in_threadpool(
+        _load_principal, db, Account.username == username
+    )
+    if principal is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return principal
+
+
+def get_read_db(current_account: Principal = Depends(get_current_principal)):
+    # Session for read-only endpoints: a healthy replica, or the primary for a
+    # short window after the account's own write
+    yield from read_session(current_account.id)
+
+
+def get_admin_principal(
+    current_account: Principal = Depends(get_current_principal),
+) -> Principal:
+    if current_account.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_account
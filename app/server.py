@@ -0,0 +1,183 @@
+import argparse
+import importlib.util
+import logging
+import math
+import os
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+import uvicorn
+
+from app.cache import CACHE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+# Worker processes; unset sizes them to the CPUs the container may use when
+# the caches and rate limits are shared through Redis, and runs one otherwise
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY")
+# Same default as app/ratelimit.py, read here so the supervisor process does
+# not import the app
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", CACHE_BACKEND)
+# Seconds from SIGTERM until a worker has exited; keep it under the platform's
+# kill timeout. A stopping worker first waits up to GRACEFUL_SHUTDOWN_TIMEOUT
+# for in-flight requests (uploads included), then spends the rest draining
+# queued ingestion jobs (INGEST_DRAIN_TIMEOUT is derived from the two).
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "9"))
+GRACEFUL_SHUTDOWN_TIMEOUT = float(
+    os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", str(SHUTDOWN_TIMEOUT / 2))
+)
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "5"))
+
+
+def _cgroup_cpus() -> Optional[float]:
+    # CPU quota of the container (cgroup v2, then v1), if it has one
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+            quota = int(file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+            period = int(file.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpus()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def share_process_pools(workers: int, cpus: int):
+    # Every worker has its own image and password process pools, which default
+    # to one process per CPU; split the CPUs between the workers instead.
+    # Workers import the app after this, so they see the new defaults.
+    per_worker = str(max(cpus // workers, 1))
+    for name in ("IMAGE_WORKERS", "PASSWORD_WORKERS"):
+        os.environ.setdefault(name, per_worker)
+
+
+def shutdown_timeouts(budget: float, graceful: float) -> Tuple[float, float]:
+    # (graceful, drain) seconds, spent one after the other within the budget
+    graceful = min(graceful, budget)
+    return graceful, budget - graceful
+
+
+def shared_state() -> bool:
+    # Whether the summary, principal, idempotency and read-your-writes caches
+    # and the rate limit buckets are shared between processes. In memory,
+    # every worker has its own: a write through one worker leaves the others
+    # serving stale summaries and ETags, and every limit is multiplied by the
+    # worker count.
+    return CACHE_BACKEND == "redis" and RATE_LIMIT_BACKEND == "redis"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.server", description="Run the API in production mode"
+    )
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(WEB_CONCURRENCY) if WEB_CONCURRENCY else None,
+        help="Default: WEB_CONCURRENCY, or one per available CPU with the Redis "
+        "cache and rate limit backends and one otherwise",
+    )
+    parser.add_argument(
+        "--allow-process-caches",
+        action="store_true",
+        help="Run several workers even though caches and rate limits are kept "
+        "per process, e.g. for benchmarks",
+    )
+    args = parser.parse_args(argv)
+
+    cpus = available_cpus()
+    shared = shared_state()
+    if args.workers and args.workers > 1 and not (shared or args.allow_process_caches):
+        parser.error(
+            f"{args.workers} workers need CACHE_BACKEND=redis and "
+            f"RATE_LIMIT_BACKEND=redis (got {CACHE_BACKEND} and "
+            f"{RATE_LIMIT_BACKEND}): in-memory caches and rate limits are per "
+            "process and go stale or multiply between workers"
+        )
+    workers = args.workers or (cpus if shared else 1)
+    share_process_pools(workers, cpus)
+    graceful, drain = shutdown_timeouts(SHUTDOWN_TIMEOUT, GRACEFUL_SHUTDOWN_TIMEOUT)
+    os.environ["INGEST_DRAIN_TIMEOUT"] = str(drain)
+    # Every worker has its own metrics; with several, each writes snapshots
+    # here and /metrics serves all of them, labelled by worker
+    metrics_dir = None
+    if workers > 1 and not os.getenv("METRICS_DIR"):
+        metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(
+            prefix="calorties-metrics-"
+        )
+
+    # The C event loop and HTTP parser when installed, the pure Python ones
+    # otherwise
+    loop = "uvloop" if _available("uvloop") else "asyncio"
+    http = "httptools" if _available("httptools") else "h11"
+
+    logging.basicConfig(level=logging.INFO)
+    if not shared and workers > 1:
+        logger.warning(
+            "Running %d workers with per-process caches and rate limits; "
+            "summaries may be served stale and limits are per worker",
+            workers,
+        )
+    elif not shared and not args.workers and cpus > 1:
+        logger.info(
+            "Running one worker: set CACHE_BACKEND=redis and "
+            "RATE_LIMIT_BACKEND=redis to run one per CPU"
+        )
+    logger.info(
+        "Starting %d workers on %s:%d (loop=%s, http=%s, %d CPUs, "
+        "shutdown %.1fs graceful + %.1fs drain)",
+        workers,
+        args.host,
+        args.port,
+        loop,
+        http,
+        cpus,
+        graceful,
+        drain,
+    )
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            loop=loop,
+            http=http,
+            timeout_keep_alive=KEEPALIVE_TIMEOUT,
+            timeout_graceful_shutdown=graceful,
+        )
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
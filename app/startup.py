@@ -0,0 +1,84 @@
+import logging
+import os
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy.pool import QueuePool
+
+from app.catalog import preload_catalog
+from app.database import DB_POOL_SIZE, SessionLocal, get_engine
+from app.gcs import GCSStorage, get_storage
+from app.prediction import prediction_client
+
+logger = logging.getLogger(__name__)
+
+# Work done before the app reports ready, comma-separated: "catalog" loads the
+# food catalog, "pool" opens STARTUP_POOL_CONNECTIONS database connections,
+# "storage" and "inference" create the upload and inference clients. Anything
+# left out happens on first use instead, trading a faster cold start for a
+# slower first request.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "catalog")
+STARTUP_POOL_CONNECTIONS = int(os.getenv("STARTUP_POOL_CONNECTIONS", str(DB_POOL_SIZE)))
+
+
+def warm_catalog():
+    db = SessionLocal()
+    try:
+        preload_catalog(db)
+    finally:
+        db.close()
+
+
+def warm_pool():
+    # Connections checked out together and returned stay open in the pool
+    engine = get_engine()
+    size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+    connections = []
+    try:
+        for _ in range(min(STARTUP_POOL_CONNECTIONS, size)):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def warm_storage():
+    # The bucket handle loads the Google client libraries and credentials
+    storage = get_storage()
+    if isinstance(storage, GCSStorage):
+        storage.bucket
+
+
+def warm_inference():
+    # Creates the pooled HTTP session
+    prediction_client.session
+
+
+WARMUPS: Dict[str, Callable[[], None]] = {
+    "catalog": warm_catalog,
+    "pool": warm_pool,
+    "storage": warm_storage,
+    "inference": warm_inference,
+}
+
+
+def warmup_steps(setting: str = STARTUP_WARMUP) -> List[str]:
+    steps = [step.strip() for step in setting.split(",") if step.strip()]
+    unknown = [step for step in steps if step not in WARMUPS]
+    if unknown:
+        raise ValueError(f"Unknown STARTUP_WARMUP steps: {', '.join(unknown)}")
+    return steps
+
+
+def warm_up(steps: List[str]):
+    # A failed step is logged and left to happen lazily on first use
+    for step in steps:
+        start = time.perf_counter()
+        try:
+            WARMUPS[step]()
+        except Exception:
+            logger.exception("Startup warm-up step %s failed", step)
+            continue
+        logger.info(
+            "Warm-up %s took %.1fms", step, (time.perf_counter() - start) * 1000
+        )
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import uuid
+from datetime import date, timedelta
+from typing import Callable, Optional
+
+import orjson
+from fastapi import Response
+
+from app.cache import Cache, create_cache
+from app.etag import etag_matches, not_modified
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "10000"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "300"))
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class SummaryCache:
+    # Caches serialized summary responses per user and date range. Every
+    # (user, day) and every user profile has a generation token that writes
+    # replace; a cached response is keyed on the tokens it was computed from,
+    # so a write makes exactly the entries covering that day unreachable.
+    def __init__(self, entries: Cache, generations: Cache):
+        self.entries = entries
+        self.generations = generations
+
+    def _tokens(self, user_id: int, start: date, end: date):
+        names = [f"{user_id}:profile"]
+        day = start
+        while day <= end:
+            names.append(f"{user_id}:{day.isoformat()}")
+            day += timedelta(days=1)
+        tokens = self.generations.get_many(names)
+        for index, token in enumerate(tokens):
+            if token is None:
+                # Never written, expired or evicted: start a fresh token
+                # rather than keying on its absence, which would bring back
+                # the keys and ETags from before the first write
+                token = uuid.uuid4().hex
+                if not self.generations.add(names[index], token):
+                    token = self.generations.get(names[index]) or token
+                tokens[index] = token
+        return tokens
+
+    def key(self, kind: str, user_id: int, start: date, end: date, *params) -> str:
+        material = json.dumps(
+            [kind, user_id, start, end, params, self._tokens(user_id, start, end)],
+            default=_json_default,
+        )
+        return f"{kind}:{user_id}:{hashlib.sha1(material.encode()).hexdigest()}"
+
+    def respond(
+        self,
+        key: str,
+        compute: Callable[[], object],
+        if_none_match: Optional[str] = None,
+    ) -> Response:
+        # The ETag is derived from the key, so an unchanged summary is a 304
+        # without computing or even fetching it
+        etag = '"' + key.rsplit(":", 1)[1] + '"'
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        body = self.entries.get(key)
+        if body is None:
+            body = orjson.dumps(compute(), option=orjson.OPT_SERIALIZE_NUMPY).decode()
+            self.entries.set(key, body)
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+        )
+
+    def invalidate_day(self, user_id: int, day: date):
+        # Call after committing a change to the user's meals on that day
+        self.generations.set(f"{user_id}:{day.isoformat()}", uuid.uuid4().hex)
+
+    def invalidate_profile(self, user_id: int):
+        # Call after committing a change that affects the user's target
+        self.generations.set(f"{user_id}:profile", uuid.uuid4().hex)
+
+
+# Tokens outlive the entries built from them and the token cache is sized
+# well above the entry cache, so entries stay reachable for their whole TTL. A
+# token that expires or is evicted anyway is replaced by a fresh one, which
+# only costs a recompute.
+summary_cache = SummaryCache(
+    create_cache("summary", maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL),
+    create_cache(
+        "summary-generation",
+        maxsize=SUMMARY_CACHE_SIZE * 10,
+        ttl=SUMMARY_CACHE_TTL * 2,
+    ),
+)
@@ -0,0 +1,12 @@
+# Benchmarks run against local stand-ins (SQLite, local storage, the stub
+# inference server). app.database builds its MySQL URL at import time, so give
+# it placeholder settings before any benchmark imports the app.
+import os
+
+for _name, _value in (
+    ("DB_USERNAME", "bench"),
+    ("DB_PASSWORD", "bench"),
+    ("DB_HOST", "localhost"),
+    ("DB_PORT", "3306"),
+):
+    os.environ.setdefault(_name, _value)
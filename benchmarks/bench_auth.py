@@ -0,0 +1,88 @@
+# Compares authenticated request throughput with AUTH_MODE=db (identity loaded
+# from the database on every request) and AUTH_MODE=stateless (token claims
+# plus the principal cache):
+#
+#   python -m benchmarks.bench_auth --users 200 --requests 5000
+import argparse
+import random
+import time
+from datetime import date, datetime
+
+from fastapi.testclient import TestClient
+
+from app import security
+from app.database import SessionLocal
+from app.main import app
+from app.models import Account, User
+from app.security import create_account_token
+from benchmarks.common import StatementCounter, create_sqlite_engine, use_engine
+
+
+def seed(users: int):
+    now = datetime(2024, 1, 1)
+    db = SessionLocal()
+    tokens = []
+    for i in range(users):
+        account = Account(
+            nama=f"User {i}",
+            username=f"user{i}",
+            email=f"user{i}@example.com",
+            password="x",
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(account)
+        db.flush()
+        user = User(
+            account_id=account.id,
+            nama=account.nama,
+            email=account.email,
+            birthdate=date(1990, 1, 1),
+            gender="Male",
+            tinggi_badan=170,
+            berat_badan=70,
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(user)
+        db.flush()
+        tokens.append(create_account_token(account, user.id))
+    db.commit()
+    db.close()
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--path", default="/calories/summary-week")
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine()
+    use_engine(engine)
+    tokens = seed(args.users)
+    client = TestClient(app)
+    rng = random.Random(0)
+    picks = [rng.choice(tokens) for _ in range(args.requests)]
+
+    print(f"{'mode':>10} {'req/s':>10} {'statements/req':>15}")
+    for mode in ("db", "stateless"):
+        security.AUTH_MODE = mode
+        security.principal_cache.clear()
+        with StatementCounter(engine) as counter:
+            start = time.perf_counter()
+            for token in picks:
+                response = client.get(
+                    args.path, headers={"Authorization": f"Bearer {token}"}
+                )
+                response.raise_for_status()
+            elapsed = time.perf_counter() - start
+        print(
+            f"{mode:>10} {args.requests / elapsed:>10.1f}"
+            f" {counter.count / args.requests:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Regression benchmark for GET /foods/daily: the number of SQL statements must
+# not grow with the number of meals logged that day.
+#
+#   python -m benchmarks.bench_food_daily --meals 1,10,100,1000
+import argparse
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.models import Account, Calorie, Food, User
+from benchmarks.common import (
+    StatementCounter,
+    auth_headers,
+    create_sqlite_engine,
+    use_engine,
+)
+
+DAY = date(2024, 1, 15)
+
+
+def seed(meals: int) -> str:
+    username = f"bench{meals}"
+    now = datetime(2024, 1, 1)
+    db = SessionLocal()
+    account = Account(
+        nama="Bench",
+        username=username,
+        email=f"bench{meals}@example.com",
+        password="x",
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(account)
+    db.flush()
+    user = User(
+        account_id=account.id,
+        nama="Bench",
+        email=account.email,
+        birthdate=date(1995, 5, 5),
+        gender="Female",
+        tinggi_badan=165,
+        berat_badan=60,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(user)
+    db.flush()
+    foods = db.query(Food).all()
+    start = datetime.combine(DAY, datetime.min.time())
+    db.add_all(
+        Calorie(
+            user_id=user.id,
+            food_id=foods[i % len(foods)].id,
+            jumlah_kalori=foods[i % len(foods)].jumlah_kalori,
+            created_at=start + timedelta(seconds=i * 86399 // max(meals, 1)),
+            updated_at=now,
+        )
+        for i in range(meals)
+    )
+    db.commit()
+    db.close()
+    return username
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--meals", default="1,10,100,1000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine()
+    use_engine(engine)
+    db = SessionLocal()
+    now = datetime(2024, 1, 1)
+    db.add_all(
+        Food(
+            name=f"Food {i}",
+            type=("karbohidrat", "protein", "sayur", "buah")[i % 4],
+            jumlah_kalori=50 + i * 10,
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(20)
+    )
+    db.commit()
+    db.close()
+
+    client = TestClient(app)
+    counts = {}
+    print(f"{'meals':>6} {'statements':>11} {'ms/request':>11}")
+    for meals in [int(value) for value in args.meals.split(",")]:
+        headers = auth_headers(seed(meals))
+        with StatementCounter(engine) as counter:
+            response = client.get(
+                "/foods/daily", params={"date": DAY.isoformat()}, headers=headers
+            )
+        response.raise_for_status()
+        assert len(response.json()["food_details"]) == meals
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            client.get(
+                "/foods/daily", params={"date": DAY.isoformat()}, headers=headers
+            )
+        elapsed = (time.perf_counter() - start) / args.repeat
+
+        counts[meals] = counter.count
+        print(f"{meals:>6} {counter.count:>11} {elapsed * 1000:>11.2f}")
+
+    if len(set(counts.values())) != 1:
+        print("FAIL: statement count depends on the number of meals")
+        sys.exit(1)
+    print("OK: constant statement count")
+
+
+if __name__ == "__main__":
+    main()
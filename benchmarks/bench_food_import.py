@@ -0,0 +1,67 @@
+# Benchmark for the food catalog import: validation of a generated CSV, then
+# a first import (all inserts), an unchanged re-import and one where every
+# row changes.
+#
+#   python -m benchmarks.bench_food_import --rows 10000,50000
+import argparse
+import random
+import time
+
+from app.database import SessionLocal
+from app.food_import import import_foods, read_csv, validate
+from benchmarks.common import StatementCounter, create_sqlite_engine, use_engine
+
+TYPES = ("karbohidrat", "protein", "sayur", "buah")
+
+
+def catalog_csv(rows: int, kalori_offset: int = 0) -> bytes:
+    # About 1% of rows are invalid and 1% repeat an earlier name
+    generator = random.Random(rows)
+    lines = ["name,type,jumlah_kalori"]
+    for i in range(rows):
+        name = f"Food {generator.randrange(i)}" if i and i % 100 == 50 else f"Food {i}"
+        kalori = "" if i % 100 == 99 else str(50 + i % 700 + kalori_offset)
+        lines.append(f"{name},{TYPES[i % len(TYPES)]},{kalori}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="1000,10000,50000")
+    args = parser.parse_args()
+
+    print(f"{'rows':>7} {'step':<12} {'ms':>9} {'statements':>11}  result")
+    for rows in [int(count) for count in args.rows.split(",")]:
+        engine = create_sqlite_engine()
+        use_engine(engine)
+        data = catalog_csv(rows)
+
+        start = time.perf_counter()
+        validate(read_csv(data))
+        print(
+            f"{rows:>7} {'validate':<12} {(time.perf_counter() - start) * 1000:>9.1f}"
+        )
+
+        for step, payload in (
+            ("insert", data),
+            ("unchanged", data),
+            ("update", catalog_csv(rows, kalori_offset=1)),
+        ):
+            db = SessionLocal()
+            with StatementCounter(engine) as counter:
+                start = time.perf_counter()
+                report = import_foods(db, payload, thumbnails=False)
+                elapsed = time.perf_counter() - start
+            db.close()
+            counts = {
+                key: report[key]
+                for key in ("inserted", "updated", "unchanged", "invalid")
+            }
+            print(
+                f"{rows:>7} {step:<12} {elapsed * 1000:>9.1f}"
+                f" {counter.count:>11}  {counts}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# Benchmark for GET /calories/summary-history over a year of synthetic meals,
+# next to the per-day dict and loop approach the weekly summary used before.
+#
+#   python -m benchmarks.bench_history --days 365 --meals-per-day 4
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.history import moving_average
+from app.main import app
+from app.models import Account, Calorie, CalorieRollup, Food, User
+from app.rollup import rebuild
+from app.routes import _daily_rollup
+from benchmarks.common import (
+    StatementCounter,
+    auth_headers,
+    create_sqlite_engine,
+    use_engine,
+)
+
+END = date(2024, 12, 31)
+
+
+def seed(days: int, meals_per_day: int) -> str:
+    now = datetime(2024, 1, 1)
+    db = SessionLocal()
+    foods = [
+        Food(
+            name=f"Food {i}",
+            type=("karbohidrat", "protein", "sayur", "buah")[i % 4],
+            jumlah_kalori=50 + i * 10,
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(20)
+    ]
+    account = Account(
+        nama="Bench",
+        username="bench",
+        email="bench@example.com",
+        password="x",
+        created_at=now,
+        updated_at=now,
+    )
+    db.add_all(foods + [account])
+    db.flush()
+    user = User(
+        account_id=account.id,
+        nama="Bench",
+        email=account.email,
+        birthdate=date(1995, 5, 5),
+        gender="Male",
+        tinggi_badan=175,
+        berat_badan=70,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(user)
+    db.flush()
+
+    # Skip some days so gap-filling has work to do
+    generator = random.Random(0)
+    start = END - timedelta(days=days - 1)
+    meals = []
+    for offset in range(days):
+        if generator.random() < 0.1:
+            continue
+        day = datetime.combine(start + timedelta(days=offset), datetime.min.time())
+        for meal in range(meals_per_day):
+            food = generator.choice(foods)
+            meals.append(
+                Calorie(
+                    user_id=user.id,
+                    food_id=food.id,
+                    jumlah_kalori=food.jumlah_kalori,
+                    created_at=day + timedelta(hours=7 + meal * 4),
+                    updated_at=now,
+                )
+            )
+    db.add_all(meals)
+    db.commit()
+    rebuild(db)
+    db.close()
+    return "bench"
+
+
+def python_history(user_id: int, start: date, end: date, window: int):
+    # Per-day dict and list version of the same totals and moving average
+    db = SessionLocal()
+    rows = (
+        db.query(CalorieRollup.day, CalorieRollup.total_kalori)
+        .filter(
+            CalorieRollup.user_id == user_id,
+            CalorieRollup.day >= start,
+            CalorieRollup.day <= end,
+        )
+        .all()
+    )
+    db.close()
+    by_day = {}
+    for day, total in rows:
+        key = day.strftime("%Y%m%d")
+        by_day[key] = by_day.get(key, 0) + float(total)
+    totals = []
+    current = start
+    while current <= end:
+        totals.append(by_day.get(current.strftime("%Y%m%d"), 0))
+        current += timedelta(days=1)
+    averages = []
+    for last in range(1, len(totals) + 1):
+        first = max(last - window, 0)
+        recent = totals[first:last]
+        averages.append(sum(recent) / len(recent))
+    return totals, averages
+
+
+def numpy_history(user_id: int, start: date, end: date, window: int):
+    # What the endpoint computes: range query, bulk gap-fill, vectorized mean
+    db = SessionLocal()
+    days, totals = _daily_rollup(db, user_id, start, end)
+    db.close()
+    return totals, moving_average(totals, window)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--meals-per-day", type=int, default=4)
+    parser.add_argument("--window", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine()
+    use_engine(engine)
+    headers = auth_headers(seed(args.days, args.meals_per_day))
+    params = {"days": args.days, "end_date": END.isoformat(), "window": args.window}
+
+    client = TestClient(app)
+    with StatementCounter(engine) as counter:
+        response = client.get(
+            "/calories/summary-history", params=params, headers=headers
+        )
+    response.raise_for_status()
+    history = response.json()
+
+    # Both versions must agree before their timings mean anything
+    start = END - timedelta(days=args.days - 1)
+    totals, averages = python_history(1, start, END, args.window)
+    assert [day["total_kalori_masuk"] for day in history["days"]] == totals
+    assert all(
+        abs(day["moving_average"] - average) < 1e-6
+        for day, average in zip(history["days"], averages)
+    )
+
+    begin = time.perf_counter()
+    for _ in range(args.repeat):
+        client.get("/calories/summary-history", params=params, headers=headers)
+    endpoint = (time.perf_counter() - begin) / args.repeat
+
+    timings = {}
+    for name, function in (("numpy", numpy_history), ("per-day loop", python_history)):
+        begin = time.perf_counter()
+        for _ in range(args.repeat):
+            function(1, start, END, args.window)
+        timings[name] = (time.perf_counter() - begin) / args.repeat
+
+    print(f"days: {args.days}, meals: {args.days * args.meals_per_day} (approx.)")
+    print(f"statements per request: {counter.count}")
+    print(f"GET /calories/summary-history: {endpoint * 1000:.2f} ms/request")
+    for name, elapsed in timings.items():
+        print(f"query + series, {name}: {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
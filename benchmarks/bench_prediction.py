@@ -0,0 +1,58 @@
+# Compares unbatched and micro-batched prediction against the stub server:
+#
+#   python -m benchmarks.bench_prediction --requests 2000 --concurrency 64
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.prediction import PredictionClient
+from benchmarks.common import percentile
+from benchmarks.stub_inference import start_stub_server
+
+
+def run(client: PredictionClient, requests: int, concurrency: int):
+    def timed(i):
+        start = time.perf_counter()
+        client.predict(f"http://bench/{i}.webp")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    return requests / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--batch-wait-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.port)
+    try:
+        print(f"{'batch':>6} {'req/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            client = PredictionClient(
+                base_url=f"http://127.0.0.1:{args.port}",
+                batch_size=batch_size,
+                batch_wait_ms=args.batch_wait_ms,
+                pool_size=args.concurrency,
+            )
+            throughput, latencies = run(client, args.requests, args.concurrency)
+            print(
+                f"{batch_size:>6} {throughput:>10.1f}"
+                f" {percentile(latencies, 0.50) * 1000:>8.1f}"
+                f" {percentile(latencies, 0.95) * 1000:>8.1f}"
+                f" {percentile(latencies, 0.99) * 1000:>8.1f}"
+            )
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Worker scaling benchmark for the production server: seeds a scratch SQLite
+# database once, then for each worker count starts `python -m app.server`,
+# drives a read-heavy request mix from concurrent clients and reports the
+# throughput and latency. Throughput should grow with the workers up to the
+# number of CPUs; on a single CPU the counts should stay level.
+#
+#   python -m benchmarks.bench_server --workers 1,2,4 --duration 20
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import requests
+
+from app.server import available_cpus
+from benchmarks.common import ROOT, migrate, percentile, use_engine
+from benchmarks.loadtest import Client, create_database_engine, seed
+from benchmarks.stub_inference import start_stub_server
+
+# Endpoints served from the database and the app's own CPU, no uploads
+MIX = {
+    "GET /foods": 15,
+    "GET /foods/daily": 20,
+    "GET /calories/summary-day": 25,
+    "GET /calories/summary-week": 20,
+    "GET /calories/summary-history": 10,
+}
+
+
+def start_server(workers: int, port: int, env: dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        # Per-process caches are fine for a read-only mix
+        [
+            sys.executable,
+            "-m",
+            "app.server",
+            "--workers",
+            str(workers),
+            "--allow-process-caches",
+        ],
+        cwd=ROOT,
+        env=dict(env, PORT=str(port)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server with {workers} workers did not start")
+
+
+def drive(base_url: str, args, seconds: float) -> Tuple[List[float], int, float]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(index: int):
+        client = Client(base_url, args, [], args.seed * 1000 + index)
+        client.names = list(MIX)
+        client.weights = [MIX[name] for name in client.names]
+        local = []
+        failed = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            name = client.random.choices(client.names, client.weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = client.request(name).ok
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - start)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    cpus = available_cpus()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(count) for count in sorted({1, 2, cpus})),
+        help="Comma-separated worker counts, default 1, 2 and the CPU count",
+    )
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--port", type=int, default=8092)
+    parser.add_argument("--inference-port", type=int, default=8093)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="calorties-server-")
+    url = f"sqlite:///{os.path.join(directory, 'server.db')}"
+    use_engine(create_database_engine(url))
+    migrate(url)
+    seed(args.users, args.days, args.meals_per_day, args.seed)
+
+    stub = start_stub_server(args.inference_port)
+    env = dict(
+        os.environ,
+        DATABASE_URL=url,
+        STORAGE_BACKEND="local",
+        LOCAL_STORAGE_DIR=os.path.join(directory, "storage"),
+        INFERENCE_URL=f"http://127.0.0.1:{args.inference_port}",
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"CPUs available: {cpus}, concurrency: {args.concurrency}")
+    print(
+        f"{'workers':>7} {'requests':>9} {'errors':>7} {'req/s':>8}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    try:
+        for workers in [int(count) for count in args.workers.split(",")]:
+            server = start_server(workers, args.port, env)
+            try:
+                drive(base_url, args, args.warmup)
+                latencies, errors, elapsed = drive(base_url, args, args.duration)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait()
+            print(
+                f"{workers:>7} {len(latencies):>9} {errors:>7}"
+                f" {len(latencies) / elapsed:>8.1f}"
+                f" {percentile(latencies, 0.50) * 1000:>8.1f}"
+                f" {percentile(latencies, 0.95) * 1000:>8.1f}"
+                f" {percentile(latencies, 0.99) * 1000:>8.1f}"
+            )
+    finally:
+        stub.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Startup benchmark: in a fresh interpreter per run, times the import of
+# app.main, the lifespan startup (warm-up included), their sum (time to
+# ready) and the first request, so cold start regressions show up before they
+# reach Cloud Run.
+#
+#   python -m benchmarks.bench_startup --runs 5 --warmup catalog,pool
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+from app.models import Base
+from benchmarks.common import ROOT
+
+# Runs in the child interpreter; prints its timings as JSON
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+modules = len(sys.modules)
+from fastapi.testclient import TestClient
+before_startup = time.perf_counter()
+with TestClient(app) as client:
+    started = time.perf_counter()
+    client.get("/metrics").raise_for_status()
+    served = time.perf_counter()
+print(json.dumps({
+    "modules": modules,
+    "import": imported - start,
+    "startup": started - before_startup,
+    "ready": imported - start + started - before_startup,
+    "first request": served - started,
+}))
+"""
+STEPS = ("import", "startup", "ready", "first request")
+
+
+def run_child(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        cwd=ROOT,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--warmup", action="append", help="STARTUP_WARMUP value, may be repeated"
+    )
+    args = parser.parse_args()
+
+    # A file database, so every child sees the same (empty) schema
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    Base.metadata.create_all(create_engine(url))
+
+    print(f"{'STARTUP_WARMUP':<32} {'modules':>8}", end="")
+    print("".join(f" {step + ' ms':>16}" for step in STEPS))
+    for warmup in args.warmup or ["", "catalog", "catalog,pool,inference"]:
+        env = dict(os.environ, DATABASE_URL=url, STARTUP_WARMUP=warmup)
+        runs = [run_child(env) for _ in range(args.runs)]
+        medians = {
+            step: statistics.median(run[step] for run in runs) * 1000 for step in STEPS
+        }
+        print(f"{warmup or '(none)':<32} {runs[0]['modules']:>8}", end="")
+        print("".join(f" {medians[step]:>16.1f}" for step in STEPS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# Query plan check for the hot routes: migrates a scratch SQLite database with
+# Alembic, exercises the routes, then runs EXPLAIN QUERY PLAN on every SELECT
+# they issued. Exits 1 if any of them scans a whole table, apart from the
+# tables that are read in full on purpose.
+#
+#   python -m benchmarks.check_query_plans [--verbose]
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+
+from app import security
+from app.database import SessionLocal
+from app.main import app
+from app.models import Account, Calorie, CalorieRollup, Food, User
+from app.passwords import password_service
+from app.routes import _encode_meal_cursor
+from benchmarks.common import auth_headers, migrate, use_engine
+
+# The catalog loads Food whole, and the dummy inference endpoints pick from it
+FULL_SCAN_ALLOWED = {"Food"}
+
+
+def seed():
+    now = datetime(2024, 1, 1)
+    db = SessionLocal()
+    foods = [
+        Food(
+            name=f"Food {i}",
+            type=("karbohidrat", "protein")[i % 2],
+            jumlah_kalori=100 + i,
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(10)
+    ]
+    accounts = [
+        Account(
+            nama=f"Plan {i}",
+            username=f"plan{i}",
+            email=f"plan{i}@example.com",
+            password=password_service.context.hash("secret", rounds=4),
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(50)
+    ]
+    db.add_all(foods + accounts)
+    db.flush()
+    users = [
+        User(
+            account_id=account.id,
+            nama=account.nama,
+            email=account.email,
+            birthdate=date(1990, 1, 1),
+            gender="Male",
+            tinggi_badan=170,
+            berat_badan=70,
+            created_at=now,
+            updated_at=now,
+        )
+        for account in accounts
+    ]
+    db.add_all(users)
+    db.flush()
+    db.add_all(
+        Calorie(
+            user_id=user.id,
+            food_id=foods[i % len(foods)].id,
+            jumlah_kalori=foods[i % len(foods)].jumlah_kalori,
+            created_at=now + timedelta(hours=i),
+            updated_at=now,
+        )
+        for user in users
+        for i in range(20)
+    )
+    db.add_all(
+        CalorieRollup(
+            user_id=user.id,
+            day=now.date(),
+            type="protein",
+            total_kalori=1,
+            meal_count=1,
+        )
+        for user in users
+    )
+    db.commit()
+    db.close()
+
+
+def exercise(client: TestClient, calorie_id: int):
+    # plan1 is user 2, who owns meals 21-40
+    headers = auth_headers("plan1")
+    requests = [
+        ("post", "/login", {"params": {"username": "plan1", "password": "secret"}}),
+        ("get", "/foods", {}),
+        ("get", "/foods", {"params": {"q": "Food 1", "limit": 5}}),
+        ("get", "/foods/daily", {"params": {"date": "2024-01-01"}}),
+        ("get", "/calories/summary-day", {"params": {"date": "2024-01-01"}}),
+        (
+            "get",
+            "/calories/summary-week",
+            {"params": {"start_date": "2024-01-01", "end_date": "2024-01-07"}},
+        ),
+        ("get", "/calories/summary-history", {"params": {"days": 30}}),
+        ("get", "/calories", {"params": {"limit": 5}}),
+        (
+            "get",
+            "/calories",
+            {"params": {"cursor": _encode_meal_cursor(datetime(2024, 1, 1, 3), 24)}},
+        ),
+        ("get", "/calories/export", {"params": {"start_date": "2024-01-01"}}),
+        ("delete", f"/calories/{calorie_id}", {}),
+        (
+            "post",
+            "/calories/bulk",
+            {
+                "json": {
+                    "entries": [
+                        {
+                            "food_id": 1,
+                            "consumed_at": "2024-01-02T08:00:00",
+                            "idempotency_key": "plan-check",
+                        }
+                    ]
+                }
+            },
+        ),
+    ]
+    for method, path, kwargs in requests:
+        response = getattr(client, method)(path, headers=headers, **kwargs)
+        if response.status_code >= 400:
+            raise SystemExit(f"{method.upper()} {path}: {response.status_code}")
+
+
+def full_scans(connection, statement, parameters):
+    # SQLite reports a full table scan as "SCAN <table>"; index lookups are
+    # "SEARCH <table> USING ...". Scans of subqueries are fine.
+    plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith("SCAN "):
+            table = detail.split()[1]
+            if not table.startswith("(") and table not in FULL_SCAN_ALLOWED:
+                scans.append(detail)
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    url = f"sqlite:///{os.path.join(directory, 'plans.db')}"
+    migrate(url)
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    use_engine(engine)
+    seed()
+
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            executed.append((statement, parameters))
+
+    # Covers both the stateless principal lookup and the per-request one
+    with TestClient(app) as client:
+        event.listen(engine, "before_cursor_execute", record)
+        for calorie_id, mode in ((21, "stateless"), (22, "db")):
+            security.AUTH_MODE = mode
+            security.principal_cache.clear()
+            exercise(client, calorie_id)
+        event.remove(engine, "before_cursor_execute", record)
+
+    failures = 0
+    seen = set()
+    with engine.connect() as connection:
+        for statement, parameters in executed:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            scans = full_scans(connection, statement, parameters)
+            if scans:
+                failures += 1
+                print("FULL SCAN:", "; ".join(scans))
+                print("   ", " ".join(statement.split()))
+            elif args.verbose:
+                print("ok:", " ".join(statement.split())[:120])
+
+    print(f"{len(seen)} distinct queries, {failures} with full table scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
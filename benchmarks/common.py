@@ -0,0 +1,85 @@
+# Shared setup for the benchmarks: runs the app against a local SQLite
+# database instead of the MySQL primary.
+import os
+import threading
+import time
+
+import uvicorn
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+
+from app import database
+from app.models import Base
+from app.security import create_access_token
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_sqlite_engine(url: str = "sqlite://") -> Engine:
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if url == "sqlite://":
+        # Share the single in-memory database between threads
+        kwargs["poolclass"] = StaticPool
+    engine = create_engine(url, **kwargs)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def migrate(url: str):
+    # Brings a scratch database to the current schema with the real migrations
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+
+
+def use_engine(engine: Engine):
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+
+
+def auth_headers(username: str) -> dict:
+    return {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def serve_in_thread(asgi_app, port: int) -> uvicorn.Server:
+    # Runs an ASGI app with uvicorn in a background thread of the calling
+    # process; set `should_exit` on the returned server to stop it
+    server = uvicorn.Server(
+        uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+class StatementCounter:
+    # Counts the SQL statements executed on an engine inside a `with` block
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
@@ -0,0 +1,382 @@
+# Load test for the API: serves the app with uvicorn against a local database,
+# local file storage and the stub inference server, seeds a realistic data set
+# and drives the main endpoints from concurrent clients. Reports p50/p95/p99
+# latency and throughput per endpoint.
+#
+#   python -m benchmarks.loadtest --users 2000 --days 365 --duration 60
+#   python -m benchmarks.loadtest --database-url mysql+mysqlconnector://...
+#
+# Save a run with --output and gate a later one on it with --baseline; the run
+# exits 1 if an endpoint's p95 regressed by more than --max-regression or the
+# error rate is above --max-error-rate.
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+import requests
+from PIL import Image
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.engine import Engine
+
+from app import ratelimit
+from app.database import DB_MAX_OVERFLOW, DB_POOL_SIZE, SessionLocal
+from app.gcs import LocalStorage, set_storage
+from app.main import app
+from app.models import Account, Calorie, Food, User
+from app.passwords import password_service
+from app.prediction import prediction_client
+from app.rollup import rebuild
+from app.security import create_access_token
+from benchmarks.common import migrate, percentile, serve_in_thread, use_engine
+from benchmarks.stub_inference import STUB_FOOD_COUNT, start_stub_server
+
+PASSWORD = "loadtest"
+FOOD_TYPES = ("karbohidrat", "protein", "sayur", "buah")
+INSERT_BATCH = 10000
+
+# Relative weight of each scenario in the request mix
+SCENARIOS = {
+    "POST /login": 2,
+    "GET /foods": 15,
+    "GET /foods/daily": 20,
+    "POST /calories": 8,
+    "GET /calories/summary-day": 25,
+    "GET /calories/summary-week": 20,
+    "GET /calories/summary-history": 10,
+}
+
+
+def create_database_engine(url: str) -> Engine:
+    # Pool sized like the app's own engine
+    pool = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_pre_ping=True, **pool)
+    engine = create_engine(
+        url, connect_args={"check_same_thread": False, "timeout": 30}, **pool
+    )
+
+    # WAL lets the readers carry on while a meal is being written
+    @event.listens_for(engine, "connect")
+    def _set_wal(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    return engine
+
+
+def _insert_batches(db, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            db.execute(insert(table), batch)
+            batch = []
+    if batch:
+        db.execute(insert(table), batch)
+
+
+def seed(users: int, days: int, meals_per_day: int, seed_value: int):
+    # Accounts share one bcrypt hash at the configured cost, so logins cost
+    # what they do in production without hashing thousands of passwords here
+    generator = random.Random(seed_value)
+    now = datetime.now().replace(microsecond=0)
+    first_day = now.date() - timedelta(days=days - 1)
+    password = password_service.context.hash(PASSWORD)
+
+    db = SessionLocal()
+    foods = [
+        {
+            "id": i,
+            "name": f"Food {i}",
+            "type": FOOD_TYPES[i % len(FOOD_TYPES)],
+            "jumlah_kalori": generator.randint(50, 700),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(1, STUB_FOOD_COUNT + 1)
+    ]
+    db.execute(insert(Food), foods)
+    kalori = {food["id"]: food["jumlah_kalori"] for food in foods}
+
+    _insert_batches(
+        db,
+        Account,
+        (
+            {
+                "id": i,
+                "nama": f"User {i}",
+                "username": f"user{i}",
+                "email": f"user{i}@example.com",
+                "password": password,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(1, users + 1)
+        ),
+    )
+    _insert_batches(
+        db,
+        User,
+        (
+            {
+                "id": i,
+                "account_id": i,
+                "nama": f"User {i}",
+                "email": f"user{i}@example.com",
+                "birthdate": date(generator.randint(1960, 2005), 1, 1)
+                + timedelta(days=generator.randint(0, 364)),
+                "gender": generator.choice(("Male", "Female")),
+                "tinggi_badan": generator.randint(150, 195),
+                "berat_badan": generator.randint(45, 110),
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(1, users + 1)
+        ),
+    )
+
+    def meals():
+        for user_id in range(1, users + 1):
+            for offset in range(days):
+                day = datetime.combine(
+                    first_day + timedelta(days=offset), datetime.min.time()
+                )
+                count = generator.randint(0, meals_per_day * 2)
+                for meal in range(count):
+                    food_id = generator.randint(1, STUB_FOOD_COUNT)
+                    consumed = day + timedelta(
+                        hours=6 + meal * 16 // count, minutes=generator.randint(0, 59)
+                    )
+                    yield {
+                        "user_id": user_id,
+                        "food_id": food_id,
+                        "jumlah_kalori": kalori[food_id],
+                        "created_at": consumed,
+                        "updated_at": consumed,
+                    }
+
+    _insert_batches(db, Calorie, meals())
+    db.commit()
+    rebuild(db)
+    db.close()
+
+
+def sample_images(count: int) -> List[bytes]:
+    # A few phone-sized photos; each upload appends random bytes after the
+    # JPEG end marker so it misses the per-image prediction cache
+    generator = random.Random(0)
+    images = []
+    for _ in range(count):
+        colour = tuple(generator.randint(0, 255) for _ in range(3))
+        buffer = io.BytesIO()
+        Image.new("RGB", (1600, 1200), colour).save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+class Client:
+    # One simulated client: a keep-alive session that issues random requests
+    # from the scenario mix for random users
+    def __init__(self, base_url: str, args, images: List[bytes], seed_value: int):
+        self.base_url = base_url
+        self.args = args
+        self.images = images
+        self.random = random.Random(seed_value)
+        self.session = requests.Session()
+        self.names = list(SCENARIOS)
+        self.weights = [SCENARIOS[name] for name in self.names]
+        self.tokens: Dict[int, str] = {}
+
+    def token(self, user_id: int) -> str:
+        # The same claims /login issues; account and user ids match in the seed
+        if user_id not in self.tokens:
+            self.tokens[user_id] = create_access_token(
+                {"sub": f"user{user_id}", "aid": user_id, "uid": user_id}
+            )
+        return self.tokens[user_id]
+
+    def _day(self) -> date:
+        return date.today() - timedelta(days=self.random.randrange(self.args.days))
+
+    def request(self, name: str) -> requests.Response:
+        user_id = self.random.randint(1, self.args.users)
+        headers = {"Authorization": f"Bearer {self.token(user_id)}"}
+        method, path = name.split(" ", 1)
+        kwargs = {}
+        if path == "/login":
+            headers = {}
+            kwargs["params"] = {"username": f"user{user_id}", "password": PASSWORD}
+        elif path == "/foods/daily":
+            kwargs["params"] = {"date": self._day().isoformat()}
+        elif path == "/calories":
+            image = self.random.choice(self.images) + os.urandom(16)
+            kwargs["files"] = {"image": ("meal.jpg", image, "image/jpeg")}
+        elif path == "/calories/summary-day":
+            kwargs["params"] = {"date": self._day().isoformat()}
+        elif path == "/calories/summary-week":
+            end = self._day()
+            kwargs["params"] = {
+                "start_date": (end - timedelta(days=6)).isoformat(),
+                "end_date": end.isoformat(),
+            }
+        elif path == "/calories/summary-history":
+            kwargs["params"] = {"days": self.random.choice((30, 90, 365))}
+        return self.session.request(
+            method, self.base_url + path, headers=headers, timeout=60, **kwargs
+        )
+
+    def run(self, deadline: float, results: List[Tuple[str, float, int]]):
+        while time.perf_counter() < deadline:
+            name = self.random.choices(self.names, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                status = self.request(name).status_code
+            except requests.RequestException:
+                status = 0
+            results.append((name, time.perf_counter() - start, status))
+
+
+def drive(base_url: str, args, images: List[bytes], seconds: float):
+    results: List[Tuple[str, float, int]] = []
+    lock = threading.Lock()
+
+    def worker(index: int):
+        local: List[Tuple[str, float, int]] = []
+        client = Client(base_url, args, images, args.seed * 1000 + index)
+        client.run(time.perf_counter() + seconds, local)
+        with lock:
+            results.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed: float) -> Dict[str, dict]:
+    by_name = defaultdict(list)
+    for name, latency, status in results:
+        by_name[name].append((latency, status))
+        by_name["total"].append((latency, status))
+    report = {}
+    for name, samples in by_name.items():
+        latencies = [latency for latency, _ in samples]
+        report[name] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, status in samples if not 200 <= status < 400),
+            "throughput": len(samples) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+    return report
+
+
+def print_report(report: Dict[str, dict]):
+    print(
+        f"{'endpoint':<32} {'requests':>9} {'errors':>7} {'req/s':>8}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for name in [*SCENARIOS, "total"]:
+        if name not in report:
+            continue
+        row = report[name]
+        print(
+            f"{name:<32} {row['requests']:>9} {row['errors']:>7}"
+            f" {row['throughput']:>8.1f} {row['p50_ms']:>8.1f}"
+            f" {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+        )
+
+
+def regressions(report, baseline, max_regression: float) -> List[str]:
+    failures = []
+    for name, row in report.items():
+        previous = baseline.get(name)
+        if previous and row["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            failures.append(
+                f"{name}: p95 {row['p95_ms']:.1f} ms,"
+                f" baseline {previous['p95_ms']:.1f} ms"
+            )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--database-url", help="Database to seed and use, default a scratch SQLite"
+    )
+    parser.add_argument(
+        "--skip-seed", action="store_true", help="Reuse an already seeded database"
+    )
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--meals-per-day", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--inference-port", type=int, default=8091)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="calorties-loadtest-")
+    url = args.database_url or f"sqlite:///{os.path.join(directory, 'load.db')}"
+    engine = create_database_engine(url)
+    use_engine(engine)
+    if not args.skip_seed:
+        migrate(url)
+        start = time.perf_counter()
+        seed(args.users, args.days, args.meals_per_day, args.seed)
+        print(f"seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+
+    set_storage(LocalStorage(os.path.join(directory, "storage")))
+    # Every simulated client comes from the same address
+    ratelimit.RATE_LIMIT_ENABLED = False
+    stub = start_stub_server(args.inference_port)
+    prediction_client.base_url = f"http://127.0.0.1:{args.inference_port}"
+    server = serve_in_thread(app, args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    images = sample_images(8)
+
+    try:
+        drive(base_url, args, images, args.warmup)
+        results, elapsed = drive(base_url, args, images, args.duration)
+    finally:
+        server.should_exit = True
+        stub.should_exit = True
+
+    report = summarize(results, elapsed)
+    print(f"concurrency: {args.concurrency}, duration: {elapsed:.1f}s")
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+
+    failures = []
+    total = report.get("total")
+    if total and total["errors"] > total["requests"] * args.max_error_rate:
+        failures.append(f"{total['errors']} of {total['requests']} requests failed")
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            failures += regressions(report, json.load(baseline), args.max_regression)
+    for failure in failures:
+        print("REGRESSION:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Stub inference server so prediction throughput can be measured without the
+# real model or network:
+#
+#   uvicorn benchmarks.stub_inference:app --port 8001
+#   INFERENCE_URL=http://localhost:8001 uvicorn app.main:app
+#
+# Every call costs STUB_LATENCY_MS plus STUB_ITEM_LATENCY_MS per image, which
+# mimics a model server where per-request overhead dominates small batches.
+import asyncio
+import os
+import zlib
+
+import uvicorn
+from fastapi import FastAPI
+
+from app.schemas import InferenceBatchRequest
+from benchmarks.common import serve_in_thread
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "20"))
+STUB_ITEM_LATENCY_MS = float(os.getenv("STUB_ITEM_LATENCY_MS", "2"))
+STUB_FOOD_COUNT = int(os.getenv("STUB_FOOD_COUNT", "50"))
+
+app = FastAPI(title="Stub inference")
+
+
+def stub_food_id(image_url: str) -> int:
+    # Deterministic, so repeated runs predict the same foods
+    return zlib.crc32(image_url.encode()) % STUB_FOOD_COUNT + 1
+
+
+@app.post("/inference/food-id")
+async def infer_food_id(image_url: str):
+    await asyncio.sleep((STUB_LATENCY_MS + STUB_ITEM_LATENCY_MS) / 1000)
+    return {"food_id": stub_food_id(image_url)}
+
+
+@app.post("/inference/food-id/batch")
+async def infer_food_id_batch(request: InferenceBatchRequest):
+    items = len(request.image_urls)
+    await asyncio.sleep((STUB_LATENCY_MS + STUB_ITEM_LATENCY_MS * items) / 1000)
+    return {"food_ids": [stub_food_id(url) for url in request.image_urls]}
+
+
+def start_stub_server(port: int = 8001) -> uvicorn.Server:
+    # Runs the stub in a background thread of the calling process
+    return serve_in_thread(app, port)
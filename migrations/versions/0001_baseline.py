@@ -0,0 +1,79 @@
+"""Baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-01-01 00:00:00
+
+The tables as they existed before migrations were introduced. Databases
+created by hand already have them: run `alembic stamp 0001` there once,
+then `alembic upgrade head`.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def timestamps():
+    return [
+        sa.Column(
+            "created_at", sa.DateTime, server_default=sa.text("CURRENT_TIMESTAMP")
+        ),
+        sa.Column(
+            "updated_at", sa.DateTime, server_default=sa.text("CURRENT_TIMESTAMP")
+        ),
+        sa.Column("deleted_at", sa.DateTime),
+    ]
+
+
+def upgrade():
+    op.create_table(
+        "Account",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("nama", sa.String(255), nullable=False),
+        sa.Column("username", sa.String(255), nullable=False),
+        sa.Column("email", sa.String(255), nullable=False),
+        sa.Column("password", sa.String(255), nullable=False),
+        *timestamps(),
+    )
+    op.create_table(
+        "User",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("account_id", sa.Integer, sa.ForeignKey("Account.id")),
+        sa.Column("nama", sa.String(255), nullable=False),
+        sa.Column("email", sa.String(255), nullable=False),
+        sa.Column("birthdate", sa.Date),
+        sa.Column("gender", sa.Enum("Male", "Female", "Other")),
+        sa.Column("tinggi_badan", sa.DECIMAL(5, 2)),
+        sa.Column("berat_badan", sa.DECIMAL(5, 2)),
+        sa.Column("profile_image_url", sa.String(255)),
+        *timestamps(),
+    )
+    op.create_table(
+        "Food",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("type", sa.String(255)),
+        sa.Column("jumlah_kalori", sa.Integer),
+        sa.Column("thumbnail", sa.String(255)),
+        *timestamps(),
+    )
+    op.create_table(
+        "Calorie",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("User.id")),
+        sa.Column("food_id", sa.Integer, sa.ForeignKey("Food.id")),
+        sa.Column("jumlah_kalori", sa.Integer),
+        sa.Column("food_image_url", sa.String(255)),
+        *timestamps(),
+    )
+
+
+def downgrade():
+    op.drop_table("Calorie")
+    op.drop_table("Food")
+    op.drop_table("User")
+    op.drop_table("Account")
@@ -0,0 +1,73 @@
+"""Calorie rollup table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-01-02 00:00:00
+
+Backfilled from the existing meals, so the summaries that read the rollup
+keep their totals. `python -m app.rollup rebuild` may already have created
+and filled the table, in which case it is left alone.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("CalorieRollup"):
+        return
+    op.create_table(
+        "CalorieRollup",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("User.id"), primary_key=True),
+        sa.Column("day", sa.Date, primary_key=True),
+        sa.Column("type", sa.String(255), primary_key=True),
+        sa.Column("total_kalori", sa.Integer, nullable=False),
+        sa.Column("meal_count", sa.Integer, nullable=False),
+    )
+
+    # Same totals as app.rollup.rebuild, from the schema at this revision
+    calorie = sa.table(
+        "Calorie",
+        sa.column("id"),
+        sa.column("user_id"),
+        sa.column("food_id"),
+        sa.column("jumlah_kalori"),
+        sa.column("created_at"),
+        sa.column("deleted_at"),
+    )
+    food = sa.table("Food", sa.column("id"), sa.column("type"))
+    rollup = sa.table(
+        "CalorieRollup",
+        sa.column("user_id"),
+        sa.column("day"),
+        sa.column("type"),
+        sa.column("total_kalori"),
+        sa.column("meal_count"),
+    )
+    day = sa.func.date(calorie.c.created_at)
+    type = sa.func.coalesce(food.c.type, "")
+    totals = (
+        sa.select(
+            calorie.c.user_id,
+            day,
+            type,
+            sa.func.coalesce(sa.func.sum(calorie.c.jumlah_kalori), 0),
+            sa.func.count(calorie.c.id),
+        )
+        .select_from(calorie.outerjoin(food, food.c.id == calorie.c.food_id))
+        .where(calorie.c.user_id.isnot(None), calorie.c.deleted_at.is_(None))
+        .group_by(calorie.c.user_id, day, type)
+    )
+    op.execute(
+        rollup.insert().from_select(
+            ["user_id", "day", "type", "total_kalori", "meal_count"], totals
+        )
+    )
+
+
+def downgrade():
+    op.drop_table("CalorieRollup")
@@ -0,0 +1,37 @@
+"""Indexes for the hot query paths
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-01-03 00:00:00
+
+- Account.username / email: login, token checks and registration. Unique,
+  which fails if duplicates slipped past the registration check; resolve
+  those first.
+- User.account_id: the account -> user profile lookup on most routes.
+- Calorie(user_id, created_at): a user's meals in a time range.
+- Food.name: name prefix search on GET /foods.
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_Account_username", "Account", ["username"], unique=True)
+    op.create_index("ix_Account_email", "Account", ["email"], unique=True)
+    op.create_index("ix_User_account_id", "User", ["account_id"])
+    op.create_index(
+        "ix_Calorie_user_id_created_at", "Calorie", ["user_id", "created_at"]
+    )
+    op.create_index("ix_Food_name", "Food", ["name"])
+
+
+def downgrade():
+    op.drop_index("ix_Food_name", table_name="Food")
+    op.drop_index("ix_Calorie_user_id_created_at", table_name="Calorie")
+    op.drop_index("ix_User_account_id", table_name="User")
+    op.drop_index("ix_Account_email", table_name="Account")
+    op.drop_index("ix_Account_username", table_name="Account")
@@ -0,0 +1,31 @@
+"""Calorie idempotency keys
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-01-04 00:00:00
+
+Client-supplied keys for meals sent through POST /calories/bulk, unique per
+user so replayed offline entries are only recorded once.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("Calorie", sa.Column("idempotency_key", sa.String(64)))
+    op.create_index(
+        "ux_Calorie_user_id_idempotency_key",
+        "Calorie",
+        ["user_id", "idempotency_key"],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index("ux_Calorie_user_id_idempotency_key", table_name="Calorie")
+    op.drop_column("Calorie", "idempotency_key")
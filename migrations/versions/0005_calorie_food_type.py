@@ -0,0 +1,34 @@
+"""Calorie food type
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-01-05 00:00:00
+
+The food type each meal was rolled up under, so deleting a meal decrements
+the same CalorieRollup row even after its food changed type. Existing meals
+take their food's current type, which is what the rollup was built from.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("Calorie", sa.Column("food_type", sa.String(255)))
+    calorie = sa.table("Calorie", sa.column("food_id"), sa.column("food_type"))
+    food = sa.table("Food", sa.column("id"), sa.column("type"))
+    op.execute(
+        calorie.update().values(
+            food_type=sa.select(food.c.type)
+            .where(food.c.id == calorie.c.food_id)
+            .scalar_subquery()
+        )
+    )
+
+
+def downgrade():
+    op.drop_column("Calorie", "food_type")
@@ -0,0 +1,113 @@
+import os
+import tempfile
+
+# A scratch SQLite database and local storage, set before the app is imported
+_directory = tempfile.mkdtemp(prefix="calorties-tests-")
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{os.path.join(_directory, 'test.db')}"
+)
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("LOCAL_STORAGE_DIR", os.path.join(_directory, "storage"))
+
+import pytest  # noqa: E402
+
+from app.database import get_engine  # noqa: E402
+from app.models import Base  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def schema():
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    from app import ratelimit
+    from app.catalog import food_catalog
+    from app.idempotency import idempotency_store
+    from app.main import app
+    from app.prediction import prediction_cache
+    from app.security import principal_cache
+    from app.summary_cache import summary_cache
+
+    # Tests reuse ids, so nothing may carry over from an earlier test
+    for cache in (
+        principal_cache,
+        summary_cache.entries,
+        summary_cache.generations,
+        idempotency_store.cache,
+        prediction_cache.cache,
+    ):
+        cache.clear()
+    food_catalog.invalidate()
+    ratelimit.RATE_LIMIT_ENABLED = False
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def headers():
+    # Account 1 with user profile 1 and two foods of different types
+    from datetime import date, datetime
+
+    from app.database import SessionLocal
+    from app.models import Account, Food, User
+    from app.security import create_access_token
+
+    now = datetime.now()
+    db = SessionLocal()
+    db.add(
+        Account(
+            id=1,
+            nama="Test",
+            username="test",
+            email="test@example.com",
+            password="x",
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    db.add(
+        User(
+            id=1,
+            account_id=1,
+            nama="Test",
+            email="test@example.com",
+            birthdate=date(1990, 1, 1),
+            gender="Male",
+            tinggi_badan=170,
+            berat_badan=70,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    db.add(
+        Food(
+            id=1,
+            name="Nasi",
+            type="karbohidrat",
+            jumlah_kalori=200,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    db.add(
+        Food(
+            id=2,
+            name="Tempe",
+            type="protein",
+            jumlah_kalori=150,
+            created_at=now,
+            updated_at=now,
+        )
+    )
+    db.commit()
+    db.close()
+    token = create_access_token({"sub": "test", "aid": 1, "uid": 1})
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,19 @@
+from app.food_import import read_csv, validate
+
+
+def test_non_ascii_digits_are_row_errors():
+    data = (
+        "name,type,jumlah_kalori\n"
+        "Nasi,karbohidrat,200\n"
+        "Tempe,protein,2²\n"
+        "Tahu,protein,١٢٠\n"
+    )
+
+    foods, errors, total, duplicates = validate(read_csv(data.encode()))
+
+    assert total == 3
+    assert foods.names.tolist() == ["Nasi"]
+    assert [error["row"] for error in errors] == [2, 3]
+    assert {error["error"] for error in errors} == {
+        "jumlah_kalori must be a non-negative number"
+    }
@@ -0,0 +1,25 @@
+import json
+import os
+
+from app.metrics import Counter, WorkerSnapshots
+
+requests_seen = Counter("test_requests_total", "Requests seen by the test")
+
+
+def test_metrics_of_every_worker_are_served(tmp_path):
+    snapshots = WorkerSnapshots(str(tmp_path))
+    requests_seen.inc(3)
+    other = {"test_requests_total": [["", '{worker="1"}', 5]]}
+    # The parent stands in for a live worker; the other pid is not running
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(other))
+    (tmp_path / "4194305.json").write_text(json.dumps(other))
+
+    body = snapshots.render()
+    assert body.count("# TYPE test_requests_total counter") == 1
+    assert f'test_requests_total{{worker="{os.getpid()}"}} 3' in body
+    assert 'test_requests_total{worker="1"} 5' in body
+    assert body.count('worker="1"') == 1
+    assert not (tmp_path / "4194305.json").exists()
+
+    snapshots.stop()
+    assert not (tmp_path / f"{os.getpid()}.json").exists()
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _config(url: str) -> Config:
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    return config
+
+
+def test_rollup_migration_backfills_existing_meals(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrate.db'}"
+    config = _config(url)
+    command.upgrade(config, "0001")
+
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO Account (id, nama, username, email, password) "
+                "VALUES (1, 'A', 'a', 'a@example.com', 'x')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO User (id, account_id, nama, email) VALUES (1, 1, 'A', 'a')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO Food (id, name, type, jumlah_kalori) "
+                "VALUES (1, 'Nasi', 'karbohidrat', 200), (2, 'Teh', NULL, 50)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO Calorie (user_id, food_id, jumlah_kalori, created_at, "
+                "deleted_at) VALUES "
+                "(1, 1, 200, '2024-01-01 08:00:00', NULL), "
+                "(1, 1, 200, '2024-01-01 12:00:00', NULL), "
+                "(1, 2, 50, '2024-01-01 15:00:00', NULL), "
+                "(1, 1, 200, '2024-01-01 19:00:00', '2024-01-01 20:00:00'), "
+                "(1, 1, 200, '2024-01-02 08:00:00', NULL)"
+            )
+        )
+
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT day, type, total_kalori, meal_count FROM CalorieRollup "
+                "ORDER BY day, type"
+            )
+        ).all()
+    engine.dispose()
+    assert [tuple(row) for row in rows] == [
+        ("2024-01-01", "", 50, 1),
+        ("2024-01-01", "karbohidrat", 400, 2),
+        ("2024-01-02", "karbohidrat", 200, 1),
+    ]
+
+
+def test_hot_queries_use_indexes():
+    # Runs the routes against a migrated database and fails on any full table
+    # scan; in a subprocess, since it swaps the app's engine
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.check_query_plans"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
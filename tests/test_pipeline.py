@@ -0,0 +1,75 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from app import pipeline as pipeline_module
+from app.pipeline import (
+    JOB_FAILED,
+    IngestError,
+    IngestionPipeline,
+    IngestJob,
+    process_ingest_job,
+)
+from app.prediction import prediction_client
+from app.ratelimit import ConcurrencyLimit
+
+
+def _job() -> IngestJob:
+    # Already uploaded, so the job goes straight to inference
+    job = IngestJob(1, "", None, b"")
+    job.image_url = "http://storage.test/meal.webp"
+    return job
+
+
+def test_prediction_failure_in_process_pool(monkeypatch):
+    # Nothing listens there, so every prediction fails with a 503
+    monkeypatch.setattr(prediction_client, "base_url", "http://127.0.0.1:9")
+    pipeline = IngestionPipeline(workers=1, executor=ProcessPoolExecutor(max_workers=1))
+
+    async def run():
+        await pipeline.start()
+        jobs = [pipeline.submit(_job()) for _ in range(3)]
+        await pipeline.stop()
+        return jobs
+
+    # The pool survives the first failure and reports the same error for
+    # every job, instead of BrokenProcessPool
+    for job in asyncio.run(run()):
+        assert job.status == JOB_FAILED
+        assert job.error.startswith("Inference service unavailable")
+
+
+def test_prediction_in_forked_worker_after_parent_prediction(monkeypatch):
+    monkeypatch.setattr(prediction_client, "base_url", "http://127.0.0.1:9")
+    # Starts the batcher thread in this process
+    with pytest.raises(HTTPException):
+        prediction_client.predict("http://storage.test/meal.webp")
+
+    # The forked worker must start its own batcher instead of waiting on the
+    # parent's, which it did not inherit
+    fork = multiprocessing.get_context("fork")
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=fork)
+    try:
+        future = executor.submit(
+            process_ingest_job, 1, "", None, b"", image_url="http://storage.test/x"
+        )
+        with pytest.raises(IngestError, match="Inference service unavailable"):
+            future.result(timeout=30)
+    finally:
+        # A worker stuck on the inherited batcher would never exit on its own
+        for process in list(executor._processes.values()):
+            process.terminate()
+        executor.shutdown(wait=True)
+
+
+def test_job_fails_when_the_stage_stays_full(monkeypatch):
+    stage = ConcurrencyLimit("inference", 1)
+    monkeypatch.setattr(pipeline_module, "inference_stage", stage)
+    monkeypatch.setattr(pipeline_module, "INGEST_STAGE_TIMEOUT", 0.1)
+
+    with stage.slot():
+        with pytest.raises(IngestError, match="Too many requests in inference"):
+            process_ingest_job(1, "", None, b"", image_url="http://storage.test/x")
@@ -0,0 +1,89 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app import ratelimit, routes
+from app.ratelimit import (
+    ConcurrencyLimit,
+    MemoryRateLimitBackend,
+    client_key,
+    login_rate_limit,
+    parse_budget,
+)
+from app.security import create_access_token
+from tests.test_routes import _image
+
+
+def _request(authorization: str = "", host: str = "203.0.113.7") -> Request:
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    return Request({"type": "http", "headers": headers, "client": (host, 1234)})
+
+
+def test_parse_budget():
+    assert parse_budget("10/60") == (10, 10 / 60)
+    assert parse_budget("") is None
+    assert parse_budget("0/60") is None
+
+
+def test_token_bucket_bursts_then_waits():
+    backend = MemoryRateLimitBackend()
+    assert backend.take("a", 2, 1) == 0
+    assert backend.take("a", 2, 1) == 0
+    assert 0.9 < backend.take("a", 2, 1) <= 1
+    # Buckets are per key
+    assert backend.take("b", 2, 1) == 0
+
+
+def test_token_bucket_evicts_least_recently_used():
+    backend = MemoryRateLimitBackend(maxsize=1)
+    backend.take("a", 1, 1)
+    backend.take("b", 1, 1)
+    # An evicted bucket starts full again
+    assert backend.take("a", 1, 1) == 0
+
+
+def test_client_key_prefers_the_account():
+    token = create_access_token({"sub": "test", "aid": 7})
+    assert client_key(_request(f"Bearer {token}")) == "account:7"
+    assert client_key(_request("Bearer not-a-token")) == "ip:203.0.113.7"
+    assert client_key(_request()) == "ip:203.0.113.7"
+
+
+def test_concurrency_limit_sheds_when_full():
+    stage = ConcurrencyLimit("upload", 1)
+    with stage.slot():
+        with pytest.raises(HTTPException) as error:
+            with stage.slot(timeout=0.01):
+                pass
+    assert error.value.status_code == 503
+    # The slot is free again once released
+    with stage.slot(timeout=0.01):
+        pass
+
+
+def test_login_is_rate_limited(client, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(login_rate_limit, "budget", (2, 0.01))
+    monkeypatch.setattr(login_rate_limit, "backend", MemoryRateLimitBackend())
+
+    params = {"username": "nobody", "password": "x"}
+    # Unknown users are counted too
+    assert client.post("/login", params=params).status_code == 404
+    assert client.post("/login", params=params).status_code == 404
+    response = client.post("/login", params=params)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_full_upload_stage_returns_503(client, headers, monkeypatch):
+    stage = ConcurrencyLimit("upload", 1)
+    monkeypatch.setattr(routes, "upload_stage", stage)
+
+    with stage.slot():
+        response = client.post(
+            "/calories",
+            files={"image": ("meal.jpg", _image(), "image/jpeg")},
+            headers=headers,
+        )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
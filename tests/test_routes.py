@@ -0,0 +1,330 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import database, routes
+from app.catalog import food_catalog
+from app.database import SessionLocal, get_engine
+from app.idempotency import fingerprint, idempotency_store
+from app.models import Calorie, CalorieRollup, Food
+from app.security import principal_cache
+from app.summary_cache import summary_cache
+
+
+def _add_meals(*meals):
+    # (food_id, jumlah_kalori, deleted) tuples, all today
+    now = datetime.now().replace(microsecond=0)
+    db = SessionLocal()
+    for food_id, kalori, deleted in meals:
+        db.add(
+            Calorie(
+                user_id=1,
+                food_id=food_id,
+                jumlah_kalori=kalori,
+                created_at=now,
+                updated_at=now,
+                deleted_at=now if deleted else None,
+            )
+        )
+    db.commit()
+    db.close()
+
+
+def _record_meal(client, headers, key: str) -> int:
+    # A meal of food 1 now, through the bulk endpoint so the rollup and the
+    # summary cache see it
+    response = client.post(
+        "/calories/bulk",
+        json={
+            "entries": [
+                {
+                    "idempotency_key": key,
+                    "food_id": 1,
+                    "consumed_at": datetime.now().replace(microsecond=0).isoformat(),
+                }
+            ]
+        },
+        headers=headers,
+    )
+    return response.json()["results"][0]["calorie_id"]
+
+
+def test_foods_daily_totals_by_type(client, headers):
+    _add_meals((1, 200, False), (1, 200, False), (2, 150, False), (2, 150, True))
+
+    response = client.get(
+        "/foods/daily", params={"date": datetime.now().date()}, headers=headers
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [food["food_id"] for food in body["food_details"]] == [1, 1, 2]
+    assert body["total_by_type"] == {"karbohidrat": 400, "protein": 150}
+
+
+def test_delete_after_food_type_change_decrements_original_rollup(client, headers):
+    calorie_id = _record_meal(client, headers, "meal-1")
+
+    # The catalog import moves the food to another type
+    db = SessionLocal()
+    db.query(Food).filter(Food.id == 1).update({Food.type: "protein"})
+    db.commit()
+    food_catalog.invalidate()
+
+    response = client.delete(f"/calories/{calorie_id}", headers=headers)
+    assert response.status_code == 200
+
+    rollup = {
+        row.type: (row.total_kalori, row.meal_count)
+        for row in db.query(CalorieRollup).filter(CalorieRollup.user_id == 1)
+    }
+    db.close()
+    assert rollup == {"karbohidrat": (0, 0)}
+
+
+def test_summary_etag_from_before_a_write_stays_stale_after_expiry(client, headers):
+    params = {"date": datetime.now().date().isoformat()}
+    first = client.get("/calories/summary-day", params=params, headers=headers)
+    old_etag = first.headers["ETag"]
+    assert first.json()["total_kalori_masuk"] == 0
+
+    _record_meal(client, headers, "meal-1")
+    assert client.get("/calories/summary-day", params=params, headers=headers).headers[
+        "ETag"
+    ] not in (old_etag, None)
+
+    # Every cached entry and generation token runs out
+    summary_cache.entries.clear()
+    summary_cache.generations.clear()
+
+    response = client.get(
+        "/calories/summary-day",
+        params=params,
+        headers={**headers, "If-None-Match": old_etag},
+    )
+    assert response.status_code == 200
+    assert response.json()["total_kalori_masuk"] == 200
+
+
+def _image(color=(200, 120, 40)) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_idempotent_record_releases_connection_before_inference(
+    client, headers, monkeypatch
+):
+    checked_out = []
+
+    def predict(image_url):
+        checked_out.append(get_engine().pool.checkedout())
+        return 1
+
+    monkeypatch.setattr(routes, "predict_food_id", predict)
+    response = client.post(
+        "/calories",
+        files={"image": ("meal.jpg", _image(), "image/jpeg")},
+        headers={**headers, "Idempotency-Key": "upload-1"},
+    )
+
+    assert response.status_code == 200
+    assert checked_out == [0]
+
+
+def test_register_and_login(client):
+    account = {
+        "nama": "New",
+        "username": "new",
+        "email": "new@example.com",
+        "password": "secret",
+    }
+    assert client.post("/register", json=account).status_code == 200
+
+    response = client.post("/login", params={"username": "new", "password": "secret"})
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+    assert (
+        client.post("/login", params={"username": "new", "password": "x"}).status_code
+        == 401
+    )
+
+
+def test_principal_cache_holds_json_values(client, headers):
+    # So that CACHE_BACKEND=redis can share it between workers
+    assert client.get("/foods", headers=headers).status_code == 200
+    cached = principal_cache.get("1")
+    assert json.loads(json.dumps(cached)) == cached
+    assert client.get("/foods", headers=headers).status_code == 200
+
+
+def test_export_pages_through_the_whole_history(client, headers, monkeypatch):
+    # Meals sharing a timestamp across page boundaries, ordered by id
+    monkeypatch.setattr(routes, "EXPORT_CHUNK_ROWS", 2)
+    _add_meals(*[(1, 100 + index, index == 2) for index in range(6)])
+
+    response = client.get("/calories/export?format=ndjson", headers=headers)
+    assert response.status_code == 200
+    meals = [json.loads(line) for line in response.text.splitlines()]
+    assert [meal["jumlah_kalori"] for meal in meals] == [100, 101, 103, 104, 105]
+
+    response = client.get("/calories/export", headers=headers)
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,")
+    assert len(lines) == 6
+
+
+def test_foods_ndjson_pages_through_the_catalog(client, headers, monkeypatch):
+    monkeypatch.setattr(routes, "FOODS_CHUNK_ROWS", 1)
+
+    response = client.get("/foods?format=ndjson&fields=name", headers=headers)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    foods = [json.loads(line) for line in response.text.splitlines()]
+    assert foods == [{"id": 1, "name": "Nasi"}, {"id": 2, "name": "Tempe"}]
+
+    response = client.get("/foods?format=ndjson&limit=1", headers=headers)
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [1]
+
+    content = client.get("/openapi.json").json()["paths"]["/foods"]["get"]
+    assert "application/x-ndjson" in content["responses"]["200"]["content"]
+
+
+def test_foods_of_unknown_type_are_not_cached(client, headers):
+    # Loaded before the headers fixture added the foods
+    food_catalog.invalidate()
+    for type in ("nope-1", "nope-2"):
+        response = client.get(f"/foods?type={type}", headers=headers)
+        assert response.json() == {"foods": []}
+    response = client.get("/foods?type=protein", headers=headers)
+    assert [food["name"] for food in response.json()["foods"]] == ["Tempe"]
+    assert set(food_catalog._serialized) == {"protein"}
+
+
+@pytest.mark.parametrize("driver", [None, "aiosqlite"])
+def test_meal_history_page(monkeypatch, driver, client, headers):
+    # Listed before client, so the async engine is disposed at its shutdown
+    # before it is unset again
+    if driver:
+        pytest.importorskip(driver)
+    monkeypatch.setattr(database, "ASYNC_DRIVER", driver)
+    monkeypatch.setattr(database, "async_engine", None)
+    monkeypatch.setattr(database, "AsyncSessionLocal", None)
+    _add_meals((1, 200, False), (2, 150, False), (1, 100, True))
+
+    response = client.get("/calories?limit=1", headers=headers)
+    page = response.json()
+    assert [meal["name"] for meal in page["meals"]] == ["Nasi"]
+    response = client.get(
+        "/calories", params={"cursor": page["next_cursor"]}, headers=headers
+    )
+    assert [meal["name"] for meal in response.json()["meals"]] == ["Tempe"]
+    assert response.json()["next_cursor"] is None
+    assert (database.async_engine is not None) == bool(driver)
+
+
+def test_principal_from_token_skips_the_user_lookup(client, headers):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(get_engine(), "before_cursor_execute", record)
+    try:
+        assert client.get("/calories", headers=headers).status_code == 200
+    finally:
+        event.remove(get_engine(), "before_cursor_execute", record)
+    principal_query = [sql for sql in statements if 'FROM "Account"' in sql]
+    assert principal_query and "User" not in principal_query[0]
+    assert principal_cache.get("1")[4] == 1
+
+
+def _post_meal(client, headers, key: str, image: bytes):
+    return client.post(
+        "/calories",
+        files={"image": ("meal.jpg", image, "image/jpeg")},
+        headers={**headers, "Idempotency-Key": key},
+    )
+
+
+def test_idempotent_record_replays_the_first_response(client, headers, monkeypatch):
+    predictions = []
+
+    def predict(image_url):
+        predictions.append(image_url)
+        return 1
+
+    monkeypatch.setattr(routes, "predict_food_id", predict)
+    image = _image()
+
+    first = _post_meal(client, headers, "meal-1", image)
+    second = _post_meal(client, headers, "meal-1", image)
+
+    assert first.status_code == second.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert len(predictions) == 1
+    db = SessionLocal()
+    assert db.query(Calorie).count() == 1
+    db.close()
+
+
+def test_idempotent_record_in_progress_conflicts(client, headers):
+    image = _image()
+    # The same request is still running elsewhere
+    idempotency_store.begin(1, "calories", "meal-1", fingerprint(image))
+
+    response = _post_meal(client, headers, "meal-1", image)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_idempotency_key_reused_for_another_image(client, headers, monkeypatch):
+    monkeypatch.setattr(routes, "predict_food_id", lambda url: 1)
+    assert _post_meal(client, headers, "meal-1", _image()).status_code == 200
+
+    response = _post_meal(client, headers, "meal-1", _image((10, 200, 90)))
+    assert response.status_code == 422
+    assert "different request" in response.json()["detail"]
+
+
+def test_bulk_record_reports_created_duplicate_and_rejected(client, headers):
+    earlier = _record_meal(client, headers, "queued-1")
+    now = datetime.now().replace(microsecond=0)
+    entries = [
+        {"idempotency_key": "queued-1", "food_id": 1},
+        {"idempotency_key": "queued-2", "food_id": 2},
+        {"idempotency_key": "queued-2", "food_id": 2},
+        {"idempotency_key": "queued-3", "food_id": 99},
+        {"idempotency_key": "queued-4", "food_id": 1, "future": True},
+    ]
+    for entry in entries:
+        consumed_at = now + timedelta(days=1) if entry.pop("future", False) else now
+        entry["consumed_at"] = consumed_at.isoformat()
+
+    response = client.post("/calories/bulk", json={"entries": entries}, headers=headers)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [
+        "duplicate",
+        "created",
+        "created",
+        "rejected",
+        "rejected",
+    ]
+    assert results[0]["calorie_id"] == earlier
+    assert results[1]["calorie_id"] == results[2]["calorie_id"]
+    assert results[3]["error"] == "Food not found"
+    assert results[4]["error"] == "consumed_at is in the future"
+
+    db = SessionLocal()
+    assert db.query(Calorie).count() == 2
+    rollup = db.query(CalorieRollup).filter(CalorieRollup.type == "protein").one()
+    assert (rollup.total_kalori, rollup.meal_count) == (150, 1)
+    db.close()
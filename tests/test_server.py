@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from app import server
+
+
+@pytest.fixture
+def run(monkeypatch):
+    # Records the worker count main() would start uvicorn with
+    calls = []
+    monkeypatch.setattr(server.uvicorn, "run", lambda app, **kw: calls.append(kw))
+    monkeypatch.setattr(server, "available_cpus", lambda: 4)
+    monkeypatch.setenv("IMAGE_WORKERS", "1")
+    monkeypatch.setenv("PASSWORD_WORKERS", "1")
+    # Restored afterwards; main() sets both
+    monkeypatch.setenv("INGEST_DRAIN_TIMEOUT", "")
+    monkeypatch.setenv("METRICS_DIR", "")
+
+    def run(*argv):
+        server.main(list(argv))
+        return calls[-1]["workers"]
+
+    run.calls = calls
+
+    return run
+
+
+def use_backend(monkeypatch, backend):
+    monkeypatch.setattr(server, "CACHE_BACKEND", backend)
+    monkeypatch.setattr(server, "RATE_LIMIT_BACKEND", backend)
+
+
+def test_memory_caches_default_to_one_worker(run, monkeypatch):
+    use_backend(monkeypatch, "memory")
+    assert run() == 1
+
+
+def test_memory_caches_refuse_several_workers(run, monkeypatch):
+    use_backend(monkeypatch, "memory")
+    with pytest.raises(SystemExit):
+        run("--workers", "2")
+    assert run("--workers", "2", "--allow-process-caches") == 2
+
+
+def test_memory_rate_limits_refuse_several_workers(run, monkeypatch):
+    use_backend(monkeypatch, "redis")
+    monkeypatch.setattr(server, "RATE_LIMIT_BACKEND", "memory")
+    with pytest.raises(SystemExit):
+        run("--workers", "2")
+
+
+def test_redis_backends_default_to_one_worker_per_cpu(run, monkeypatch):
+    use_backend(monkeypatch, "redis")
+    assert run() == 4
+    assert run("--workers", "2") == 2
+
+
+def test_shutdown_fits_one_budget(run, monkeypatch):
+    use_backend(monkeypatch, "memory")
+    assert server.shutdown_timeouts(9, 4) == (4, 5)
+    assert server.shutdown_timeouts(9, 20) == (9, 0)
+
+    monkeypatch.setattr(server, "SHUTDOWN_TIMEOUT", 9.0)
+    monkeypatch.setattr(server, "GRACEFUL_SHUTDOWN_TIMEOUT", 6.0)
+    run()
+    graceful = run.calls[-1]["timeout_graceful_shutdown"]
+    drain = float(os.environ["INGEST_DRAIN_TIMEOUT"])
+    assert (graceful, drain) == (6.0, 3.0)
@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+
+# Loaded on first use, not when the app is imported
+DEFERRED = ("passlib", "bcrypt", "numpy", "PIL", "pyarrow", "google.cloud.storage")
+
+
+def test_app_import_defers_heavy_modules():
+    # A fresh interpreter, so modules loaded by other tests do not count
+    code = (
+        "import json, sys\n"
+        "import app.main\n"
+        f"print(json.dumps([name for name in {DEFERRED!r} if name in sys.modules]))\n"
+        "print(json.dumps('cryptography' in sys.modules))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=dict(os.environ, STARTUP_WARMUP=""),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+    loaded, cryptography = json.loads(output[-2]), json.loads(output[-1])
+
+    # PyJWT uses the cryptography package when it is installed, and that
+    # imports bcrypt for SSH keys on its own
+    if cryptography:
+        loaded = [name for name in loaded if name != "bcrypt"]
+    assert loaded == []